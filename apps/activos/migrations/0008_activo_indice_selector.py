@@ -0,0 +1,17 @@
+# Generated by Django 5.0.14 on 2026-10-19 05:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activos', '0007_alter_activo_estado'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activo',
+            index=models.Index(fields=['estado', 'ubicacion', 'kit', 'codigo'], name='activo_estado_ubic_kit_idx'),
+        ),
+    ]
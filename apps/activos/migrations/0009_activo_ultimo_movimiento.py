@@ -0,0 +1,43 @@
+# Generated by Django 5.0.14 on 2026-10-19 05:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def poblar_ultimo_movimiento(apps, schema_editor):
+    """Último movimiento confirmado de cada activo (o su ingreso de origen), en un solo UPDATE."""
+    Activo = apps.get_model('activos', 'Activo')
+    DetalleMovimiento = apps.get_model('logistica', 'DetalleMovimiento')
+    Movimiento = apps.get_model('logistica', 'Movimiento')
+
+    ultimo = DetalleMovimiento.objects.filter(
+        activo=OuterRef('pk'), movimiento__estado='CONFIRMADO'
+    ).order_by('-movimiento__fecha').values('movimiento_id')[:1]
+    Activo.objects.update(ultimo_movimiento_id=Coalesce(Subquery(ultimo), F('ingreso_origen_id')))
+
+    fecha = Movimiento.objects.filter(pk=OuterRef('ultimo_movimiento_id')).values('fecha')[:1]
+    Activo.objects.filter(ultimo_movimiento__isnull=False).update(fecha_ultimo_movimiento=Subquery(fecha))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activos', '0008_activo_indice_selector'),
+        ('logistica', '0021_movimiento_indice_transacciones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activo',
+            name='fecha_ultimo_movimiento',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='activo',
+            name='ultimo_movimiento',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='logistica.movimiento'),
+        ),
+        migrations.RunPython(poblar_ultimo_movimiento, migrations.RunPython.noop),
+    ]
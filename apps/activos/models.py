@@ -92,12 +92,28 @@ class Activo(models.Model):
         help_text="Enlace al catálogo para control de stock"
     )
 
+    # Último movimiento confirmado del activo (lo mantiene KardexService).
+    # Listados y reportes lo leen con select_related en vez de buscarlo en DetalleMovimiento.
+    ultimo_movimiento = models.ForeignKey(
+        'logistica.Movimiento',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='+'
+    )
+    fecha_ultimo_movimiento = models.DateTimeField(null=True, blank=True, editable=False)
+
     def __str__(self):
         return f"{self.codigo} - {self.nombre}"
 
     class Meta:
         verbose_name = "Activo Fijo"
         verbose_name_plural = "Activos Fijos"
+        indexes = [
+            # Selector de activos (api_listar_activos): filtra por estado/ubicación/kit y pagina por código
+            models.Index(fields=['estado', 'ubicacion', 'kit', 'codigo'], name='activo_estado_ubic_kit_idx'),
+        ]
 
 class AsignacionActivo(models.Model):
     """
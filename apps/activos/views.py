@@ -8,13 +8,11 @@ from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
 from django.core.exceptions import ValidationError
-from django.http import HttpResponse # <--- Importar
-import openpyxl # <--- Importar
-from openpyxl.styles import Font, Alignment, PatternFill # <--- Importar
 from .models import Activo, AsignacionActivo, Kit
 from .forms import ActivoForm, AsignacionForm, DevolucionForm, KitForm, AsignarKitForm
 from apps.logistica.models import Movimiento, DetalleMovimiento, Almacen
 from apps.logistica.services import KardexService
+from apps.core.exportacion import LibroExcel, TAMANO_LOTE, AZUL
 
 class ActivoListView(LoginRequiredMixin, ListView):
     model = Activo
@@ -25,7 +23,7 @@ class ActivoListView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         # Optimizamos con select_related para traer la ubicación en una sola consulta
-        queryset = super().get_queryset().select_related('ubicacion', 'trabajador_asignado')
+        queryset = super().get_queryset().select_related('ubicacion', 'trabajador_asignado', 'ultimo_movimiento')
         q = self.request.GET.get('q')
         estado = self.request.GET.get('estado')
         ubicacion = self.request.GET.get('ubicacion') # Nuevo filtro
@@ -80,6 +78,7 @@ class ActivoDetailView(LoginRequiredMixin, DetailView):
     model = Activo
     template_name = 'activos/activo_detail.html'
     context_object_name = 'activo'
+    queryset = Activo.objects.select_related('kit', 'trabajador_asignado', 'ultimo_movimiento__creado_por')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -355,51 +354,25 @@ def administrar_kit(request, pk):
 def exportar_activos_excel(request):
     """
     Genera el Reporte Maestro de Activos Fijos (Sábana de Equipos).
+    Se escribe en streaming (LibroExcel) leyendo solo las columnas necesarias.
     """
-    # Obtenemos todos los activos con sus relaciones clave
-    activos = Activo.objects.select_related('ubicacion', 'trabajador_asignado', 'material').order_by('codigo')
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Maestro de Activos"
-
-    # Encabezados
-    headers = ["Código", "Serie", "Descripción", "Marca", "Modelo", "Estado", "Ubicación Actual", "Trabajador Asignado", "Valor Compra"]
-    ws.append(headers)
-
-    # Estilo Encabezado
-    for cell in ws[1]:
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color="2980B9", end_color="2980B9", fill_type="solid")
-        cell.alignment = Alignment(horizontal="center")
-
-    for activo in activos:
-        ubicacion_str = "-"
-        if activo.ubicacion:
-            ubicacion_str = activo.ubicacion.nombre
-        
-        trabajador_str = "-"
-        if activo.trabajador_asignado:
-            trabajador_str = f"{activo.trabajador_asignado.nombres} {activo.trabajador_asignado.apellidos}"
-
-        ws.append([
-            activo.codigo,
-            activo.serie,
-            activo.nombre,
-            activo.marca,
-            activo.modelo,
-            activo.get_estado_display(),
-            ubicacion_str,
-            trabajador_str,
-            activo.valor_compra
-        ])
-
-    # Ajuste de anchos
-    ws.column_dimensions['C'].width = 40 # Nombre
-    ws.column_dimensions['G'].width = 25 # Ubicación
-    ws.column_dimensions['H'].width = 30 # Trabajador
-
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename="Maestro_Activos_{timezone.now().strftime("%Y%m%d")}.xlsx"'
-    wb.save(response)
-    return response
+    activos = Activo.objects.order_by('codigo').values_list(
+        'codigo', 'serie', 'nombre', 'marca', 'modelo', 'estado', 'ubicacion__nombre',
+        'trabajador_asignado__nombres', 'trabajador_asignado__apellidos', 'valor_compra'
+    ).iterator(chunk_size=TAMANO_LOTE)
+    estados = dict(Activo._meta.get_field('estado').choices)
+
+    def generar():
+        for codigo, serie, nombre, marca, modelo, estado, ubicacion, nombres, apellidos, valor in activos:
+            trabajador = f"{nombres} {apellidos}" if nombres is not None else "-"
+            yield [codigo, serie, nombre, marca, modelo, estados.get(estado, estado), ubicacion or "-", trabajador, valor]
+
+    libro = LibroExcel()
+    libro.hoja(
+        "Maestro de Activos",
+        ["Código", "Serie", "Descripción", "Marca", "Modelo", "Estado", "Ubicación Actual", "Trabajador Asignado", "Valor Compra"],
+        generar(),
+        color=AZUL,
+        anchos={'C': 40, 'G': 25, 'H': 30}  # Nombre, Ubicación, Trabajador
+    )
+    return libro.respuesta(f"Maestro_Activos_{timezone.now().strftime('%Y%m%d')}.xlsx")
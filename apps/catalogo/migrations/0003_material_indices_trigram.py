@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+def crear_indices(apps, schema_editor):
+    """
+    Índices trigram (pg_trgm) para las búsquedas `icontains` sobre Material.
+    Django traduce `icontains` a UPPER(columna) LIKE UPPER('%texto%'), por eso el
+    índice es sobre UPPER(...). Solo aplica en PostgreSQL (SQLite de desarrollo lo omite).
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS catalogo_material_codigo_trgm "
+        "ON catalogo_material USING gin (UPPER(codigo) gin_trgm_ops)"
+    )
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS catalogo_material_descripcion_trgm "
+        "ON catalogo_material USING gin (UPPER(descripcion) gin_trgm_ops)"
+    )
+
+
+def eliminar_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS catalogo_material_codigo_trgm")
+    schema_editor.execute("DROP INDEX IF EXISTS catalogo_material_descripcion_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0002_proveedor'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices, eliminar_indices),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+def crear_indice(apps, schema_editor):
+    """
+    Índice B-tree para el buscador de materiales (prefijo de código).
+    Django traduce `istartswith` a UPPER(codigo) LIKE UPPER('texto%'); con `text_pattern_ops`
+    PostgreSQL lo resuelve como un rango del índice (independiente de la collation).
+    El índice parcial cubre solo los materiales activos, que son los que se ofrecen.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS catalogo_material_codigo_prefijo "
+        "ON catalogo_material (UPPER(codigo) text_pattern_ops) WHERE activo"
+    )
+
+
+def eliminar_indice(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS catalogo_material_codigo_prefijo")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0003_material_indices_trigram'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, eliminar_indice),
+    ]
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.core'
+
+    def ready(self):
+        from .busqueda import conectar_senales
+
+        # Índice de la búsqueda global (materiales, activos, trabajadores, vales, requerimientos)
+        conectar_senales()
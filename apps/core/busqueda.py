@@ -0,0 +1,228 @@
+"""
+BÚSQUEDA GLOBAL (Índice invertido).
+
+Cada material, activo, trabajador, vale y requerimiento se guarda como un DocumentoBusqueda
+con sus tokens normalizados (sin tildes, mayúsculas) en TerminoBusqueda. Las señales
+post_save/post_delete lo mantienen al día; `manage.py reindexar_busqueda` lo reconstruye.
+
+Búsqueda: cada palabra escrita debe ser prefijo de algún token del documento.
+Ej: "NI-00123", "00123", "taladro bosch", "4567" (DNI o serie), "jose".
+"""
+import hashlib
+import re
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, F, Window
+from django.db.models.functions import RowNumber
+from django.db.models.signals import post_save, post_delete
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from apps.rrhh.models import normalizar_texto
+
+MAX_TOKEN = 60
+SEPARADORES = re.compile(r'[-/._#]+')
+PUNTUACION = '.,;:()[]{}"\'¿?¡!'
+
+
+def tokenizar(*textos):
+    """
+    Tokens normalizados de los textos. Los códigos compuestos se indexan completos y por partes:
+    'NI-00123' -> {'NI-00123', 'NI', '00123'}.
+    """
+    tokens = set()
+    for texto in textos:
+        for palabra in normalizar_texto(str(texto or '')).split():
+            palabra = palabra.strip(PUNTUACION)
+            if not palabra:
+                continue
+            tokens.add(palabra[:MAX_TOKEN])
+            for parte in SEPARADORES.split(palabra):
+                if parte:
+                    tokens.add(parte[:MAX_TOKEN])
+    return tokens
+
+
+# ==========================================
+# ENTIDADES INDEXADAS
+# ==========================================
+# Cada descriptor devuelve (titulo, detalle, enlace, textos a indexar, almacenes que lo pueden ver)
+
+def _fecha(valor):
+    if isinstance(valor, datetime):
+        valor = timezone.localtime(valor) if timezone.is_aware(valor) else valor
+    return valor.strftime('%d/%m/%Y') if hasattr(valor, 'strftime') else str(valor or '')
+
+
+def _material(m):
+    return (
+        f"{m.codigo} - {m.descripcion}",
+        f"{m.get_tipo_display()} · {m.unidad_medida}",
+        f"{reverse('inventario_list')}?{urlencode({'q': m.codigo})}",
+        [m.codigo, m.descripcion],
+        [],
+    )
+
+
+def _activo(a):
+    return (
+        f"{a.codigo} - {a.nombre}",
+        f"Serie: {a.serie or '-'} · {a.get_estado_display()}",
+        reverse('activo_detail', args=[a.pk]),
+        [a.codigo, a.serie, a.nombre, a.marca, a.modelo],
+        [a.ubicacion_id],
+    )
+
+
+def _trabajador(t):
+    return (
+        f"{t.nombres} {t.apellidos}",
+        f"DNI {t.dni}{' · ' + t.cargo if t.cargo else ''}",
+        reverse('trabajador_detail', args=[t.pk]),
+        [t.dni, t.nombres, t.apellidos],
+        [],
+    )
+
+
+def _movimiento(m):
+    return (
+        f"{m.nota_ingreso or 'BORRADOR'} · {m.get_tipo_display()}",
+        f"Doc: {m.documento_referencia or '-'} · {m.get_estado_display()} · {_fecha(m.fecha)}",
+        reverse('generar_vale_pdf', args=[m.pk]),
+        [m.nota_ingreso, m.documento_referencia],
+        [m.almacen_origen_id, m.almacen_destino_id],
+    )
+
+
+def _requerimiento(r):
+    # El requerimiento es del proyecto: lo ven los usuarios de cualquiera de sus almacenes
+    return (
+        f"{r.codigo} - {r.solicitante}",
+        f"{r.get_estado_display()} · {_fecha(r.fecha_solicitud)}",
+        reverse('requerimiento_detail', args=[r.pk]),
+        [r.codigo, r.solicitante],
+        r.proyecto.almacenes.values_list('id', flat=True),
+    )
+
+
+def entidades():
+    """{tipo: (Modelo, descriptor)}. Import diferido: core se carga antes que las demás apps."""
+    from apps.catalogo.models import Material
+    from apps.activos.models import Activo
+    from apps.rrhh.models import Trabajador
+    from apps.logistica.models import Movimiento, Requerimiento
+
+    return {
+        'MATERIAL': (Material, _material),
+        'ACTIVO': (Activo, _activo),
+        'TRABAJADOR': (Trabajador, _trabajador),
+        'MOVIMIENTO': (Movimiento, _movimiento),
+        'REQUERIMIENTO': (Requerimiento, _requerimiento),
+    }
+
+
+def _tipo_de(instancia):
+    for tipo, (modelo, descriptor) in entidades().items():
+        if isinstance(instancia, modelo):
+            return tipo, descriptor
+    return None, None
+
+
+# ==========================================
+# MANTENIMIENTO DEL ÍNDICE
+# ==========================================
+
+def indexar(instancia):
+    """Crea o actualiza el documento de la instancia. No escribe nada si el contenido no cambió."""
+    from .models import DocumentoBusqueda, TerminoBusqueda
+
+    tipo, descriptor = _tipo_de(instancia)
+    if tipo is None:
+        return
+    titulo, detalle, enlace, textos, almacenes = descriptor(instancia)
+    tokens = tokenizar(*textos)
+    almacenes = sorted({str(a) for a in almacenes if a})
+    firma = hashlib.md5('|'.join([titulo, detalle, enlace, *sorted(tokens), *(f'@{a}' for a in almacenes)]).encode('utf-8')).hexdigest()
+
+    objeto_id = str(instancia.pk)
+    if DocumentoBusqueda.objects.filter(tipo=tipo, objeto_id=objeto_id, firma=firma).exists():
+        return
+
+    with transaction.atomic():
+        documento, _ = DocumentoBusqueda.objects.update_or_create(
+            tipo=tipo, objeto_id=objeto_id,
+            defaults={'titulo': titulo[:255], 'detalle': detalle[:255], 'enlace': enlace[:255], 'firma': firma}
+        )
+        documento.terminos.all().delete()
+        TerminoBusqueda.objects.bulk_create([TerminoBusqueda(token=t, documento=documento) for t in tokens])
+        documento.almacenes.set(almacenes)
+
+
+def desindexar(instancia):
+    from .models import DocumentoBusqueda
+
+    tipo, _ = _tipo_de(instancia)
+    if tipo:
+        DocumentoBusqueda.objects.filter(tipo=tipo, objeto_id=str(instancia.pk)).delete()
+
+
+def _al_guardar(sender, instance, raw=False, **kwargs):
+    if not raw:  # loaddata: se reindexa luego con el comando
+        indexar(instance)
+
+
+def _al_eliminar(sender, instance, **kwargs):
+    desindexar(instance)
+
+
+def conectar_senales():
+    for tipo, (modelo, _) in entidades().items():
+        post_save.connect(_al_guardar, sender=modelo, dispatch_uid=f'busqueda_indexar_{tipo}')
+        post_delete.connect(_al_eliminar, sender=modelo, dispatch_uid=f'busqueda_desindexar_{tipo}')
+
+
+# ==========================================
+# CONSULTA
+# ==========================================
+
+def buscar(q, almacenes=None, limite_por_tipo=10):
+    """
+    Devuelve [(tipo, etiqueta, [documentos...]), ...] en el orden de DocumentoBusqueda.TIPOS.
+    Una sola consulta: un EXISTS por palabra sobre el índice de tokens y un ROW_NUMBER por tipo,
+    para que un tipo con muchas coincidencias no deje fuera a los demás.
+    `almacenes`: los permitidos del usuario (request.almacenes_permitidos); None no restringe (administradores).
+    """
+    from .models import DocumentoBusqueda, TerminoBusqueda
+
+    palabras = [p.strip(PUNTUACION)[:MAX_TOKEN] for p in normalizar_texto(q).split()]
+    palabras = [p for p in palabras if p]
+    if not palabras:
+        return []
+
+    qs = DocumentoBusqueda.objects.all()
+    for palabra in palabras:
+        qs = qs.filter(Exists(TerminoBusqueda.objects.filter(documento=OuterRef('pk'), token__startswith=palabra)))
+
+    # Documentos sin almacén (catálogo, trabajadores) o de un almacén permitido
+    if almacenes is not None:
+        relacion = DocumentoBusqueda.almacenes.through.objects
+        qs = qs.filter(
+            ~Exists(relacion.filter(documentobusqueda=OuterRef('pk')))
+            | Exists(relacion.filter(documentobusqueda=OuterRef('pk'), almacen__in=almacenes))
+        )
+
+    # Coincidencias exactas de la primera palabra (ej. DNI o código completo) primero, dentro de cada tipo
+    qs = qs.annotate(
+        exacto=Exists(TerminoBusqueda.objects.filter(documento=OuterRef('pk'), token=palabras[0]))
+    ).annotate(
+        posicion=Window(RowNumber(), partition_by=F('tipo'), order_by=[F('exacto').desc(), F('titulo').asc()])
+    ).filter(posicion__lte=limite_por_tipo).order_by('tipo', 'posicion').only('tipo', 'titulo', 'detalle', 'enlace')
+
+    grupos = {tipo: [] for tipo, _ in DocumentoBusqueda.TIPOS}
+    for documento in qs:
+        grupos[documento.tipo].append(documento)
+
+    etiquetas = dict(DocumentoBusqueda.TIPOS)
+    return [(tipo, etiquetas[tipo], docs) for tipo, docs in grupos.items() if docs]
@@ -0,0 +1,150 @@
+"""
+EXPORTACIÓN A EXCEL EN MEMORIA CONSTANTE.
+
+openpyxl en modo "write_only": cada fila se escribe al disco apenas se agrega (no se arma
+el libro completo en memoria). Las filas llegan de un generador (idealmente un queryset
+`.values_list(...).iterator(chunk_size=...)`), el archivo se arma en un temporal y se
+envía con FileResponse, que lo lee por bloques. La memoria del worker no depende de
+la cantidad de filas.
+
+Uso:
+    libro = LibroExcel()
+    libro.hoja("Inventario", ["Código", "Material"], filas, anchos={'B': 40})
+    return libro.respuesta("Inventario.xlsx")
+
+Para CSV (`?export=csv`) las filas se envían al cliente a medida que salen del cursor
+(StreamingHttpResponse): el primer byte sale de inmediato y nada se acumula en el servidor.
+"""
+import csv
+import tempfile
+from itertools import islice
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill
+from django.http import FileResponse, StreamingHttpResponse
+
+TAMANO_LOTE = 2000
+TIPO_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+FORMATOS = ('excel', 'csv')
+
+# Colores de cabecera usados en los reportes
+AZUL_OSCURO = "2C3E50"
+AZUL = "2980B9"
+ROJO = "C0392B"
+
+
+class FilaDestacada(list):
+    """Fila que se escribe resaltada (títulos de sección, saldos finales). En CSV es una fila más."""
+
+
+def por_lotes(iterable, tamano=TAMANO_LOTE):
+    """Agrupa un iterable en listas de `tamano` elementos (para consultas auxiliares por lote)."""
+    iterador = iter(iterable)
+    while lote := list(islice(iterador, tamano)):
+        yield lote
+
+
+class LibroExcel:
+    """Libro de solo escritura: las hojas se escriben en orden y una sola vez."""
+
+    def __init__(self):
+        self.wb = openpyxl.Workbook(write_only=True)
+
+    def _fila_estilo(self, ws, valores, fuente, relleno=None, alineacion=None):
+        celdas = []
+        for valor in valores:
+            celda = WriteOnlyCell(ws, value=valor)
+            celda.font = fuente
+            if relleno:
+                celda.fill = relleno
+            if alineacion:
+                celda.alignment = alineacion
+            celdas.append(celda)
+        return celdas
+
+    def hoja(self, titulo, encabezados, filas, color=AZUL_OSCURO, anchos=None, preambulo=None,
+             congelar=None, pie=None):
+        """
+        Escribe una hoja completa.
+        - preambulo: filas simples antes de la cabecera (ej. datos del material en el Kardex).
+        - filas: iterable de listas/tuplas; se consume una sola vez. Las FilaDestacada salen en negrita.
+        - pie: filas finales en negrita (totales).
+        """
+        ws = self.wb.create_sheet(title=titulo[:31])
+        for columna, ancho in (anchos or {}).items():
+            ws.column_dimensions[columna].width = ancho
+        if congelar:
+            ws.freeze_panes = congelar
+
+        for fila in preambulo or []:
+            ws.append(fila)
+        ws.append(self._fila_estilo(
+            ws, encabezados,
+            Font(bold=True, color="FFFFFF"),
+            PatternFill(start_color=color, end_color=color, fill_type="solid"),
+            Alignment(horizontal="center", wrap_text=True),
+        ))
+
+        negrita = Font(bold=True)
+        relleno_seccion = PatternFill(start_color="D6EAF8", end_color="D6EAF8", fill_type="solid")
+        for fila in filas:
+            if isinstance(fila, FilaDestacada):
+                ws.append(self._fila_estilo(ws, fila, negrita, relleno_seccion))
+            else:
+                ws.append(fila)
+
+        for fila in pie or []:
+            ws.append(self._fila_estilo(ws, fila, negrita))
+        return ws
+
+    def guardar(self, destino):
+        """Guarda el libro en una ruta o archivo abierto (solo se puede guardar una vez)."""
+        self.wb.save(destino)
+
+    def respuesta(self, nombre_archivo):
+        """Guarda el libro en un temporal (se borra al cerrarse) y lo devuelve como descarga."""
+        temporal = tempfile.TemporaryFile()
+        self.guardar(temporal)
+        temporal.seek(0)
+        return FileResponse(temporal, as_attachment=True, filename=nombre_archivo, content_type=TIPO_XLSX)
+
+
+# ==========================================
+# CSV EN STREAMING
+# ==========================================
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: devuelve la línea en vez de guardarla."""
+
+    def write(self, valor):
+        return valor
+
+
+def respuesta_csv(nombre_archivo, encabezados, filas):
+    """
+    CSV UTF-8 (con BOM, para que Excel respete las tildes) separado por comas.
+    `filas` se consume mientras se envía la respuesta.
+    """
+    escritor = csv.writer(_Eco())
+
+    def lineas():
+        yield '\ufeff' + escritor.writerow(encabezados)
+        for fila in filas:
+            yield escritor.writerow(fila)
+
+    respuesta = StreamingHttpResponse(lineas(), content_type='text/csv; charset=utf-8')
+    respuesta['Content-Disposition'] = f'attachment; filename="{nombre_archivo}"'
+    return respuesta
+
+
+def exportar(formato, nombre_base, titulo, encabezados, filas, **opciones_excel):
+    """
+    Respuesta de descarga en el formato pedido ('excel' o 'csv').
+    `opciones_excel` (colores, anchos, preámbulo, pie...) solo aplican al Excel.
+    """
+    if formato == 'csv':
+        return respuesta_csv(f"{nombre_base}.csv", encabezados, filas)
+    libro = LibroExcel()
+    libro.hoja(titulo, encabezados, filas, **opciones_excel)
+    return libro.respuesta(f"{nombre_base}.xlsx")
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from apps.core.busqueda import entidades, indexar
+from apps.core.models import DocumentoBusqueda
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el índice de la búsqueda global (solo reescribe los documentos que cambiaron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tipo', choices=[t for t, _ in DocumentoBusqueda.TIPOS], help="Reindexar solo un tipo")
+        parser.add_argument('--completo', action='store_true', help="Vaciar el índice antes de reconstruirlo")
+
+    def handle(self, *args, **options):
+        tipos = {t: e for t, e in entidades().items() if not options['tipo'] or t == options['tipo']}
+
+        if options['completo']:
+            DocumentoBusqueda.objects.filter(tipo__in=tipos).delete()
+
+        for tipo, (modelo, _) in tipos.items():
+            vigentes = set()
+            for instancia in modelo.objects.all().iterator(chunk_size=500):
+                indexar(instancia)
+                vigentes.add(str(instancia.pk))
+
+            # Documentos huérfanos (borrados con .update()/.delete() masivos sin señales, o datos importados)
+            huerfanos = [
+                pk for pk, objeto_id in DocumentoBusqueda.objects.filter(tipo=tipo).values_list('pk', 'objeto_id')
+                if objeto_id not in vigentes
+            ]
+            DocumentoBusqueda.objects.filter(pk__in=huerfanos).delete()
+
+            self.stdout.write(self.style.SUCCESS(f"{tipo}: {len(vigentes)} indexados, {len(huerfanos)} huérfanos eliminados"))
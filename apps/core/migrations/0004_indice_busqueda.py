@@ -0,0 +1,45 @@
+# Generated by Django 5.0.14 on 2026-10-19 05:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_perfilusuario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentoBusqueda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('MATERIAL', 'Materiales'), ('ACTIVO', 'Activos'), ('TRABAJADOR', 'Trabajadores'), ('MOVIMIENTO', 'Vales / Movimientos'), ('REQUERIMIENTO', 'Requerimientos')], max_length=15)),
+                ('objeto_id', models.CharField(max_length=36)),
+                ('titulo', models.CharField(max_length=255)),
+                ('detalle', models.CharField(blank=True, max_length=255)),
+                ('enlace', models.CharField(blank=True, max_length=255)),
+                ('firma', models.CharField(help_text='Hash del contenido indexado (evita reindexar si no cambió)', max_length=32)),
+            ],
+            options={
+                'verbose_name': 'Documento de Búsqueda',
+                'verbose_name_plural': 'Documentos de Búsqueda',
+                'unique_together': {('tipo', 'objeto_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TerminoBusqueda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=60)),
+                ('documento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terminos', to='core.documentobusqueda')),
+            ],
+            options={
+                'verbose_name': 'Término de Búsqueda',
+                'verbose_name_plural': 'Términos de Búsqueda',
+                'indexes': [models.Index(fields=['token'], name='busqueda_token_prefijo_idx', opclasses=['varchar_pattern_ops'])],
+                'unique_together': {('token', 'documento')},
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.0.14 on 2026-10-19 06:19
+
+from django.db import migrations, models
+
+
+def asignar_almacenes(apps, schema_editor):
+    """Almacenes de los documentos ya indexados: vales (origen/destino), activos (ubicación) y requerimientos (proyecto)."""
+    DocumentoBusqueda = apps.get_model('core', 'DocumentoBusqueda')
+    Movimiento = apps.get_model('logistica', 'Movimiento')
+    Requerimiento = apps.get_model('logistica', 'Requerimiento')
+    Almacen = apps.get_model('logistica', 'Almacen')
+    Activo = apps.get_model('activos', 'Activo')
+    Relacion = DocumentoBusqueda.almacenes.through
+
+    almacenes_proyecto = {}
+    for almacen_id, proyecto_id in Almacen.objects.values_list('id', 'proyecto_id'):
+        almacenes_proyecto.setdefault(proyecto_id, []).append(almacen_id)
+
+    for tipo, filas in (
+        ('MOVIMIENTO', ((pk, [o, d]) for pk, o, d in Movimiento.objects.values_list('id', 'almacen_origen_id', 'almacen_destino_id').iterator())),
+        ('ACTIVO', ((pk, [u]) for pk, u in Activo.objects.values_list('id', 'ubicacion_id').iterator())),
+        ('REQUERIMIENTO', ((pk, almacenes_proyecto.get(p, [])) for pk, p in Requerimiento.objects.values_list('id', 'proyecto_id').iterator())),
+    ):
+        documentos = dict(DocumentoBusqueda.objects.filter(tipo=tipo).values_list('objeto_id', 'id'))
+        Relacion.objects.bulk_create([
+            Relacion(documentobusqueda_id=documentos[str(pk)], almacen_id=almacen_id)
+            for pk, almacenes in filas if str(pk) in documentos
+            for almacen_id in {a for a in almacenes if a}
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_indice_busqueda'),
+        ('logistica', '0024_movimiento_fecha_anulacion'),
+        ('activos', '0009_activo_ultimo_movimiento'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentobusqueda',
+            name='almacenes',
+            field=models.ManyToManyField(blank=True, help_text='Almacenes cuyos usuarios pueden ver el documento (vacío: visible para todos, ej. catálogo).', related_name='documentos_busqueda', to='logistica.almacen'),
+        ),
+        migrations.RunPython(asignar_almacenes, migrations.RunPython.noop),
+    ]
@@ -38,4 +38,61 @@ class PerfilUsuario(models.Model):
     almacenes = models.ManyToManyField('logistica.Almacen', blank=True, related_name='usuarios_permitidos', help_text="Almacenes a los que tiene acceso este usuario.")
 
     def __str__(self):
-        return f"Perfil de {self.usuario.username}"
\ No newline at end of file
+        return f"Perfil de {self.usuario.username}"
+
+
+# ==========================================
+# BÚSQUEDA GLOBAL (Índice invertido)
+# ==========================================
+
+class DocumentoBusqueda(models.Model):
+    """
+    Una entidad buscable (material, activo, trabajador, vale o requerimiento) con el texto
+    que se muestra en los resultados. Lo mantiene apps/core/busqueda.py vía señales.
+    """
+    TIPOS = [
+        ('MATERIAL', 'Materiales'),
+        ('ACTIVO', 'Activos'),
+        ('TRABAJADOR', 'Trabajadores'),
+        ('MOVIMIENTO', 'Vales / Movimientos'),
+        ('REQUERIMIENTO', 'Requerimientos'),
+    ]
+
+    tipo = models.CharField(max_length=15, choices=TIPOS)
+    objeto_id = models.CharField(max_length=36)
+    titulo = models.CharField(max_length=255)
+    detalle = models.CharField(max_length=255, blank=True)
+    enlace = models.CharField(max_length=255, blank=True)
+    firma = models.CharField(max_length=32, help_text="Hash del contenido indexado (evita reindexar si no cambió)")
+    almacenes = models.ManyToManyField(
+        'logistica.Almacen', blank=True, related_name='documentos_busqueda',
+        help_text="Almacenes cuyos usuarios pueden ver el documento (vacío: visible para todos, ej. catálogo)."
+    )
+
+    def __str__(self):
+        return f"{self.get_tipo_display()}: {self.titulo}"
+
+    class Meta:
+        verbose_name = "Documento de Búsqueda"
+        verbose_name_plural = "Documentos de Búsqueda"
+        unique_together = ('tipo', 'objeto_id')
+
+
+class TerminoBusqueda(models.Model):
+    """
+    Índice invertido: token normalizado -> documento.
+    La búsqueda es por prefijo (token LIKE 'texto%'), por eso el índice usa varchar_pattern_ops.
+    """
+    token = models.CharField(max_length=60)
+    documento = models.ForeignKey(DocumentoBusqueda, related_name='terminos', on_delete=models.CASCADE)
+
+    def __str__(self):
+        return self.token
+
+    class Meta:
+        verbose_name = "Término de Búsqueda"
+        verbose_name_plural = "Términos de Búsqueda"
+        unique_together = ('token', 'documento')
+        indexes = [
+            models.Index(fields=['token'], name='busqueda_token_prefijo_idx', opclasses=['varchar_pattern_ops']),
+        ]
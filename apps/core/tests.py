@@ -1,3 +1,111 @@
+from io import StringIO, BytesIO
+
+import openpyxl
+
 from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+
+from apps.catalogo.models import Material, Categoria
+from apps.rrhh.models import Trabajador
+from apps.core.busqueda import buscar
+from apps.core.exportacion import LibroExcel, por_lotes
+from apps.core.models import DocumentoBusqueda, PerfilUsuario
+from apps.logistica.models import Almacen, Movimiento
+from apps.proyectos.models import Proyecto
+
+
+class BusquedaGlobalTest(TestCase):
+    """
+    El índice invertido se mantiene con las señales y encuentra por prefijo de cualquier palabra.
+    """
+
+    def setUp(self):
+        categoria = Categoria.objects.create(nombre='Herramientas', codigo='HER')
+        self.material = Material.objects.create(codigo='MAT-0042', descripcion='Aislador polimérico 220kV', unidad_medida='UND', categoria=categoria)
+        self.trabajador = Trabajador.objects.create(nombres='José', apellidos='Quispe', dni='45678912')
+
+    def _titulos(self, q):
+        return {tipo: [d.titulo for d in docs] for tipo, _, docs in buscar(q)}
+
+    def test_busqueda_y_senales(self):
+        self.assertEqual(self._titulos('aislador polim'), {'MATERIAL': ['MAT-0042 - Aislador polimérico 220kV']})
+        self.assertEqual(self._titulos('0042'), {'MATERIAL': ['MAT-0042 - Aislador polimérico 220kV']})
+        self.assertEqual(self._titulos('jose 4567'), {'TRABAJADOR': ['José Quispe']})
+
+        self.material.descripcion = 'Aislador de vidrio'
+        self.material.save()
+        self.assertEqual(self._titulos('polimerico'), {})
+
+        self.trabajador.delete()
+        self.assertEqual(self._titulos('quispe'), {})
+
+    def test_reindexar(self):
+        DocumentoBusqueda.objects.all().delete()
+        call_command('reindexar_busqueda', stdout=StringIO())
+        self.assertIn('MATERIAL', self._titulos('MAT-0042'))
+
+        User = get_user_model()
+        self.client.force_login(User.objects.create_user('tester', 'test@obra.com', 'password'))
+        self.assertContains(self.client.get('/buscar/', {'q': 'mat-0042'}), 'Aislador polimérico')
+
+    def test_limite_por_tipo(self):
+        """Muchas coincidencias de un tipo no desplazan a los demás tipos."""
+        categoria = Categoria.objects.get(codigo='HER')
+        for i in range(105):
+            Material.objects.create(codigo=f'TAL-{i:03d}', descripcion='Taladro percutor', unidad_medida='UND', categoria=categoria)
+        Trabajador.objects.create(nombres='Talía', apellidos='Zapata', dni='11223344')
+
+        grupos = self._titulos('tal')
+        self.assertEqual(len(grupos['MATERIAL']), 10)
+        self.assertEqual(grupos['TRABAJADOR'], ['Talía Zapata'])
+
+    def test_enlace_codificado(self):
+        categoria = Categoria.objects.get(codigo='HER')
+        Material.objects.create(codigo='A&B 01', descripcion='Abrazadera', unidad_medida='UND', categoria=categoria)
+        documento = buscar('abrazadera')[0][2][0]
+        self.assertTrue(documento.enlace.endswith('?q=A%26B+01'))
+
+    def test_filtra_por_almacenes_permitidos(self):
+        User = get_user_model()
+        admin = User.objects.create_superuser('admin', 'admin@obra.com', 'password')
+        proyecto = Proyecto.objects.create(codigo='PRJ-001', nombre='Proyecto Demo')
+        alm_a = Almacen.objects.create(proyecto=proyecto, nombre='Almacén A', codigo='ALM-A')
+        alm_b = Almacen.objects.create(proyecto=proyecto, nombre='Almacén B', codigo='ALM-B')
+        for almacen, guia in [(alm_a, 'GUIA-111'), (alm_b, 'GUIA-222')]:
+            Movimiento.objects.create(proyecto=proyecto, tipo='INGRESO_COMPRA', almacen_destino=almacen, creado_por=admin, documento_referencia=guia)
+
+        self.assertEqual(len(buscar('guia', Almacen.objects.filter(id=alm_a.id))[0][2]), 1)
+        self.assertEqual(len(buscar('guia')[0][2]), 2)
+
+        usuario = User.objects.create_user('almacenero', 'alm@obra.com', 'password')
+        PerfilUsuario.objects.create(usuario=usuario).almacenes.add(alm_a)
+        self.client.force_login(usuario)
+        response = self.client.get('/buscar/', {'q': 'guia'})
+        self.assertContains(response, 'GUIA-111')
+        self.assertNotContains(response, 'GUIA-222')
+        # El catálogo no depende del almacén
+        self.assertContains(self.client.get('/buscar/', {'q': 'aislador'}), 'MAT-0042')
+
+
+class LibroExcelTest(TestCase):
+    """
+    El exportador consume las filas de un generador y responde con un archivo temporal.
+    """
+
+    def test_hoja_desde_generador(self):
+        filas = ([f'MAT-{i:04d}', i] for i in range(5000))
+        libro = LibroExcel()
+        libro.hoja("Inventario", ["Código", "Cantidad"], filas, preambulo=[["Reporte:", "Demo"]], pie=[["TOTAL", 12497500]])
+        respuesta = libro.respuesta("Inventario.xlsx")
+
+        self.assertIn('Inventario.xlsx', respuesta['Content-Disposition'])
+        ws = openpyxl.load_workbook(BytesIO(b''.join(respuesta.streaming_content))).active
+        self.assertEqual(ws.max_row, 1 + 1 + 5000 + 1)
+        self.assertEqual(ws['A2'].value, 'Código')
+        self.assertTrue(ws['A2'].font.bold)
+        self.assertEqual(ws['A5002'].value, 'MAT-4999')
+        self.assertEqual(ws['B5003'].value, 12497500)
 
-# Create your tests here.
+    def test_por_lotes(self):
+        self.assertEqual([len(l) for l in por_lotes(range(5), 2)], [2, 2, 1])
@@ -1,8 +1,9 @@
 from django.urls import path
-from .views import dashboard, UsuarioListView, UsuarioCreateView, UsuarioUpdateView, UsuarioDeleteView
+from .views import dashboard, busqueda_global, UsuarioListView, UsuarioCreateView, UsuarioUpdateView, UsuarioDeleteView
 
 urlpatterns = [
     path('', dashboard, name='dashboard'),
+    path('buscar/', busqueda_global, name='busqueda_global'),
     path('usuarios/', UsuarioListView.as_view(), name='usuario_list'),
     path('usuarios/nuevo/', UsuarioCreateView.as_view(), name='usuario_create'),
     path('usuarios/editar/<int:pk>/', UsuarioUpdateView.as_view(), name='usuario_update'),
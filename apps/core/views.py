@@ -10,6 +10,7 @@ from datetime import timedelta
 from decimal import Decimal # <--- ESTA IMPORTACIÓN ES CRÍTICA
 from django.contrib.auth import get_user_model
 from .forms import UsuarioForm
+from .busqueda import buscar
 
 # Importamos modelos para sacar métricas
 from apps.proyectos.models import Proyecto, Torre
@@ -100,6 +101,34 @@ def dashboard(request):
     }
     return render(request, 'core/dashboard.html', context)
 
+# ==========================================
+# BÚSQUEDA GLOBAL
+# ==========================================
+
+ICONOS_BUSQUEDA = {
+    'MATERIAL': 'fa-box',
+    'ACTIVO': 'fa-tools',
+    'TRABAJADOR': 'fa-hard-hat',
+    'MOVIMIENTO': 'fa-file-invoice',
+    'REQUERIMIENTO': 'fa-clipboard-list',
+}
+
+@login_required
+def busqueda_global(request):
+    """
+    Un solo buscador para series, vales (NI-00123), guías, DNIs y materiales.
+    Usa el índice invertido de apps/core/busqueda.py (una consulta).
+    """
+    q = request.GET.get('q', '').strip()
+    # Vales, activos y requerimientos solo de los almacenes del usuario (ver AlmacenContextMiddleware)
+    almacenes = None if request.user.is_superuser else request.almacenes_permitidos
+    grupos = [
+        {'tipo': tipo, 'etiqueta': etiqueta, 'icono': ICONOS_BUSQUEDA[tipo], 'documentos': documentos}
+        for tipo, etiqueta, documentos in buscar(q, almacenes)
+    ] if q else []
+
+    return render(request, 'core/busqueda.html', {'q': q, 'grupos': grupos})
+
 # ==========================================
 # GESTIÓN DE USUARIOS (ADMINISTRACIÓN)
 # ==========================================
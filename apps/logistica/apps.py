@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class LogisticaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.logistica'
+
+    def ready(self):
+        from django.core.signals import request_started
+        from . import signals  # noqa: F401 (registra receptores)
+        from . import cache  # noqa: F401 (suscribe las cachés locales al bus)
+        from .invalidacion import iniciar_listener
+
+        # El listener LISTEN/NOTIFY se levanta en el primer request de cada worker
+        request_started.connect(iniciar_listener, dispatch_uid='logistica_listener_invalidacion')
@@ -0,0 +1,133 @@
+"""
+CACHÉS LOCALES DEL PROCESO (Por worker).
+Se vacían automáticamente con los eventos del bus de invalidación (invalidacion.py),
+que KardexService emite al confirmar/anular un movimiento (después del commit).
+"""
+import threading
+from collections import OrderedDict
+
+from .invalidacion import suscribir
+
+
+class CacheStock:
+    """
+    Caché (almacén, material) -> {stock, precio, stock_reservado, stock_libre}.
+    Se llena en la primera lectura y se invalida por material, almacén o proyecto.
+    Tamaño acotado (LRU) para no crecer sin límite en almacenes grandes.
+
+    El cálculo de un faltante se hace fuera del lock: si mientras tanto llega una invalidación
+    (p. ej. un vale que hace commit), el valor pudo leerse antes del commit. Por eso cada
+    invalidación incrementa `_generacion` y un valor solo se guarda si la generación no cambió.
+    """
+
+    def __init__(self, max_items=20000):
+        self.max_items = max_items
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self._generacion = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidaciones = 0
+
+    def obtener(self, almacen_id, material_id, calcular):
+        """
+        Devuelve el dato cacheado o lo calcula con `calcular(almacen_id, material_id)`.
+        `calcular` debe devolver un dict que incluya 'proyecto_id' (para invalidar por proyecto).
+        """
+        clave = (str(almacen_id), str(material_id))
+        with self._lock:
+            if clave in self._datos:
+                self._datos.move_to_end(clave)
+                self.hits += 1
+                return self._datos[clave]
+            self.misses += 1
+            generacion = self._generacion
+
+        valor = calcular(almacen_id, material_id)
+
+        with self._lock:
+            if generacion == self._generacion:  # Si hubo una invalidación, el valor no se guarda
+                self._datos[clave] = valor
+                self._datos.move_to_end(clave)
+                while len(self._datos) > self.max_items:
+                    self._datos.popitem(last=False)
+        return valor
+
+    def obtener_lote(self, almacen_ids, material_ids, calcular_lote):
+        """
+        Igual que `obtener` pero para varias combinaciones: solo las que faltan en caché
+        se calculan, en una sola llamada a `calcular_lote(almacen_ids, material_ids)`.
+        Devuelve {(almacen_id, material_id): dato} con ids en texto.
+        """
+        claves = [(str(a), str(m)) for a in almacen_ids for m in material_ids]
+        resultado = {}
+        faltantes = []
+        with self._lock:
+            for clave in claves:
+                if clave in self._datos:
+                    self._datos.move_to_end(clave)
+                    resultado[clave] = self._datos[clave]
+                else:
+                    faltantes.append(clave)
+            self.hits += len(resultado)
+            self.misses += len(faltantes)
+            generacion = self._generacion
+
+        if faltantes:
+            calculados = calcular_lote(
+                {a for a, _ in faltantes}, {m for _, m in faltantes}
+            )
+            with self._lock:
+                vigente = generacion == self._generacion
+                for clave in faltantes:
+                    if clave in calculados:
+                        if vigente:
+                            self._datos[clave] = calculados[clave]
+                            self._datos.move_to_end(clave)
+                        resultado[clave] = calculados[clave]
+                while len(self._datos) > self.max_items:
+                    self._datos.popitem(last=False)
+        return resultado
+
+    def invalidar(self, evento):
+        with self._lock:
+            self.invalidaciones += 1
+            self._generacion += 1
+            if evento.get('todo'):
+                self._datos.clear()
+                return
+
+            almacenes = set(evento.get('almacenes', []))
+            materiales = set(evento.get('materiales', []))
+            proyectos = set(evento.get('proyectos', []))
+
+            # Un movimiento cambia el stock del proyecto (PMP / stock libre) en TODOS sus almacenes,
+            # por eso se invalida por material y no solo por el par (almacén, material).
+            for clave in list(self._datos):
+                almacen_id, material_id = clave
+                if (
+                    almacen_id in almacenes
+                    or material_id in materiales
+                    or str(self._datos[clave].get('proyecto_id')) in proyectos
+                ):
+                    del self._datos[clave]
+
+    def limpiar(self):
+        with self._lock:
+            self._generacion += 1
+            self._datos.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'items': len(self._datos),
+                'hits': self.hits,
+                'misses': self.misses,
+                'ratio_hits': round(self.hits / total, 4) if total else 0,
+                'invalidaciones': self.invalidaciones,
+            }
+
+
+cache_stock = CacheStock()
+suscribir(cache_stock.invalidar)
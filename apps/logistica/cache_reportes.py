@@ -0,0 +1,137 @@
+"""
+CACHÉ DE REPORTES GERENCIALES.
+
+Los reportes (consumo por torre, backlog, sábana de transacciones) se repiten muchas veces
+al día con los mismos filtros. Se guardan:
+- los resultados calculados, en la caché de Django;
+- los .xlsx generados, en MEDIA_ROOT/reportes_cache/.
+
+La clave combina el nombre del reporte, los parámetros normalizados y la firma de versión
+de los datos (versiones.py). Cuando un movimiento o requerimiento del proyecto cambia, la
+firma cambia: las entradas viejas simplemente dejan de usarse y se purgan por antigüedad
+y tamaño (LRU: se borra primero lo que hace más tiempo que no se descarga).
+"""
+import hashlib
+import json
+import os
+import pickle
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse
+
+from apps.core.exportacion import LibroExcel, TIPO_XLSX, exportar
+from .versiones import TODO, estado_versiones
+
+PREFIJO = 'reporte'
+
+
+def carpeta_archivos():
+    return os.path.join(settings.MEDIA_ROOT, 'reportes_cache')
+
+
+def normalizar_parametros(request, nombres):
+    """Solo los parámetros que afectan al resultado, sin vacíos y sin espacios sobrantes."""
+    parametros = {}
+    for nombre in nombres:
+        valor = request.GET.get(nombre, '').strip()
+        if valor:
+            parametros[nombre] = valor
+    return parametros
+
+
+def purgar_archivos(max_bytes=None, max_edad=None, conservar=None):
+    """
+    Borra los .xlsx más antiguos que `max_edad` segundos y luego, si la carpeta sigue
+    superando `max_bytes`, los de uso menos reciente (mtime) hasta quedar por debajo.
+    `conservar`: ruta que nunca se borra (el archivo que se está sirviendo).
+    Devuelve la cantidad de archivos borrados.
+    """
+    max_bytes = settings.CACHE_REPORTES_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    max_edad = settings.CACHE_REPORTES_MAX_EDAD if max_edad is None else max_edad
+    carpeta = carpeta_archivos()
+    if not os.path.isdir(carpeta):
+        return 0
+
+    limite_edad = time.time() - max_edad
+    archivos = []
+    for entrada in os.scandir(carpeta):
+        if entrada.is_file() and entrada.name.endswith('.xlsx') and entrada.path != conservar:
+            info = entrada.stat()
+            archivos.append((info.st_mtime, info.st_size, entrada.path))
+    archivos.sort()  # Uso menos reciente primero
+
+    borrados = 0
+    total = sum(tamano for _, tamano, _ in archivos)
+    for mtime, tamano, ruta in archivos:
+        if mtime >= limite_edad and total <= max_bytes:
+            break
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass  # Otro worker ya lo borró
+        total -= tamano
+        borrados += 1
+    return borrados
+
+
+class CacheReporte:
+    """
+    Entrada de caché de UNA ejecución de reporte (nombre + parámetros + versión de datos).
+
+        reporte = CacheReporte('backlog', parametros, [('PROYECTO', '...'), ...])
+        filas = reporte.resultado(lambda: list(queryset))
+        return reporte.descarga('excel', 'Backlog', 'Backlog', encabezados, generar())
+    """
+
+    def __init__(self, nombre, parametros, claves_version):
+        firma, _ = estado_versiones([TODO, *claves_version])
+        crudo = json.dumps([nombre, parametros, firma], sort_keys=True, default=str)
+        self.nombre = nombre
+        self.clave = f"{nombre}-{hashlib.sha1(crudo.encode('utf-8')).hexdigest()}"
+
+    def resultado(self, calcular):
+        """Devuelve el resultado cacheado o lo calcula. Los resultados muy pesados no se guardan."""
+        clave = f"{PREFIJO}:{self.clave}"
+        valor = cache.get(clave)
+        if valor is not None:
+            return valor
+        valor = calcular()
+        if len(pickle.dumps(valor, pickle.HIGHEST_PROTOCOL)) <= settings.CACHE_REPORTES_MAX_RESULTADO_KB * 1024:
+            cache.set(clave, valor, settings.CACHE_REPORTES_MAX_EDAD)
+        return valor
+
+    @property
+    def ruta_archivo(self):
+        return os.path.join(carpeta_archivos(), f"{self.clave}.xlsx")
+
+    def descarga(self, formato, nombre_base, titulo, encabezados, filas, **opciones_excel):
+        """
+        Como exportacion.exportar(), pero el Excel se sirve desde MEDIA_ROOT si ya existe.
+        `filas` debe ser perezoso (generador): en un acierto no se consulta la base de datos.
+        El CSV siempre sale en streaming directo desde el cursor.
+        """
+        if formato == 'csv':
+            return exportar(formato, nombre_base, titulo, encabezados, filas)
+
+        ruta = self.ruta_archivo
+        try:
+            os.utime(ruta)  # Marca de uso reciente (LRU)
+            archivo = open(ruta, 'rb')
+        except FileNotFoundError:
+            os.makedirs(carpeta_archivos(), exist_ok=True)
+            libro = LibroExcel()
+            libro.hoja(titulo, encabezados, filas, **opciones_excel)
+            temporal = f"{ruta}.{os.getpid()}.tmp"
+            try:
+                libro.guardar(temporal)
+                os.replace(temporal, ruta)  # Atómico: otro worker nunca ve un archivo a medias
+                # Se abre antes de purgar: si otro worker lo borra, el descriptor abierto sigue sirviendo
+                archivo = open(ruta, 'rb')
+            finally:
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+            purgar_archivos(conservar=ruta)
+
+        return FileResponse(archivo, as_attachment=True, filename=f"{nombre_base}.xlsx", content_type=TIPO_XLSX)
@@ -1,11 +1,46 @@
 from django import forms
-from django.forms import inlineformset_factory
+from django.forms import inlineformset_factory, BaseInlineFormSet
+from django.utils.functional import cached_property
 from django.db.models import F
 from .models import Movimiento, DetalleMovimiento, Requerimiento, DetalleRequerimiento
 from apps.activos.models import Activo
 from apps.rrhh.models import Trabajador
 from apps.catalogo.models import Proveedor
 
+class SelectOpcionesCompartidas(forms.Select):
+    """
+    Select que solo renderiza la opción seleccionada. El resto se copia en el navegador desde
+    un único <select> compartido (id en `data-opciones`) que la plantilla dibuja UNA vez,
+    en lugar de repetir la lista completa en cada fila del formset.
+    """
+    def __init__(self, id_compartido, attrs=None):
+        super().__init__(attrs)
+        self.attrs['data-opciones'] = id_compartido
+
+    def optgroups(self, name, value, attrs=None):
+        seleccion = {str(v) for v in value if v}
+        opciones = [
+            self.create_option(name, valor, etiqueta, True, indice)
+            for indice, (valor, etiqueta) in enumerate(self.choices) if str(valor) in seleccion
+        ]
+        return [(None, opciones, 0)]
+
+
+class SelectActivoAsincrono(forms.Select):
+    """
+    Select de activos que solo renderiza la opción vacía y la seleccionada.
+    El resto de opciones las carga el navegador desde api_listar_activos (paginada y con búsqueda),
+    así cada fila no envía miles de <option>. La validación sigue usando el queryset completo.
+    """
+    def optgroups(self, name, value, attrs=None):
+        seleccion = [v for v in value if v]
+        campo = self.choices.field
+        opciones = [self.create_option(name, '', campo.empty_label or '', not seleccion, 0)]
+        if seleccion:
+            for indice, obj in enumerate(self.choices.queryset.filter(pk__in=seleccion), start=1):
+                opciones.append(self.create_option(name, str(obj.pk), campo.label_from_instance(obj), True, indice))
+        return [(None, opciones, 0)]
+
 # ==========================================
 # 1. FORMULARIO DE LA CABECERA (Movimiento)
 # ==========================================
@@ -150,39 +185,32 @@ class DetalleMovimientoForm(forms.ModelForm):
             'costo_unitario': forms.NumberInput(attrs={'step': '0.01', 'placeholder': 'Precio S/.'}),
             'marca': forms.TextInput(attrs={'placeholder': 'Marca / Modelo', 'class': 'form-control-sm campo-activo-fijo'}),
             'series_temporales': forms.TextInput(attrs={'placeholder': 'Series (sep. por comas)', 'class': 'form-control-sm campo-activo-fijo'}),
-            'activo': forms.Select(attrs={'class': 'form-select form-select-sm campo-activo-salida'}),
+            'activo': SelectActivoAsincrono(attrs={'class': 'form-select form-select-sm campo-activo-salida'}),
         }
     
-    def __init__(self, *args, tipo_accion=None, almacen_id=None, tipo_movimiento=None, **kwargs):
-        self.tipo_accion = tipo_accion # Guardamos el tipo para usarlo en clean()
-        self.almacen_id = almacen_id   # Guardamos el almacén para filtrar
-        self.tipo_movimiento = tipo_movimiento # Nuevo: Para saber si es REINGRESO_LIMA
-        super().__init__(*args, **kwargs)
-        # Hacemos que el costo sea opcional (para Salidas o cuando no se tiene el dato)
-        self.fields['costo_unitario'].required = False
-        
-        # Filtramos los activos disponibles para el selector
+    @staticmethod
+    def queryset_activos(almacen_id=None, tipo_movimiento=None):
+        """Activos seleccionables según la operación (igual para todas las filas del formset)."""
         # Solo mostramos activos DISPONIBLES y que NO pertenezcan a un Kit (los kits se asignan en bloque)
         qs_activos = Activo.objects.filter(estado='DISPONIBLE', kit__isnull=True)
         
         # NUEVO: Si hay un almacén definido, filtramos solo los activos que están ahí
-        if self.almacen_id:
-            qs_activos = qs_activos.filter(ubicacion_id=self.almacen_id)
+        if almacen_id:
+            qs_activos = qs_activos.filter(ubicacion_id=almacen_id)
             
         # LÓGICA DE REINGRESO: Si vuelve de Lima, mostramos los que están "DEVUELTO_EXTERNO"
-        if self.tipo_movimiento == 'REINGRESO_LIMA':
+        if tipo_movimiento == 'REINGRESO_LIMA':
             # Sobreescribimos el queryset para mostrar SOLO los que están fuera
             qs_activos = Activo.objects.filter(estado='DEVUELTO_EXTERNO')
         
         # NUEVO: Si es devolución de obra, mostramos los que están ASIGNADOS (en campo)
-        elif self.tipo_movimiento == 'DEVOLUCION_OBRA':
+        elif tipo_movimiento == 'DEVOLUCION_OBRA':
             qs_activos = Activo.objects.filter(estado='ASIGNADO')
-            
-        if self.instance.pk and self.instance.activo:
-            # Si estamos editando, incluimos el activo actual aunque ya no esté disponible (porque lo tiene esta línea)
-            qs_activos = qs_activos | Activo.objects.filter(id=self.instance.activo.id)
-        self.fields['activo'].queryset = qs_activos
+        return qs_activos
 
+    @staticmethod
+    def opciones_requerimiento(tipo_accion=None):
+        """Opciones del desplegable unificado 'Asignar a Req. / Stock Libre' (una consulta)."""
         # Filtramos para que no salgan requerimientos viejos/cerrados en el desplegable de la fila
         qs = Requerimiento.objects.exclude(estado__in=['TOTAL', 'CANCELADO'])
         
@@ -201,20 +229,45 @@ class DetalleMovimientoForm(forms.ModelForm):
         # Agregamos los requerimientos reales
         for req in qs:
             choices.append((str(req.id), str(req)))
+        return choices
+
+    def __init__(self, *args, tipo_accion=None, almacen_id=None, tipo_movimiento=None,
+                 opciones_requerimiento=None, activos_queryset=None, **kwargs):
+        self.tipo_accion = tipo_accion # Guardamos el tipo para usarlo en clean()
+        self.almacen_id = almacen_id   # Guardamos el almacén para filtrar
+        self.tipo_movimiento = tipo_movimiento # Nuevo: Para saber si es REINGRESO_LIMA
+        super().__init__(*args, **kwargs)
+        # Hacemos que el costo sea opcional (para Salidas o cuando no se tiene el dato)
+        self.fields['costo_unitario'].required = False
+        
+        # Filtramos los activos disponibles para el selector
+        # (El formset los calcula una sola vez y los pasa en `activos_queryset`)
+        if activos_queryset is None:
+            activos_queryset = self.queryset_activos(almacen_id, tipo_movimiento)
+        qs_activos = activos_queryset
+            
+        if self.instance.pk and self.instance.activo_id:
+            # Si estamos editando, incluimos el activo actual aunque ya no esté disponible (porque lo tiene esta línea)
+            qs_activos = qs_activos | Activo.objects.filter(id=self.instance.activo_id)
+        self.fields['activo'].queryset = qs_activos
+
+        if opciones_requerimiento is None:
+            opciones_requerimiento = self.opciones_requerimiento(tipo_accion)
             
         # Definimos el campo dinámicamente para asegurar que quede al final del formulario (DOM)
+        # El widget solo dibuja la opción elegida: la lista completa se copia desde #opciones-requerimiento
         self.fields['seleccion_requerimiento'] = forms.ChoiceField(
-            choices=choices, 
+            choices=opciones_requerimiento, 
             required=False, 
-            widget=forms.Select(attrs={'class': 'form-select form-select-sm'})
+            widget=SelectOpcionesCompartidas('opciones-requerimiento', attrs={'class': 'form-select form-select-sm'})
         )
         
         # Establecer valor inicial basado en la instancia (Edición)
         if self.instance.pk:
             if self.instance.es_stock_libre:
                 self.fields['seleccion_requerimiento'].initial = 'STOCK_LIBRE'
-            elif self.instance.requerimiento:
-                self.fields['seleccion_requerimiento'].initial = str(self.instance.requerimiento.id)
+            elif self.instance.requerimiento_id:
+                self.fields['seleccion_requerimiento'].initial = str(self.instance.requerimiento_id)
             else:
                 self.fields['seleccion_requerimiento'].initial = 'STOCK_LIBRE'
         else:
@@ -280,8 +333,8 @@ class DetalleMovimientoForm(forms.ModelForm):
             instance.requerimiento = None
             instance.es_stock_libre = True
         elif val:
-            # Es un UUID de Requerimiento
-            instance.requerimiento = Requerimiento.objects.get(id=val)
+            # Es un UUID de Requerimiento (ya validado contra las opciones del campo)
+            instance.requerimiento_id = val
             instance.es_stock_libre = False
         else:
             # Fallback
@@ -295,10 +348,41 @@ class DetalleMovimientoForm(forms.ModelForm):
 # ==========================================
 # 3. LA FÁBRICA (FormSet)
 # ==========================================
+class BaseDetalleMovimientoFormSet(BaseInlineFormSet):
+    """
+    Calcula UNA vez las opciones de requerimientos y el queryset de activos
+    y los comparte con todas las filas (antes cada fila repetía las consultas).
+    """
+
+    @cached_property
+    def opciones_compartidas(self):
+        return {
+            'opciones_requerimiento': DetalleMovimientoForm.opciones_requerimiento(self.form_kwargs.get('tipo_accion')),
+            'activos_queryset': DetalleMovimientoForm.queryset_activos(
+                self.form_kwargs.get('almacen_id'), self.form_kwargs.get('tipo_movimiento')
+            ),
+        }
+
+    @property
+    def opciones_requerimiento(self):
+        """Lista compartida que la plantilla dibuja una sola vez (#opciones-requerimiento)."""
+        return self.opciones_compartidas['opciones_requerimiento']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # El nombre/unidad del material se muestra en cada fila
+        self.queryset = self.queryset.select_related('material')
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        kwargs.update(self.opciones_compartidas)
+        return kwargs
+
 DetalleMovimientoFormSet = inlineformset_factory(
     Movimiento,           # Modelo Padre
     DetalleMovimiento,    # Modelo Hijo
     form=DetalleMovimientoForm, # <--- IMPORTANTE: Usar el formulario del HIJO
+    formset=BaseDetalleMovimientoFormSet,
     extra=0,
     can_delete=True
 )
@@ -0,0 +1,263 @@
+"""
+BUS DE INVALIDACIÓN DE CACHÉS ENTRE WORKERS (PostgreSQL LISTEN/NOTIFY).
+
+Cada proceso (worker de gunicorn) puede mantener cachés locales de stock,
+catálogos o permisos. Cuando un worker confirma un vale, los demás deben
+enterarse para descartar lo que tienen en memoria. Para eso:
+
+1. `publicar(...)` registra el cambio y, DESPUÉS del commit, emite un
+   `NOTIFY` con las claves afectadas (almacenes, materiales, proyectos, catálogos).
+2. Cada worker levanta un hilo `ListenerInvalidacion` que hace `LISTEN` sobre el
+   mismo canal y entrega los eventos a las cachés suscritas con `suscribir(...)`.
+
+No requiere Redis ni broker externo: solo la base PostgreSQL del sistema.
+En otros motores (SQLite de desarrollo) solo se invalida el proceso local.
+"""
+import json
+import logging
+import os
+import select
+import socket
+import threading
+import weakref
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+CANAL = getattr(settings, 'CACHE_INVALIDACION_CANAL', 'almacen_cache')
+
+# Límite de payload de NOTIFY es 8000 bytes. Si el evento no entra, se manda "invalidar todo".
+MAX_PAYLOAD = 7500
+
+CLAVES = ('almacenes', 'materiales', 'proyectos', 'catalogos')
+
+_suscriptores = []
+_lock_suscriptores = threading.Lock()
+
+
+def _origen():
+    """Identifica al proceso emisor (host + pid) para no procesar dos veces sus propios eventos."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def suscribir(callback):
+    """
+    Registra una función `callback(evento)` que se ejecutará ante cada invalidación.
+    El evento es un dict con listas en 'almacenes', 'materiales', 'proyectos', 'catalogos'
+    y el flag 'todo' (True cuando se debe vaciar la caché completa).
+    """
+    with _lock_suscriptores:
+        if callback not in _suscriptores:
+            _suscriptores.append(callback)
+    return callback
+
+
+def desuscribir(callback):
+    with _lock_suscriptores:
+        if callback in _suscriptores:
+            _suscriptores.remove(callback)
+
+
+# Evento pendiente de cada conexión (las conexiones de Django son por hilo).
+# Se guarda una referencia débil al callback: la única referencia fuerte la tiene
+# la cola on_commit de Django. Si el savepoint o la transacción que lo registró se
+# revierte, Django lo descarta, la referencia muere y el siguiente evento registra
+# un callback nuevo. Así nunca se combina con un aviso que no se va a emitir.
+_pendientes = threading.local()
+
+
+def _pendientes_hilo():
+    if not hasattr(_pendientes, 'por_conexion'):
+        _pendientes.por_conexion = {}
+    return _pendientes.por_conexion
+
+
+class _Emision:
+    """Callback on_commit que emite el evento acumulado de una transacción."""
+
+    def __init__(self, evento, using):
+        self.evento = evento
+        self.using = using
+
+    def __call__(self):
+        # Ya emitido: los eventos siguientes van en un aviso nuevo
+        pendientes = _pendientes_hilo()
+        referencia = pendientes.get(self.using)
+        if referencia is not None and referencia() in (self, None):
+            del pendientes[self.using]
+        _emitir(self.evento, self.using)
+
+
+def publicar(almacenes=(), materiales=(), proyectos=(), catalogos=(), todo=False, using='default'):
+    """
+    Anuncia un cambio de datos. El evento se emite solo si la transacción
+    actual hace commit (si no hay transacción abierta, se emite de inmediato).
+    """
+    evento = {
+        'almacenes': sorted({str(x) for x in almacenes if x}),
+        'materiales': sorted({str(x) for x in materiales if x}),
+        'proyectos': sorted({str(x) for x in proyectos if x}),
+        'catalogos': sorted({str(x) for x in catalogos if x}),
+        'todo': bool(todo),
+    }
+    if not todo and not any(evento[k] for k in CLAVES):
+        return
+
+    # Dentro de una misma transacción se acumula un solo evento: un vale de 50 líneas
+    # guarda 50 Stocks pero emite un único aviso al confirmar.
+    conexion = connections[using]
+    pendientes = _pendientes_hilo()
+    referencia = pendientes.get(conexion.alias) if conexion.in_atomic_block else None
+    emision = referencia() if referencia else None
+    if emision is not None:
+        _combinar(emision.evento, evento)
+        return
+
+    emision = _Emision(evento, conexion.alias)
+    if conexion.in_atomic_block:
+        pendientes[conexion.alias] = weakref.ref(emision)
+    transaction.on_commit(emision, using=using)
+
+
+def _combinar(destino, evento):
+    for clave in CLAVES:
+        destino[clave] = sorted(set(destino[clave]) | set(evento[clave]))
+    destino['todo'] = destino['todo'] or evento['todo']
+
+
+def _emitir(evento, using='default'):
+    # 1. Invalidamos primero el proceso actual (no esperamos el eco del NOTIFY)
+    despachar(evento)
+
+    # 2. Versiones persistentes para ETag (compartidas por todos los workers)
+    try:
+        from .versiones import incrementar_versiones
+        incrementar_versiones(evento)
+    except Exception:
+        logger.exception("No se pudo incrementar la versión de datos")
+
+    # 3. Avisamos al resto de workers / nodos
+    conexion = connections[using]
+    if conexion.vendor != 'postgresql':
+        return
+
+    mensaje = dict(evento, origen=_origen())
+    payload = json.dumps(mensaje)
+    if len(payload) > MAX_PAYLOAD:
+        payload = json.dumps({'origen': mensaje['origen'], 'todo': True})
+
+    try:
+        with conexion.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [CANAL, payload])
+    except Exception:
+        # Un fallo del aviso nunca debe romper la operación ya confirmada
+        logger.exception("No se pudo emitir NOTIFY de invalidación")
+
+
+def despachar(evento):
+    """Entrega el evento a todas las cachés suscritas del proceso."""
+    with _lock_suscriptores:
+        callbacks = list(_suscriptores)
+    for callback in callbacks:
+        try:
+            callback(evento)
+        except Exception:
+            logger.exception("Error invalidando caché local (%s)", getattr(callback, '__name__', callback))
+
+
+# ==========================================
+# LISTENER (UN HILO POR WORKER)
+# ==========================================
+
+class ListenerInvalidacion(threading.Thread):
+    """
+    Hilo demonio con conexión dedicada (autocommit) que escucha el canal de invalidación.
+    Si la conexión se cae, reconecta y vacía las cachés locales (pudo perder eventos).
+    """
+    daemon = True
+
+    def __init__(self, using='default', timeout=5):
+        super().__init__(name='listener-invalidacion')
+        self.using = using
+        self.timeout = timeout
+        self._detener = threading.Event()
+
+    def detener(self):
+        self._detener.set()
+
+    def run(self):
+        while not self._detener.is_set():
+            try:
+                self._escuchar()
+            except Exception:
+                logger.exception("Listener de invalidación desconectado, reintentando")
+                self._detener.wait(self.timeout)
+
+    def _escuchar(self):
+        import psycopg2
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+        params = connections[self.using].get_connection_params()
+        conn = psycopg2.connect(**params)
+        try:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN "{CANAL}"')
+
+            # Recién conectados: no sabemos qué pasó mientras no escuchábamos
+            despachar({k: [] for k in CLAVES} | {'todo': True})
+
+            origen = _origen()
+            while not self._detener.is_set():
+                if select.select([conn], [], [], self.timeout) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notificacion = conn.notifies.pop(0)
+                    self._procesar(notificacion.payload, origen)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _procesar(payload, origen):
+        try:
+            evento = json.loads(payload)
+        except ValueError:
+            evento = {'todo': True}
+        if evento.get('origen') == origen:
+            return  # Ya se despachó localmente al emitirlo
+        for clave in CLAVES:
+            evento.setdefault(clave, [])
+        evento.setdefault('todo', False)
+        despachar(evento)
+
+
+_listener = None
+_listener_pid = None
+_lock_listener = threading.Lock()
+
+
+def iniciar_listener(**kwargs):
+    """
+    Arranca (una sola vez por proceso) el hilo listener.
+    Se invoca con la señal `request_started`, así funciona aunque gunicorn haga fork
+    después de cargar la aplicación (`--preload`).
+    """
+    global _listener, _listener_pid
+    if not getattr(settings, 'CACHE_INVALIDACION_LISTENER', False):
+        return
+    if connections['default'].vendor != 'postgresql':
+        return
+
+    pid = os.getpid()
+    if _listener is not None and _listener_pid == pid and _listener.is_alive():
+        return
+
+    with _lock_listener:
+        if _listener is not None and _listener_pid == pid and _listener.is_alive():
+            return
+        _listener = ListenerInvalidacion()
+        _listener_pid = pid
+        _listener.start()
@@ -0,0 +1,42 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from apps.logistica.services import InventarioHistoricoService
+from apps.proyectos.models import Proyecto
+
+
+class Command(BaseCommand):
+    help = (
+        "Guarda el cierre de inventario (stock por almacén y PMP) de cada proyecto al final del día indicado. "
+        "Por defecto, el último día del mes anterior. Pensado para ejecutarse a inicio de cada mes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fecha', help="Último día incluido en el cierre (AAAA-MM-DD)")
+        parser.add_argument('--proyecto', help="Código del proyecto (por defecto, todos)")
+
+    def handle(self, *args, **options):
+        if options['fecha']:
+            fecha = parse_date(options['fecha'])
+            if not fecha:
+                raise CommandError("Fecha inválida, use AAAA-MM-DD.")
+        else:
+            fecha = timezone.localdate().replace(day=1) - timedelta(days=1)
+
+        # El cierre incluye los movimientos con fecha anterior al inicio del día siguiente
+        fecha_corte = timezone.make_aware(datetime.combine(fecha + timedelta(days=1), time.min))
+        if fecha_corte > timezone.now():
+            raise CommandError("Solo se pueden cerrar días ya terminados.")
+
+        proyectos = Proyecto.objects.order_by('codigo')
+        if options['proyecto']:
+            proyectos = proyectos.filter(codigo=options['proyecto'])
+
+        for proyecto in proyectos:
+            cierre = InventarioHistoricoService.guardar_cierre(proyecto, fecha_corte)
+            self.stdout.write(self.style.SUCCESS(
+                f"{proyecto.codigo}: cierre al {fecha:%d/%m/%Y} ({cierre.stocks.count()} saldos por almacén)"
+            ))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from apps.logistica.invalidacion import publicar
+from apps.logistica.services import ConsumoService
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el cubo de consumo por torre (ConsumoMensual) desde las Salidas a Obra confirmadas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--proyecto', help="ID del proyecto (por defecto, todos)")
+
+    def handle(self, *args, **options):
+        proyecto_id = options['proyecto']
+        celdas = ConsumoService.reconstruir(proyecto_id)
+
+        # Los reportes cacheados por versión deben volver a leer el cubo
+        if proyecto_id:
+            publicar(proyectos=[proyecto_id])
+        else:
+            publicar(todo=True)
+
+        self.stdout.write(self.style.SUCCESS(f"Cubo de consumo reconstruido: {celdas} celdas"))
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.14 on 2026-10-19 05:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistica', '0018_movimiento_proveedor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionDatos',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ambito', models.CharField(choices=[('TODO', 'Reinicio Total'), ('GLOBAL', 'Global'), ('ALMACEN', 'Almacén'), ('PROYECTO', 'Proyecto'), ('CATALOGO', 'Catálogos')], max_length=10)),
+                ('clave', models.CharField(blank=True, help_text='ID del almacén/proyecto (vacío en ámbitos generales)', max_length=40)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('fecha_actualizacion', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Versión de Datos',
+                'verbose_name_plural': 'Versiones de Datos',
+                'unique_together': {('ambito', 'clave')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.14 on 2026-10-19 05:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0003_material_indices_trigram'),
+        ('logistica', '0019_versiondatos'),
+        ('proyectos', '0001_initial'),
+        ('rrhh', '0002_entregaepp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimiento',
+            index=models.Index(fields=['fecha', 'id'], name='mov_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimiento',
+            index=models.Index(fields=['almacen_origen', 'fecha', 'id'], name='mov_origen_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimiento',
+            index=models.Index(fields=['almacen_destino', 'fecha', 'id'], name='mov_destino_fecha_idx'),
+        ),
+    ]
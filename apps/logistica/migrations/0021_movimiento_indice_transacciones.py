@@ -0,0 +1,17 @@
+# Generated by Django 5.0.14 on 2026-10-19 05:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistica', '0020_movimiento_indices_cursor'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimiento',
+            index=models.Index(fields=['estado', 'tipo', 'fecha'], name='mov_estado_tipo_fecha_idx'),
+        ),
+    ]
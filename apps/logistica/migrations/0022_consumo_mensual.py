@@ -0,0 +1,74 @@
+# Generated by Django 5.0.14 on 2026-10-19 05:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import DateField, DecimalField, F, Sum
+from django.db.models.functions import Round, TruncMonth
+
+
+def poblar_cubo(apps, schema_editor):
+    """
+    Carga inicial del cubo con las Salidas a Obra ya confirmadas.
+    Costo redondeado a céntimos por línea, igual que ConsumoService.registrar/reconstruir.
+    """
+    DetalleMovimiento = apps.get_model('logistica', 'DetalleMovimiento')
+    ConsumoMensual = apps.get_model('logistica', 'ConsumoMensual')
+
+    agregado = DetalleMovimiento.objects.filter(
+        movimiento__tipo='SALIDA_OBRA', movimiento__estado='CONFIRMADO', movimiento__torre_destino__isnull=False
+    ).annotate(
+        mes=TruncMonth('movimiento__fecha', output_field=DateField())
+    ).values(
+        'movimiento__proyecto_id', 'movimiento__torre_destino__tramo_id', 'movimiento__torre_destino_id',
+        'material_id', 'mes'
+    ).annotate(
+        total_cantidad=Sum('cantidad'),
+        total_costo=Sum(
+            Round(F('cantidad') * F('costo_unitario'), 2, output_field=DecimalField(max_digits=18, decimal_places=2))
+        ),
+    ).order_by()
+
+    ConsumoMensual.objects.bulk_create([
+        ConsumoMensual(
+            proyecto_id=fila['movimiento__proyecto_id'],
+            tramo_id=fila['movimiento__torre_destino__tramo_id'],
+            torre_id=fila['movimiento__torre_destino_id'],
+            material_id=fila['material_id'],
+            periodo=fila['mes'],
+            cantidad=fila['total_cantidad'],
+            costo_total=fila['total_costo'] or 0,
+        )
+        for fila in agregado.iterator()
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0004_material_indice_prefijo_codigo'),
+        ('logistica', '0021_movimiento_indice_transacciones'),
+        ('proyectos', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsumoMensual',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.DateField(help_text='Primer día del mes')),
+                ('cantidad', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('costo_total', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumos_mensuales', to='catalogo.material')),
+                ('proyecto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumos_mensuales', to='proyectos.proyecto')),
+                ('torre', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumos_mensuales', to='proyectos.torre')),
+                ('tramo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumos_mensuales', to='proyectos.tramo')),
+            ],
+            options={
+                'verbose_name': 'Consumo Mensual',
+                'verbose_name_plural': 'Consumos Mensuales',
+                'indexes': [models.Index(fields=['proyecto', 'periodo'], name='consumo_proyecto_periodo_idx'), models.Index(fields=['tramo', 'periodo'], name='consumo_tramo_periodo_idx')],
+                'unique_together': {('torre', 'material', 'periodo')},
+            },
+        ),
+        migrations.RunPython(poblar_cubo, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.0.14 on 2026-10-19 06:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalogo', '0004_material_indice_prefijo_codigo'),
+        ('logistica', '0022_consumo_mensual'),
+        ('proyectos', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CierreInventario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_corte', models.DateTimeField()),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('proyecto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cierres', to='proyectos.proyecto')),
+            ],
+            options={
+                'verbose_name': 'Cierre de Inventario',
+                'verbose_name_plural': 'Cierres de Inventario',
+                'unique_together': {('proyecto', 'fecha_corte')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CierreExistencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock_total_proyecto', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('costo_promedio', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='catalogo.material')),
+                ('cierre', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='existencias', to='logistica.cierreinventario')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CierreStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cantidad', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('almacen', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='logistica.almacen')),
+                ('cierre', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stocks', to='logistica.cierreinventario')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='catalogo.material')),
+            ],
+        ),
+    ]
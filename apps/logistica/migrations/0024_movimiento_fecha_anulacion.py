@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-19 06:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistica', '0023_cierres_inventario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movimiento',
+            name='fecha_anulacion',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -5,7 +5,7 @@ from django.core.exceptions import ValidationError
 from decimal import Decimal
 
 # Importamos modelos de otras apps
-from apps.proyectos.models import Proyecto, Torre
+from apps.proyectos.models import Proyecto, Tramo, Torre
 from apps.catalogo.models import Material
 from apps.rrhh.models import Trabajador
 
@@ -180,7 +180,9 @@ class Movimiento(models.Model):
     proyecto = models.ForeignKey(Proyecto, related_name='movimientos', on_delete=models.PROTECT)
     tipo = models.CharField(max_length=30, choices=TIPOS_MOVIMIENTO)
     fecha = models.DateTimeField(auto_now_add=True)
-    
+    # Momento en que se revirtió un vale CONFIRMADO (el Kardex repite la reversión en esa fecha)
+    fecha_anulacion = models.DateTimeField(null=True, blank=True)
+
     # Referencias
     documento_referencia = models.CharField(max_length=50, help_text="Nro Guía, Factura, Vale")
     
@@ -268,6 +270,16 @@ class Movimiento(models.Model):
             return f"MOV-{str(self.id)[:8].upper()}"
         return "NUEVO"
 
+    class Meta:
+        indexes = [
+            # Listado de movimientos: paginación por cursor sobre (fecha, id), global y por almacén
+            models.Index(fields=['fecha', 'id'], name='mov_fecha_id_idx'),
+            models.Index(fields=['almacen_origen', 'fecha', 'id'], name='mov_origen_fecha_idx'),
+            models.Index(fields=['almacen_destino', 'fecha', 'id'], name='mov_destino_fecha_idx'),
+            # Sábana de transacciones: confirmados por tipo en un rango de fechas
+            models.Index(fields=['estado', 'tipo', 'fecha'], name='mov_estado_tipo_fecha_idx'),
+        ]
+
 class DetalleMovimiento(models.Model):
     """
     Los ítems dentro del movimiento.
@@ -310,3 +322,107 @@ class DetalleMovimiento(models.Model):
         
     def __str__(self):
         return f"{self.cantidad} x {self.material.codigo}"
+
+# ==========================================
+# 4. VERSIONES DE DATOS (CACHÉ HTTP / ETAG)
+# ==========================================
+
+class VersionDatos(models.Model):
+    """
+    Contador de cambios por ámbito (Global, Almacén, Proyecto, Catálogo).
+    Lo incrementa el bus de invalidación tras cada commit; las vistas lo usan
+    para responder 304 (Not Modified) sin ejecutar sus consultas pesadas.
+    """
+    AMBITOS = [
+        ('TODO', 'Reinicio Total'),
+        ('GLOBAL', 'Global'),
+        ('ALMACEN', 'Almacén'),
+        ('PROYECTO', 'Proyecto'),
+        ('CATALOGO', 'Catálogos'),
+    ]
+
+    ambito = models.CharField(max_length=10, choices=AMBITOS)
+    clave = models.CharField(max_length=40, blank=True, help_text="ID del almacén/proyecto (vacío en ámbitos generales)")
+    version = models.PositiveBigIntegerField(default=0)
+    fecha_actualizacion = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.ambito}:{self.clave} v{self.version}"
+
+    class Meta:
+        unique_together = ('ambito', 'clave')
+        verbose_name = "Versión de Datos"
+        verbose_name_plural = "Versiones de Datos"
+
+
+# ==========================================
+# 5. CUBO DE CONSUMO (Proyecto > Tramo > Torre > Material x Mes)
+# ==========================================
+
+class ConsumoMensual(models.Model):
+    """
+    Agregado de las Salidas a Obra confirmadas: una fila por torre, material y mes.
+    Lo mantiene KardexService al confirmar/anular (ConsumoService.registrar) y se
+    reconstruye con `manage.py reconstruir_consumo`. Los reportes de consumo leen de
+    aquí en lugar de sumar DetalleMovimiento en cada consulta.
+    """
+    proyecto = models.ForeignKey(Proyecto, related_name='consumos_mensuales', on_delete=models.CASCADE)
+    tramo = models.ForeignKey(Tramo, related_name='consumos_mensuales', on_delete=models.CASCADE)
+    torre = models.ForeignKey(Torre, related_name='consumos_mensuales', on_delete=models.CASCADE)
+    material = models.ForeignKey(Material, related_name='consumos_mensuales', on_delete=models.CASCADE)
+    periodo = models.DateField(help_text="Primer día del mes")
+    cantidad = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    costo_total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.periodo:%Y-%m} | {self.torre_id} | {self.material_id}: {self.costo_total}"
+
+    class Meta:
+        unique_together = ('torre', 'material', 'periodo')
+        indexes = [
+            models.Index(fields=['proyecto', 'periodo'], name='consumo_proyecto_periodo_idx'),
+            models.Index(fields=['tramo', 'periodo'], name='consumo_tramo_periodo_idx'),
+        ]
+        verbose_name = "Consumo Mensual"
+        verbose_name_plural = "Consumos Mensuales"
+
+
+# ==========================================
+# 6. CIERRES DE INVENTARIO (Saldos a una fecha)
+# ==========================================
+
+class CierreInventario(models.Model):
+    """
+    Foto de Stock y Existencia de un proyecto a una fecha de corte (ej. fin de mes).
+    El inventario a una fecha pasada se reconstruye desde el cierre más cercano anterior
+    sumando solo los movimientos posteriores (InventarioHistoricoService).
+    Incluye los movimientos con fecha < fecha_corte. Se descarta automáticamente si luego se
+    confirma o anula un movimiento con fecha anterior al corte.
+    """
+    proyecto = models.ForeignKey(Proyecto, related_name='cierres', on_delete=models.CASCADE)
+    fecha_corte = models.DateTimeField()
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Cierre {self.proyecto_id} al {self.fecha_corte:%d/%m/%Y %H:%M}"
+
+    class Meta:
+        unique_together = ('proyecto', 'fecha_corte')
+        verbose_name = "Cierre de Inventario"
+        verbose_name_plural = "Cierres de Inventario"
+
+
+class CierreStock(models.Model):
+    """Stock físico de un almacén del proyecto a la fecha del cierre."""
+    cierre = models.ForeignKey(CierreInventario, related_name='stocks', on_delete=models.CASCADE)
+    almacen = models.ForeignKey(Almacen, on_delete=models.CASCADE)
+    material = models.ForeignKey(Material, on_delete=models.CASCADE)
+    cantidad = models.DecimalField(max_digits=12, decimal_places=2)
+
+
+class CierreExistencia(models.Model):
+    """Stock total y PMP del proyecto a la fecha del cierre."""
+    cierre = models.ForeignKey(CierreInventario, related_name='existencias', on_delete=models.CASCADE)
+    material = models.ForeignKey(Material, on_delete=models.CASCADE)
+    stock_total_proyecto = models.DecimalField(max_digits=12, decimal_places=2)
+    costo_promedio = models.DecimalField(max_digits=14, decimal_places=4)
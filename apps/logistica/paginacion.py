@@ -0,0 +1,125 @@
+"""
+PAGINACIÓN POR CURSOR (KEYSET).
+
+En vez de OFFSET (que recorre y descarta todas las filas previas), la página siguiente
+se pide "a partir de" la última fila vista: WHERE (campo, id) < (valor, id_ultimo).
+Con un índice compuesto sobre (campo, id) la página 1.000 cuesta lo mismo que la primera.
+"""
+import base64
+import json
+
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+
+
+def _campo_modelo(modelo, ruta):
+    """Resuelve 'movimiento__fecha' al Field final (para convertir el valor del cursor)."""
+    partes = ruta.split(LOOKUP_SEP)
+    for parte in partes[:-1]:
+        modelo = modelo._meta.get_field(parte).related_model
+    return modelo._meta.get_field(partes[-1])
+
+
+def _valor_ruta(objeto, ruta):
+    if isinstance(objeto, dict):  # Filas de .values(): la clave es la ruta completa
+        return objeto[ruta]
+    for parte in ruta.split(LOOKUP_SEP):
+        objeto = getattr(objeto, parte)
+    return objeto
+
+
+class PaginaKeyset:
+    """
+    Página PEREZOSA ordenada por (campo, pk) descendente (lo más reciente primero).
+    La consulta se ejecuta recién al iterar (compatible con {% cache %} en plantillas).
+
+    direccion='sig' -> filas más antiguas que el cursor; 'ant' -> más recientes.
+    """
+
+    def __init__(self, queryset, campo, cursor=None, direccion='sig', por_pagina=50, campo_pk='pk'):
+        self.queryset = queryset
+        self.campo = campo
+        self.campo_pk = campo_pk
+        self.direccion = 'ant' if direccion == 'ant' else 'sig'
+        self.por_pagina = por_pagina
+        self.cursor = self._decodificar(cursor) if cursor else None
+        self._items = None
+        self.tiene_siguiente = False
+        self.tiene_anterior = False
+
+    # --- Cursor (texto opaco para la URL) ---
+
+    @staticmethod
+    def codificar(valor, pk):
+        crudo = json.dumps([valor.isoformat() if hasattr(valor, 'isoformat') else str(valor), str(pk)])
+        return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip('=')
+
+    def _decodificar(self, cursor):
+        try:
+            relleno = '=' * (-len(cursor) % 4)
+            valor, pk = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+            modelo = self.queryset.model
+            campo_pk = modelo._meta.pk if self.campo_pk == 'pk' else _campo_modelo(modelo, self.campo_pk)
+            return _campo_modelo(modelo, self.campo).to_python(valor), campo_pk.to_python(pk)
+        except Exception:
+            return None  # Cursor inválido o manipulado: se muestra la primera página
+
+    # --- Carga ---
+
+    def _cargar(self):
+        if self._items is not None:
+            return
+        qs = self.queryset
+        campo, campo_pk = self.campo, self.campo_pk
+
+        if self.cursor and self.direccion == 'ant':
+            valor, pk = self.cursor
+            qs = qs.filter(Q(**{f'{campo}__gt': valor}) | Q(**{campo: valor, f'{campo_pk}__gt': pk}))
+            qs = qs.order_by(campo, campo_pk)
+        else:
+            if self.cursor:
+                valor, pk = self.cursor
+                qs = qs.filter(Q(**{f'{campo}__lt': valor}) | Q(**{campo: valor, f'{campo_pk}__lt': pk}))
+            qs = qs.order_by(f'-{campo}', f'-{campo_pk}')
+
+        filas = list(qs[:self.por_pagina + 1])
+        hay_mas = len(filas) > self.por_pagina
+        filas = filas[:self.por_pagina]
+
+        if self.cursor and self.direccion == 'ant':
+            filas.reverse()
+            self.tiene_anterior = hay_mas
+            self.tiene_siguiente = True
+        else:
+            self.tiene_siguiente = hay_mas
+            self.tiene_anterior = self.cursor is not None
+        self._items = filas
+
+    def __iter__(self):
+        self._cargar()
+        return iter(self._items)
+
+    def __len__(self):
+        self._cargar()
+        return len(self._items)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    @property
+    def tiene_otras_paginas(self):
+        self._cargar()
+        return self.tiene_siguiente or self.tiene_anterior
+
+    def _cursor_de(self, fila):
+        return self.codificar(_valor_ruta(fila, self.campo), _valor_ruta(fila, self.campo_pk))
+
+    @property
+    def cursor_siguiente(self):
+        self._cargar()
+        return self._cursor_de(self._items[-1]) if self._items and self.tiene_siguiente else ''
+
+    @property
+    def cursor_anterior(self):
+        self._cargar()
+        return self._cursor_de(self._items[0]) if self._items and self.tiene_anterior else ''
@@ -1,12 +1,27 @@
 from django.db import transaction
 from django.core.exceptions import ValidationError
-from django.db.models import Sum, F
-from decimal import Decimal
-from .models import Movimiento, Stock, Existencia, DetalleRequerimiento
+from django.db.models import Sum, F, Q, Case, When, Value, IntegerField, DecimalField, DateField, BooleanField, Subquery, OuterRef
+from django.db.models.functions import Coalesce, Round, TruncMonth
+from django.utils import timezone
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+import heapq
+import uuid
+from .models import (
+    Movimiento, DetalleMovimiento, Stock, Existencia, DetalleRequerimiento, Almacen, Material, ConsumoMensual,
+    CierreInventario, CierreStock, CierreExistencia,
+)
+from .invalidacion import publicar
 from apps.activos.models import Activo, AsignacionActivo
 from apps.rrhh.models import EntregaEPP
+from apps.proyectos.models import Torre
+from apps.core.exportacion import FilaDestacada, por_lotes, TAMANO_LOTE
 
 class KardexService:
+    # Naturaleza de cada tipo de movimiento (AJUSTE_INVENTARIO depende del almacén indicado)
+    TIPOS_INGRESO = ['INGRESO_COMPRA', 'DEVOLUCION_OBRA', 'TRANSFERENCIA_ENTRADA', 'REINGRESO_LIMA']
+    TIPOS_SALIDA = ['SALIDA_OBRA', 'SALIDA_OFICINA', 'TRANSFERENCIA_SALIDA', 'SALIDA_EPP', 'DEVOLUCION_LIMA']
+
     @staticmethod
     @transaction.atomic
     def confirmar_movimiento(movimiento_id):
@@ -37,7 +52,7 @@ class KardexService:
 
             # 2. Lógica según el tipo de movimiento
             # --- GRUPO INGRESOS (Suman Stock) ---
-            if movimiento.tipo in ['INGRESO_COMPRA', 'DEVOLUCION_OBRA', 'TRANSFERENCIA_ENTRADA', 'REINGRESO_LIMA']:
+            if movimiento.tipo in KardexService.TIPOS_INGRESO:
                 KardexService._procesar_ingreso(movimiento, detalle, existencia)
                 
                 # NUEVO: Si es Activo Fijo, creamos las fichas individuales
@@ -48,6 +63,7 @@ class KardexService:
                     detalle.activo.ubicacion = movimiento.almacen_destino
                     detalle.activo.estado = 'DISPONIBLE'
                     detalle.activo.trabajador_asignado = None
+                    KardexService._marcar_ultimo_movimiento(detalle.activo, movimiento)
                     detalle.activo.save()
                     
                     # NUEVO: Cerrar la asignación histórica (RRHH/Activos)
@@ -64,7 +80,7 @@ class KardexService:
                 KardexService._conciliar_ingreso_detalle(movimiento, detalle)
             
             # --- GRUPO SALIDAS (Restan Stock) ---
-            elif movimiento.tipo in ['SALIDA_OBRA', 'SALIDA_OFICINA', 'TRANSFERENCIA_SALIDA', 'SALIDA_EPP', 'DEVOLUCION_LIMA']:
+            elif movimiento.tipo in KardexService.TIPOS_SALIDA:
                 # 1. Identificar Requerimiento (Línea > Cabecera)
                 req_asociado = detalle.requerimiento or movimiento.requerimiento
                 if req_asociado:
@@ -84,6 +100,21 @@ class KardexService:
         movimiento.estado = 'CONFIRMADO'
         movimiento.save()
 
+        # Cubo de consumo por torre (solo Salidas a Obra)
+        ConsumoService.registrar(movimiento, detalles)
+        InventarioHistoricoService.descartar_cierres(movimiento)
+
+        # 4. Avisar a las cachés de todos los workers (se emite tras el commit)
+        KardexService._publicar_cambios(movimiento, detalles)
+
+    @staticmethod
+    def _publicar_cambios(movimiento, detalles):
+        publicar(
+            almacenes=[movimiento.almacen_origen_id, movimiento.almacen_destino_id],
+            materiales=[d.material_id for d in detalles],
+            proyectos=[movimiento.proyecto_id],
+        )
+
     @staticmethod
     def _procesar_ingreso(movimiento, detalle, existencia):
         """
@@ -175,9 +206,30 @@ class KardexService:
                     ingreso_origen=movimiento, # Vinculamos al movimiento origen
                     material=detalle.material, # Vinculamos al catálogo para stock
                     ubicacion=movimiento.almacen_destino, # Asignamos ubicación inicial
+                    ultimo_movimiento=movimiento,
+                    fecha_ultimo_movimiento=movimiento.fecha,
                     # No asignamos kit ni trabajador todavía
                 )
 
+    @staticmethod
+    def _marcar_ultimo_movimiento(activo, movimiento):
+        """Denormaliza en el activo el movimiento que lo acaba de mover (se guarda con el activo)."""
+        activo.ultimo_movimiento = movimiento
+        activo.fecha_ultimo_movimiento = movimiento.fecha
+
+    @staticmethod
+    def _recalcular_ultimo_movimiento(activo, excluir=None):
+        """Vuelve al último movimiento confirmado del activo (tras anular el que lo había movido)."""
+        ultimo = DetalleMovimiento.objects.filter(
+            activo=activo, movimiento__estado='CONFIRMADO'
+        ).exclude(movimiento=excluir).select_related('movimiento').order_by('-movimiento__fecha').first()
+        movimiento = ultimo.movimiento if ultimo else activo.ingreso_origen
+        if movimiento and movimiento == excluir:
+            movimiento = None
+        activo.ultimo_movimiento = movimiento
+        activo.fecha_ultimo_movimiento = movimiento.fecha if movimiento else None
+        activo.save(update_fields=['ultimo_movimiento', 'fecha_ultimo_movimiento'])
+
     @staticmethod
     def _conciliar_ingreso_detalle(movimiento, detalle):
         """
@@ -301,6 +353,7 @@ class KardexService:
                 detalle.activo.estado = 'ASIGNADO'
                 detalle.activo.trabajador_asignado = movimiento.trabajador
             
+            KardexService._marcar_ultimo_movimiento(detalle.activo, movimiento)
             detalle.activo.save()
             
             # Crear historial de asignación (Solo si hay trabajador responsable)
@@ -386,13 +439,20 @@ class KardexService:
 
         # 1. Revertir Stock, Existencia y Requerimientos (Línea por línea)
         for detalle in detalles:
+            existencia = Existencia.objects.select_for_update().get(
+                proyecto=movimiento.proyecto,
+                material=detalle.material
+            )
+
             # Revertir Ingreso de Requerimiento (Lógica inversa de conciliación)
-            if movimiento.tipo in ['INGRESO_COMPRA', 'DEVOLUCION_OBRA', 'TRANSFERENCIA_ENTRADA', 'REINGRESO_LIMA']:
+            if movimiento.tipo in KardexService.TIPOS_INGRESO:
                  KardexService._revertir_ingreso_detalle_requerimiento(movimiento, detalle)
                  KardexService._revertir_ingreso(movimiento, detalle, existencia)
+                 if detalle.activo:
+                     KardexService._recalcular_ultimo_movimiento(detalle.activo, excluir=movimiento)
 
             # Revertir Salida de Requerimiento
-            elif movimiento.tipo in ['SALIDA_OBRA', 'SALIDA_OFICINA', 'TRANSFERENCIA_SALIDA', 'SALIDA_EPP', 'DEVOLUCION_LIMA']:
+            elif movimiento.tipo in KardexService.TIPOS_SALIDA:
                  req_asociado = detalle.requerimiento or movimiento.requerimiento
                  if req_asociado:
                      KardexService._revertir_atencion_detalle_requerimiento(detalle, req_asociado)
@@ -403,6 +463,7 @@ class KardexService:
                      detalle.activo.trabajador_asignado = None
                      detalle.activo.ubicacion = movimiento.almacen_origen # Regresa al almacén de origen
                      detalle.activo.save()
+                     KardexService._recalcular_ultimo_movimiento(detalle.activo, excluir=movimiento)
                      # Eliminamos la asignación generada para limpiar el historial
                      AsignacionActivo.objects.filter(
                          activo=detalle.activo,
@@ -420,12 +481,6 @@ class KardexService:
 
                  KardexService._revertir_salida(movimiento, detalle, existencia)
 
-            # Obtener existencia para ajustes
-            existencia = Existencia.objects.select_for_update().get(
-                proyecto=movimiento.proyecto,
-                material=detalle.material
-            )
-
             # AJUSTES
             if movimiento.tipo == 'AJUSTE_INVENTARIO':
                 if movimiento.almacen_destino: # Fue entrada -> Restar
@@ -434,8 +489,14 @@ class KardexService:
                     KardexService._revertir_salida(movimiento, detalle, existencia)
 
         movimiento.estado = 'CANCELADO'
+        movimiento.fecha_anulacion = timezone.now()
         movimiento.save()
 
+        ConsumoService.registrar(movimiento, detalles, signo=-1)
+        InventarioHistoricoService.descartar_cierres(movimiento)
+
+        KardexService._publicar_cambios(movimiento, detalles)
+
     @staticmethod
     def _revertir_ingreso(movimiento, detalle, existencia):
         """
@@ -529,4 +590,654 @@ class KardexService:
             if det_req:
                 det_req.cantidad_ingresada -= detalle.cantidad
                 if det_req.cantidad_ingresada < 0: det_req.cantidad_ingresada = Decimal(0)
-                det_req.save()
\ No newline at end of file
+                det_req.save()
+
+
+class StockService:
+    """
+    Consultas de SOLO LECTURA sobre stock, costo y reservas.
+    (Las escrituras viven en KardexService).
+    """
+
+    @staticmethod
+    def consultar_stock(almacen_id, material_id):
+        """Stock de un solo material en un almacén (ver consultar_stock_lote)."""
+        resultado = StockService.consultar_stock_lote([almacen_id], [material_id])
+        return resultado.get((str(almacen_id), str(material_id)), {
+            'proyecto_id': None,
+            'stock': Decimal(0),
+            'precio': Decimal(0),
+            'stock_reservado': Decimal(0),
+            'stock_libre': Decimal(0),
+        })
+
+    @staticmethod
+    def consultar_stock_lote(almacen_ids, material_ids):
+        """
+        Stock físico por almacén, PMP del proyecto y stock libre (no reservado por requerimientos)
+        para todas las combinaciones almacén x material, con UNA consulta por tabla.
+        Stock libre = mín(Stock del almacén, Stock del proyecto - Reservado), igual que la
+        validación de salidas "Sin Requerimiento" de KardexService._procesar_salida.
+
+        Devuelve {(almacen_id, material_id): {...}} con ids en texto.
+        Los almacenes inexistentes se omiten.
+        """
+        material_ids = {str(m) for m in material_ids}
+        if not material_ids:
+            return {}
+
+        # 1. Proyecto de cada almacén
+        almacenes = {
+            str(a_id): p_id
+            for a_id, p_id in Almacen.objects.filter(id__in=set(almacen_ids)).values_list('id', 'proyecto_id')
+        }
+        if not almacenes:
+            return {}
+        proyectos = set(almacenes.values())
+
+        # 2. Stock físico
+        stocks = {
+            (str(a_id), str(m_id)): cantidad
+            for a_id, m_id, cantidad in Stock.objects.filter(
+                almacen_id__in=almacenes.keys(), material_id__in=material_ids
+            ).values_list('almacen_id', 'material_id', 'cantidad')
+        }
+
+        # 3. Existencia (PMP y stock total) del proyecto
+        existencias = {
+            (p_id, str(m_id)): (costo, total)
+            for p_id, m_id, costo, total in Existencia.objects.filter(
+                proyecto_id__in=proyectos, material_id__in=material_ids
+            ).values_list('proyecto_id', 'material_id', 'costo_promedio', 'stock_total_proyecto')
+        }
+
+        # 4. Reservas vigentes (ingresado para un requerimiento y aún no atendido)
+        reservas = {
+            (fila['requerimiento__proyecto_id'], str(fila['material_id'])): fila['total']
+            for fila in DetalleRequerimiento.objects.filter(
+                requerimiento__proyecto_id__in=proyectos,
+                material_id__in=material_ids,
+                requerimiento__estado__in=['PENDIENTE', 'PARCIAL'],
+                cantidad_ingresada__gt=F('cantidad_atendida')
+            ).values('requerimiento__proyecto_id', 'material_id').annotate(
+                total=Sum(F('cantidad_ingresada') - F('cantidad_atendida'))
+            )
+        }
+
+        resultado = {}
+        for almacen_id, proyecto_id in almacenes.items():
+            for material_id in material_ids:
+                cantidad = stocks.get((almacen_id, material_id), Decimal(0))
+                costo, total = existencias.get((proyecto_id, material_id), (Decimal(0), Decimal(0)))
+                reservado = reservas.get((proyecto_id, material_id)) or Decimal(0)
+                libre_proyecto = max(Decimal(0), total - reservado)
+
+                resultado[(almacen_id, material_id)] = {
+                    'proyecto_id': proyecto_id,
+                    'stock': cantidad,
+                    'precio': costo,
+                    'stock_reservado': reservado,
+                    'stock_libre': min(cantidad, libre_proyecto),
+                }
+        return resultado
+
+    # --- MATRIZ MATERIAL x ALMACÉN (Un proyecto) ---
+
+    @staticmethod
+    def matriz_filas(almacen_ids, q=None):
+        """
+        Una fila por material con stock en los almacenes dados y su total, en UNA consulta
+        agrupada sobre Stock (queryset perezoso: se pagina con Paginator).
+        """
+        qs = Stock.objects.filter(almacen_id__in=almacen_ids, cantidad__gt=0)
+        if q:
+            qs = qs.filter(Q(material__codigo__icontains=q) | Q(material__descripcion__icontains=q))
+        return qs.values(
+            'material_id', 'material__codigo', 'material__descripcion', 'material__unidad_medida'
+        ).annotate(total=Sum('cantidad')).order_by('material__codigo')
+
+    @staticmethod
+    def matriz_celdas(almacen_ids, material_ids):
+        """Cantidades {(material_id, almacen_id): cantidad} de una página de la matriz."""
+        return {
+            (str(m_id), str(a_id)): cantidad
+            for m_id, a_id, cantidad in Stock.objects.filter(
+                almacen_id__in=almacen_ids, material_id__in=material_ids, cantidad__gt=0
+            ).values_list('material_id', 'almacen_id', 'cantidad')
+        }
+
+    @staticmethod
+    def matriz_costos(proyecto_id, material_ids):
+        """PMP del proyecto {material_id: costo_promedio}."""
+        return {
+            str(m_id): costo
+            for m_id, costo in Existencia.objects.filter(
+                proyecto_id=proyecto_id, material_id__in=material_ids
+            ).values_list('material_id', 'costo_promedio')
+        }
+
+    @staticmethod
+    def matriz_totales_almacen(almacen_ids, proyecto_id, q=None):
+        """Cantidad y valor (a PMP del proyecto) por almacén: {almacen_id: (cantidad, valor)}."""
+        costo = Existencia.objects.filter(
+            proyecto_id=proyecto_id, material_id=OuterRef('material_id')
+        ).values('costo_promedio')[:1]
+        qs = Stock.objects.filter(almacen_id__in=almacen_ids, cantidad__gt=0)
+        if q:
+            qs = qs.filter(Q(material__codigo__icontains=q) | Q(material__descripcion__icontains=q))
+        filas = qs.values('almacen_id').annotate(
+            cantidad_total=Sum('cantidad'),
+            valor_total=Sum(
+                F('cantidad') * Coalesce(Subquery(costo), Value(Decimal(0))),
+                output_field=DecimalField(max_digits=18, decimal_places=2)
+            )
+        ).order_by()
+        return {str(f['almacen_id']): (f['cantidad_total'], f['valor_total'] or Decimal(0)) for f in filas}
+
+
+    # --- KARDEX VALORIZADO ---
+
+    DECIMALES_PMP = Decimal('0.0001')  # Igual que Existencia.costo_promedio
+
+    @staticmethod
+    def pmp_tras_ingreso(stock, pmp, cantidad, costo):
+        """PMP después de un ingreso (misma fórmula que KardexService._procesar_ingreso)."""
+        nuevo_stock = stock + cantidad
+        if nuevo_stock <= 0:
+            return pmp
+        return ((stock * pmp + cantidad * costo) / nuevo_stock).quantize(StockService.DECIMALES_PMP)
+
+    @staticmethod
+    def pmp_tras_anulacion(stock, pmp, cantidad, costo):
+        """PMP después de anular un ingreso (misma fórmula inversa que KardexService._revertir_ingreso)."""
+        nuevo_stock = stock - cantidad
+        if nuevo_stock <= 0:
+            return Decimal(0)
+        valor = max(stock * pmp - cantidad * costo, Decimal(0))
+        return (valor / nuevo_stock).quantize(StockService.DECIMALES_PMP)
+
+    @staticmethod
+    def aplicar_evento(stock, pmp, cantidad, costo, es_ingreso, anulacion, usa_control_costos):
+        """
+        Aplica un evento del Kardex a (stock_total_proyecto, costo_promedio) como lo hace KardexService:
+        los ingresos y sus anulaciones recalculan el PMP; las salidas y sus anulaciones solo mueven la cantidad.
+        """
+        if es_ingreso and usa_control_costos:
+            formula = StockService.pmp_tras_anulacion if anulacion else StockService.pmp_tras_ingreso
+            pmp = formula(stock, pmp, cantidad, costo)
+        return (stock + cantidad if es_ingreso != anulacion else stock - cantidad), pmp
+
+    @staticmethod
+    def lineas_kardex(lineas, desde=None, hasta=None):
+        """
+        Separa `lineas` en los dos tipos de evento del Kardex, cada uno con el campo que fija su momento:
+        [(líneas de vales confirmados o anulados tras confirmarse, 'movimiento__fecha', False),
+         (líneas de vales anulados, 'movimiento__fecha_anulacion', True)], acotadas a desde <= momento < hasta.
+        Los vales anulados antes de existir `fecha_anulacion` no tienen momento de reversión: se omiten.
+        """
+        anuladas = Q(movimiento__estado='CANCELADO', movimiento__fecha_anulacion__isnull=False)
+        partes = []
+        for filtro, momento, anulacion in (
+            (Q(movimiento__estado='CONFIRMADO') | anuladas, 'movimiento__fecha', False),
+            (anuladas, 'movimiento__fecha_anulacion', True),
+        ):
+            qs = lineas.filter(filtro)
+            if desde:
+                qs = qs.filter(**{f'{momento}__gte': desde})
+            if hasta:
+                qs = qs.filter(**{f'{momento}__lt': hasta})
+            partes.append((qs, momento, anulacion))
+        return partes
+
+    @staticmethod
+    def eventos_kardex(lineas, campos, orden=(), desde=None, hasta=None):
+        """
+        Eventos que movieron Stock y Existencia, en el orden en que ocurrieron: cada línea de un vale
+        confirmado en la fecha del vale y, si luego se anuló, su reversión en `fecha_anulacion`.
+        Mezcla las dos lecturas ordenadas por (*orden, momento) sin acumularlas en memoria y devuelve
+        tuplas (*orden, momento, anulacion, *campos).
+        """
+        lecturas = [
+            qs.annotate(
+                momento=F(momento), anulacion=Value(anulacion, output_field=BooleanField())
+            ).order_by(*orden, 'momento', 'id').values_list(
+                *orden, 'momento', 'anulacion', *campos
+            ).iterator(chunk_size=TAMANO_LOTE)
+            for qs, momento, anulacion in StockService.lineas_kardex(lineas, desde, hasta)
+        ]
+        n = len(orden) + 1
+        return heapq.merge(*lecturas, key=lambda fila: fila[:n])
+
+    @staticmethod
+    def _lineas_kardex_valorizado(proyecto, material_id, almacen_id=None):
+        """Líneas que lee el Kardex valorizado: las del proyecto (mueven el PMP) y, con almacén, las de ese almacén."""
+        filtro = Q(movimiento__proyecto=proyecto)
+        if almacen_id:
+            filtro |= Q(movimiento__almacen_origen_id=almacen_id) | Q(movimiento__almacen_destino_id=almacen_id)
+        return DetalleMovimiento.objects.filter(material_id=material_id).filter(filtro)
+
+    @staticmethod
+    def contar_kardex_valorizado(proyecto, material_id, almacen_id=None):
+        """Cantidad de filas que devolverá kardex_valorizado, contadas en SQL (para paginar sin recorrerlo)."""
+        almacen_id = uuid.UUID(str(almacen_id)) if almacen_id else None
+        lineas = StockService._lineas_kardex_valorizado(proyecto, material_id, almacen_id)
+        if almacen_id:
+            # Mismo criterio que el generador: los ingresos cuentan en el destino y las salidas en el origen
+            es_ingreso = Q(movimiento__tipo__in=KardexService.TIPOS_INGRESO) | Q(
+                movimiento__tipo='AJUSTE_INVENTARIO', movimiento__almacen_destino__isnull=False
+            )
+            lineas = lineas.filter(
+                (es_ingreso & Q(movimiento__almacen_destino_id=almacen_id))
+                | (~es_ingreso & Q(movimiento__almacen_origen_id=almacen_id))
+            )
+        return sum(qs.count() for qs, _, _ in StockService.lineas_kardex(lineas))
+
+    @staticmethod
+    def kardex_valorizado(proyecto, material_id, almacen_id=None):
+        """
+        Kardex valorizado en una lectura ordenada: repite sobre los eventos del Kardex (líneas
+        confirmadas y, en su fecha, las anulaciones) las mismas fórmulas de PMP de KardexService,
+        por lo que la última fila coincide con Existencia. Devuelve un generador de dicts.
+        - Sin almacén: saldo, PMP y valor del proyecto (todos sus almacenes).
+        - Con almacén: solo las líneas de ese almacén, con su saldo valorizado al PMP del
+          proyecto en ese momento (el PMP es único por proyecto y material).
+        """
+        almacen_id = uuid.UUID(str(almacen_id)) if almacen_id else None
+        eventos = StockService.eventos_kardex(
+            StockService._lineas_kardex_valorizado(proyecto, material_id, almacen_id),
+            ['cantidad', 'costo_unitario', 'movimiento_id', 'movimiento__proyecto_id', 'movimiento__tipo',
+             'movimiento__almacen_origen_id', 'movimiento__almacen_destino_id',
+             'movimiento__almacen_origen__nombre', 'movimiento__almacen_destino__nombre',
+             'movimiento__nota_ingreso', 'movimiento__documento_referencia',
+             'movimiento__creado_por__username', 'movimiento__creado_por__first_name', 'movimiento__creado_por__last_name'],
+        )
+
+        stock_proyecto = Decimal(0)
+        pmp = Decimal(0)
+        saldo_almacen = Decimal(0)
+        for (fecha, anulacion, cantidad, costo, movimiento_id, proyecto_id, tipo, origen_id, destino_id, origen, destino,
+             nota, documento, usuario, nombres, apellidos) in eventos:
+            es_ingreso = tipo in KardexService.TIPOS_INGRESO or (tipo == 'AJUSTE_INVENTARIO' and destino_id is not None)
+            # Como en Stock: los ingresos entran al destino y las salidas salen del origen (la anulación invierte el signo)
+            flujo = cantidad if es_ingreso != anulacion else -cantidad
+
+            # 1. Existencia del proyecto (solo sus propios movimientos mueven el PMP)
+            if proyecto_id == proyecto.id:
+                stock_proyecto, pmp = StockService.aplicar_evento(
+                    stock_proyecto, pmp, cantidad, costo, es_ingreso, anulacion, proyecto.usa_control_costos
+                )
+
+            # 2. Saldo que se informa: el del almacén o el del proyecto
+            if almacen_id:
+                if (destino_id if es_ingreso else origen_id) != almacen_id:
+                    continue  # Línea de otro almacén del proyecto: solo movió el PMP
+                saldo_almacen += flujo
+                saldo = saldo_almacen
+            else:
+                saldo = stock_proyecto
+
+            yield {
+                'fecha': fecha,
+                'anulacion': anulacion,
+                'movimiento_id': movimiento_id,
+                'tipo': tipo,
+                'almacen': (destino if es_ingreso else origen) or '',
+                'nota_ingreso': nota,
+                'documento': documento,
+                'entrada': flujo if flujo > 0 else Decimal(0),
+                'salida': -flujo if flujo < 0 else Decimal(0),
+                'saldo': saldo,
+                'costo_unitario': costo,
+                'valor_movimiento': flujo * costo,
+                'pmp': pmp,
+                'valor_inventario': saldo * pmp,
+                'usuario': f"{nombres} {apellidos}".strip() or usuario,
+            }
+
+class MaterialService:
+    """
+    Búsqueda del catálogo para los selectores asíncronos de los formularios
+    (en lugar de enviar el catálogo completo en el HTML).
+    """
+
+    LIMITE_MAXIMO = 50
+
+    @staticmethod
+    def buscar(q, categoria_id=None, tipo=None, requerimiento_id=None, limite=10):
+        """
+        Materiales activos cuyo código empieza con `q` o cuya descripción contiene
+        TODAS las palabras de `q`. Ranking: código exacto > prefijo de código >
+        prefijo de descripción > resto (luego por código).
+        Los filtros usan los índices de catalogo (0003 trigram y 0004 prefijo de código).
+        """
+        q = (q or '').strip()
+        palabras = q.split()
+        if not palabras:
+            return []
+
+        filtro_palabras = Q()
+        for palabra in palabras:
+            filtro_palabras &= Q(descripcion__icontains=palabra) | Q(codigo__icontains=palabra)
+
+        qs = Material.objects.filter(activo=True).filter(Q(codigo__istartswith=q) | filtro_palabras)
+        if categoria_id:
+            qs = qs.filter(categoria_id=categoria_id)
+        if tipo:
+            qs = qs.filter(tipo=tipo)
+        if requerimiento_id:
+            qs = qs.filter(id__in=DetalleRequerimiento.objects.filter(
+                requerimiento_id=requerimiento_id
+            ).values('material_id'))
+
+        limite = max(1, min(int(limite), MaterialService.LIMITE_MAXIMO))
+        return list(qs.annotate(
+            rango=Case(
+                When(codigo__iexact=q, then=Value(0)),
+                When(codigo__istartswith=q, then=Value(1)),
+                When(descripcion__istartswith=q, then=Value(2)),
+                default=Value(3),
+                output_field=IntegerField()
+            )
+        ).order_by('rango', 'codigo').values(
+            'id', 'codigo', 'descripcion', 'unidad_medida', 'tipo', 'categoria_id'
+        )[:limite])
+
+
+class ConsumoService:
+    """
+    Cubo de consumo (ConsumoMensual): Salidas a Obra agregadas por Proyecto > Tramo > Torre > Material x Mes.
+    KardexService lo actualiza en la misma transacción del vale; `reconstruir` lo rehace desde el Kardex.
+    """
+
+    # Nivel de detalle -> (campo código, campo nombre) para agrupar
+    NIVELES = {
+        'proyecto': ('proyecto__codigo', 'proyecto__nombre'),
+        'tramo': ('tramo__codigo', 'tramo__nombre'),
+        'torre': ('torre__codigo', 'torre__tipo'),
+        'material': ('material__codigo', 'material__descripcion'),
+    }
+
+    DECIMALES_COSTO = Decimal('0.01')  # Igual que ConsumoMensual.costo_total
+
+    @staticmethod
+    def costo_linea(cantidad, costo_unitario):
+        """Costo de una línea redondeado a céntimos (como ROUND(...,2) en `reconstruir`): la suma no deriva."""
+        return (cantidad * costo_unitario).quantize(ConsumoService.DECIMALES_COSTO, rounding=ROUND_HALF_UP)
+
+    @staticmethod
+    def periodo(fecha):
+        """Mes (primer día, en hora local) al que se imputa un movimiento."""
+        return timezone.localtime(fecha).date().replace(day=1)
+
+    @staticmethod
+    def registrar(movimiento, detalles, signo=1):
+        """
+        Suma (signo=1, al confirmar) o resta (signo=-1, al anular) las líneas de una Salida a Obra.
+        Usa el costo_unitario ya fijado por _procesar_salida (PMP del momento), redondeado por línea.
+        """
+        if movimiento.tipo != 'SALIDA_OBRA' or not movimiento.torre_destino_id:
+            return
+
+        tramo_id = Torre.objects.filter(id=movimiento.torre_destino_id).values_list('tramo_id', flat=True).get()
+        periodo = ConsumoService.periodo(movimiento.fecha)
+
+        por_material = defaultdict(lambda: [Decimal(0), Decimal(0)])
+        for detalle in detalles:
+            por_material[detalle.material_id][0] += detalle.cantidad
+            por_material[detalle.material_id][1] += ConsumoService.costo_linea(detalle.cantidad, detalle.costo_unitario)
+
+        # Orden fijo de bloqueo (evita deadlocks entre vales de la misma torre)
+        for material_id in sorted(por_material, key=str):
+            cantidad, costo = por_material[material_id]
+            celda, _ = ConsumoMensual.objects.select_for_update().get_or_create(
+                torre_id=movimiento.torre_destino_id, material_id=material_id, periodo=periodo,
+                defaults={'proyecto_id': movimiento.proyecto_id, 'tramo_id': tramo_id}
+            )
+            ConsumoMensual.objects.filter(pk=celda.pk).update(
+                cantidad=F('cantidad') + signo * cantidad,
+                costo_total=F('costo_total') + signo * costo,
+            )
+
+        if signo < 0:
+            # Celdas que quedaron vacías tras la anulación
+            ConsumoMensual.objects.filter(
+                torre_id=movimiento.torre_destino_id, periodo=periodo,
+                material_id__in=por_material.keys(), cantidad=0, costo_total=0
+            ).delete()
+
+    @staticmethod
+    @transaction.atomic
+    def reconstruir(proyecto_id=None):
+        """Rehace el cubo (de un proyecto o completo) desde las Salidas a Obra confirmadas. Devuelve las celdas creadas."""
+        lineas = DetalleMovimiento.objects.filter(
+            movimiento__tipo='SALIDA_OBRA', movimiento__estado='CONFIRMADO', movimiento__torre_destino__isnull=False
+        )
+        cubo = ConsumoMensual.objects.all()
+        if proyecto_id:
+            lineas = lineas.filter(movimiento__proyecto_id=proyecto_id)
+            cubo = cubo.filter(proyecto_id=proyecto_id)
+        cubo.delete()
+
+        agregado = lineas.annotate(
+            mes=TruncMonth('movimiento__fecha', output_field=DateField())
+        ).values(
+            'movimiento__proyecto_id', 'movimiento__torre_destino__tramo_id', 'movimiento__torre_destino_id',
+            'material_id', 'mes'
+        ).annotate(
+            total_cantidad=Sum('cantidad'),
+            total_costo=Sum(
+                Round(F('cantidad') * F('costo_unitario'), 2, output_field=DecimalField(max_digits=18, decimal_places=2))
+            ),
+        ).order_by()
+
+        creadas = 0
+        for lote in por_lotes(agregado.iterator(chunk_size=TAMANO_LOTE)):
+            ConsumoMensual.objects.bulk_create([
+                ConsumoMensual(
+                    proyecto_id=fila['movimiento__proyecto_id'],
+                    tramo_id=fila['movimiento__torre_destino__tramo_id'],
+                    torre_id=fila['movimiento__torre_destino_id'],
+                    material_id=fila['material_id'],
+                    periodo=fila['mes'],
+                    cantidad=fila['total_cantidad'],
+                    costo_total=(fila['total_costo'] or Decimal(0)).quantize(ConsumoService.DECIMALES_COSTO),
+                )
+                for fila in lote
+            ])
+            creadas += len(lote)
+        return creadas
+
+    # --- CONSULTAS ---
+
+    @staticmethod
+    def resumen(cubo, nivel):
+        """Una fila por elemento del nivel (con su costo y cantidad) sobre el cubo ya filtrado, de mayor a menor costo."""
+        codigo, nombre = ConsumoService.NIVELES[nivel]
+        return cubo.values(f'{nivel}_id', codigo, nombre).annotate(
+            total_cantidad=Sum('cantidad'), total_costo=Sum('costo_total')
+        ).order_by('-total_costo', codigo)
+
+    @staticmethod
+    def por_periodo(cubo):
+        """Costo por mes del cubo filtrado."""
+        return cubo.values('periodo').annotate(total_costo=Sum('costo_total')).order_by('periodo')
+
+    @staticmethod
+    def filas_rollup(cubo):
+        """
+        Detalle Proyecto / Tramo / Torre / Material con subtotales por torre, tramo y proyecto y un total
+        general (lo que daría GROUP BY ROLLUP), en una sola pasada sobre las filas ordenadas.
+        Columnas: Proyecto, Tramo, Torre, Código, Material, Unidad, Cantidad, Costo.
+        """
+        niveles = ('proyecto__codigo', 'tramo__codigo', 'torre__codigo')
+        etiquetas = ('PROYECTO', 'TRAMO', 'TORRE')
+        lineas = cubo.values(
+            *niveles, 'material__codigo', 'material__descripcion', 'material__unidad_medida'
+        ).annotate(
+            total_cantidad=Sum('cantidad'), total_costo=Sum('costo_total')
+        ).order_by(*niveles, 'material__codigo')
+
+        def subtotales(clave, acumulado, desde):
+            # Del nivel más profundo al más alto, y se reinician los acumulados cerrados
+            for i in reversed(range(desde, len(niveles))):
+                relleno = [''] * (len(niveles) - i - 1)
+                yield FilaDestacada([*clave[:i + 1], *relleno, f"SUBTOTAL {etiquetas[i]}", '', '', '', acumulado[i]])
+                acumulado[i] = Decimal(0)
+
+        actual = None
+        acumulado = [Decimal(0)] * len(niveles)
+        total = Decimal(0)
+        for fila in lineas.iterator(chunk_size=TAMANO_LOTE):
+            clave = tuple(fila[n] for n in niveles)
+            if actual is not None and clave != actual:
+                cambio = next(i for i in range(len(niveles)) if clave[i] != actual[i])
+                yield from subtotales(actual, acumulado, cambio)
+            actual = clave
+
+            costo = fila['total_costo'] or Decimal(0)
+            for i in range(len(niveles)):
+                acumulado[i] += costo
+            total += costo
+            yield [*clave, fila['material__codigo'], fila['material__descripcion'], fila['material__unidad_medida'],
+                   fila['total_cantidad'], costo]
+
+        if actual is not None:
+            yield from subtotales(actual, acumulado, 0)
+            yield FilaDestacada(['TOTAL GENERAL', '', '', '', '', '', '', total])
+
+
+class InventarioHistoricoService:
+    """
+    Inventario a una fecha pasada: stock por almacén y PMP por material de un proyecto.
+    Parte del CierreInventario más cercano anterior a la fecha y suma solo los eventos
+    posteriores del Kardex, movimientos confirmados y anulaciones (cantidades con GROUP BY;
+    el PMP, que depende del orden, en una pasada ordenada por material).
+    """
+
+    @staticmethod
+    def _filtro_ingreso():
+        """Líneas que suman al almacén destino (el resto resta del almacén origen)."""
+        return Q(movimiento__tipo__in=KardexService.TIPOS_INGRESO) | Q(
+            movimiento__tipo='AJUSTE_INVENTARIO', movimiento__almacen_destino__isnull=False
+        )
+
+    @staticmethod
+    def _filtro_salida():
+        return Q(movimiento__tipo__in=KardexService.TIPOS_SALIDA) | Q(
+            movimiento__tipo='AJUSTE_INVENTARIO', movimiento__almacen_destino__isnull=True
+        )
+
+    @staticmethod
+    def saldos(proyecto, hasta):
+        """
+        Saldos del proyecto con los eventos del Kardex anteriores a `hasta` (movimientos confirmados
+        y anulaciones en su fecha, como en StockService.eventos_kardex). Devuelve (stocks, costos, cierre):
+        - stocks: {(almacen_id, material_id): cantidad} de los almacenes del proyecto;
+        - costos: {material_id: (stock_total_proyecto, costo_promedio)};
+        - cierre: el CierreInventario usado como punto de partida (o None).
+        """
+        cierre = CierreInventario.objects.filter(
+            proyecto=proyecto, fecha_corte__lte=hasta
+        ).order_by('-fecha_corte').first()
+
+        stocks = defaultdict(Decimal)
+        costos = {}
+        desde = None
+        if cierre:
+            desde = cierre.fecha_corte
+            for almacen_id, material_id, cantidad in cierre.stocks.values_list('almacen_id', 'material_id', 'cantidad'):
+                stocks[(almacen_id, material_id)] = cantidad
+            costos = {
+                material_id: (stock, pmp)
+                for material_id, stock, pmp in cierre.existencias.values_list('material_id', 'stock_total_proyecto', 'costo_promedio')
+            }
+
+        # 1. Stock físico: flujo neto por almacén y material (GROUP BY de entradas y salidas; las anulaciones restan)
+        almacenes = Almacen.objects.filter(proyecto=proyecto).values('id')
+        for lineas, _, anulacion in StockService.lineas_kardex(DetalleMovimiento.objects.all(), desde, hasta):
+            for filtro, campo, signo in (
+                (InventarioHistoricoService._filtro_ingreso(), 'movimiento__almacen_destino_id', 1),
+                (InventarioHistoricoService._filtro_salida(), 'movimiento__almacen_origen_id', -1),
+            ):
+                if anulacion:
+                    signo = -signo
+                flujos = lineas.filter(filtro, **{f'{campo}__in': almacenes}).values(campo, 'material_id').annotate(
+                    total=Sum('cantidad')
+                ).order_by()
+                for fila in flujos:
+                    stocks[(fila[campo], fila['material_id'])] += signo * fila['total']
+
+        # 2. Existencia y PMP del proyecto: pasada ordenada por (material, momento) con las fórmulas de KardexService
+        eventos = StockService.eventos_kardex(
+            DetalleMovimiento.objects.filter(movimiento__proyecto=proyecto).annotate(
+                es_ingreso=Case(
+                    When(InventarioHistoricoService._filtro_ingreso(), then=Value(True)),
+                    default=Value(False),
+                    output_field=BooleanField()
+                )
+            ),
+            ['cantidad', 'costo_unitario', 'es_ingreso'], orden=('material_id',), desde=desde, hasta=hasta
+        )
+        for material_id, _, anulacion, cantidad, costo, es_ingreso in eventos:
+            stock, pmp = costos.get(material_id, (Decimal(0), Decimal(0)))
+            costos[material_id] = StockService.aplicar_evento(
+                stock, pmp, cantidad, costo, es_ingreso, anulacion, proyecto.usa_control_costos
+            )
+
+        return dict(stocks), costos, cierre
+
+    @staticmethod
+    @transaction.atomic
+    def guardar_cierre(proyecto, fecha_corte):
+        """Calcula y guarda (o reemplaza) el cierre del proyecto a `fecha_corte`."""
+        stocks, costos, _ = InventarioHistoricoService.saldos(proyecto, fecha_corte)
+        CierreInventario.objects.filter(proyecto=proyecto, fecha_corte=fecha_corte).delete()
+        cierre = CierreInventario.objects.create(proyecto=proyecto, fecha_corte=fecha_corte)
+        CierreStock.objects.bulk_create([
+            CierreStock(cierre=cierre, almacen_id=almacen_id, material_id=material_id, cantidad=cantidad)
+            for (almacen_id, material_id), cantidad in stocks.items() if cantidad
+        ], batch_size=TAMANO_LOTE)
+        # Se guardan también los materiales en cero: conservan su último PMP
+        CierreExistencia.objects.bulk_create([
+            CierreExistencia(cierre=cierre, material_id=material_id, stock_total_proyecto=stock, costo_promedio=pmp)
+            for material_id, (stock, pmp) in costos.items()
+        ], batch_size=TAMANO_LOTE)
+        return cierre
+
+    @staticmethod
+    def descartar_cierres(movimiento):
+        """
+        Borra los cierres que ya no coinciden con el Kardex, del proyecto del vale o de sus almacenes:
+        los posteriores a la fecha de un movimiento que se acaba de confirmar, o a la fecha de
+        anulación de uno que se acaba de anular (la reversión se aplica en ese momento).
+        """
+        almacenes = [a for a in (movimiento.almacen_origen_id, movimiento.almacen_destino_id) if a]
+        CierreInventario.objects.filter(
+            Q(proyecto_id=movimiento.proyecto_id) | Q(proyecto__almacenes__id__in=almacenes),
+            fecha_corte__gt=movimiento.fecha_anulacion or movimiento.fecha
+        ).delete()
+
+    @staticmethod
+    def filas(proyectos, hasta, almacen_id=None):
+        """
+        Filas del reporte (un proyecto a la vez, ordenadas por almacén y material) con saldo distinto de cero:
+        [proyecto, almacén, código, material, unidad, cantidad, PMP, valor].
+        """
+        for proyecto in proyectos:
+            stocks, costos, _ = InventarioHistoricoService.saldos(proyecto, hasta)
+            stocks = {
+                clave: cantidad for clave, cantidad in stocks.items()
+                if cantidad and (not almacen_id or str(clave[0]) == str(almacen_id))
+            }
+            if not stocks:
+                continue
+            almacenes = dict(Almacen.objects.filter(proyecto=proyecto).values_list('id', 'nombre'))
+            materiales = {
+                m_id: (codigo, descripcion, unidad)
+                for m_id, codigo, descripcion, unidad in Material.objects.filter(
+                    id__in={m for _, m in stocks}
+                ).values_list('id', 'codigo', 'descripcion', 'unidad_medida')
+            }
+            for (a_id, m_id), cantidad in sorted(stocks.items(), key=lambda x: (almacenes.get(x[0][0], ''), materiales[x[0][1]][0])):
+                pmp = costos.get(m_id, (Decimal(0), Decimal(0)))[1]
+                yield [proyecto.codigo, almacenes.get(a_id, ''), *materiales[m_id], cantidad, pmp, round(cantidad * pmp, 2)]
@@ -0,0 +1,88 @@
+"""
+Señales que alimentan el bus de invalidación (ver invalidacion.py).
+Los movimientos de stock los publica directamente KardexService; aquí
+cubrimos catálogos, almacenes, permisos, requerimientos, borradores de vales
+y las ediciones hechas fuera del Kardex (admin de Stock, módulo de Activos).
+Varias señales dentro de una misma transacción se emiten como un solo evento.
+"""
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from apps.catalogo.models import Material, Categoria, Proveedor
+from apps.core.models import PerfilUsuario
+from apps.proyectos.models import Proyecto, Tramo, Torre
+from apps.rrhh.models import Trabajador
+from apps.activos.models import Activo, Kit
+from .models import Almacen, Requerimiento, Movimiento, Stock
+from .invalidacion import publicar
+
+
+@receiver([post_save, post_delete], sender=Material)
+def invalidar_material(sender, instance, **kwargs):
+    publicar(materiales=[instance.pk], catalogos=['material'])
+
+
+@receiver([post_save, post_delete], sender=Categoria)
+def invalidar_categoria(sender, instance, **kwargs):
+    publicar(catalogos=['categoria'])
+
+
+@receiver([post_save, post_delete], sender=Almacen)
+def invalidar_almacen(sender, instance, **kwargs):
+    publicar(almacenes=[instance.pk], proyectos=[instance.proyecto_id], catalogos=['almacen'])
+
+
+@receiver([post_save, post_delete], sender=PerfilUsuario)
+def invalidar_perfil(sender, instance, **kwargs):
+    publicar(catalogos=['permisos'])
+
+
+@receiver(m2m_changed, sender=PerfilUsuario.almacenes.through)
+def invalidar_permisos_almacen(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        publicar(catalogos=['permisos'])
+
+
+@receiver(post_save, sender=Requerimiento)
+def invalidar_requerimiento(sender, instance, **kwargs):
+    # Cerrar o cancelar un requerimiento libera su reserva: cambia el stock libre del proyecto
+    publicar(proyectos=[instance.proyecto_id])
+
+
+@receiver([post_save, post_delete], sender=Movimiento)
+def invalidar_movimiento(sender, instance, **kwargs):
+    # Cubre borradores (listado de movimientos) y vales creados fuera del Kardex
+    publicar(
+        almacenes=[instance.almacen_origen_id, instance.almacen_destino_id],
+        proyectos=[instance.proyecto_id]
+    )
+
+
+@receiver([post_save, post_delete], sender=Stock)
+def invalidar_stock(sender, instance, **kwargs):
+    publicar(almacenes=[instance.almacen_id], materiales=[instance.material_id])
+
+
+@receiver([post_save, post_delete], sender=Activo)
+def invalidar_activo(sender, instance, **kwargs):
+    publicar(almacenes=[instance.ubicacion_id], catalogos=['activo'])
+
+
+# Catálogos que solo aparecen como etiquetas en listados y reportes
+CATALOGOS_SECUNDARIOS = {
+    Proveedor: 'proveedor',
+    Trabajador: 'trabajador',
+    Proyecto: 'proyecto',
+    Tramo: 'tramo',
+    Torre: 'torre',
+    Kit: 'kit',
+}
+
+
+def invalidar_catalogo_secundario(sender, instance, **kwargs):
+    publicar(catalogos=[CATALOGOS_SECUNDARIOS[sender]])
+
+
+for _modelo in CATALOGOS_SECUNDARIOS:
+    post_save.connect(invalidar_catalogo_secundario, sender=_modelo, dispatch_uid=f'invalidar_{_modelo.__name__}_save')
+    post_delete.connect(invalidar_catalogo_secundario, sender=_modelo, dispatch_uid=f'invalidar_{_modelo.__name__}_delete')
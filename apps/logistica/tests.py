@@ -1,16 +1,73 @@
-from django.test import TestCase
+import os
+import tempfile
+from unittest import mock
+from django.test import TestCase, RequestFactory, override_settings
+from django.core.cache import cache
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from decimal import Decimal
+from django.db import connection, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from datetime import datetime, timedelta
+from django.utils import timezone
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 # Importamos modelos del sistema
-from apps.logistica.models import Almacen, Stock, Movimiento, DetalleMovimiento, Requerimiento, DetalleRequerimiento
-from apps.proyectos.models import Proyecto
+from apps.logistica.models import Almacen, Stock, Movimiento, DetalleMovimiento, Requerimiento, DetalleRequerimiento, ConsumoMensual, CierreInventario, Existencia
+from apps.proyectos.models import Proyecto, Tramo, Torre
 from apps.catalogo.models import Material, Categoria
 from apps.rrhh.models import Trabajador
-from apps.logistica.services import KardexService
+from apps.activos.models import Activo
+from apps.logistica.services import KardexService, StockService, MaterialService, ConsumoService, InventarioHistoricoService
 from apps.logistica.forms import ImportarDatosForm
+from apps.logistica.invalidacion import suscribir, desuscribir, publicar
+from apps.logistica.cache import cache_stock
+from apps.logistica.paginacion import PaginaKeyset
+from apps.logistica.versiones import alcance_proyecto_url
+from apps.core.exportacion import LibroExcel
+
+class DatosObraTestCase(TestCase):
+    """
+    Datos comunes de los tests: usuario admin, proyecto PRJ-001, "Almacén Central",
+    categoría Albañilería y el cemento CEM-001, ya confirmados (con sus eventos emitidos).
+    """
+
+    def setUp(self):
+        User = get_user_model()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_superuser('admin', 'admin@obra.com', 'password')
+            self.proyecto = Proyecto.objects.create(codigo='PRJ-001', nombre='Proyecto Demo')
+            self.almacen = Almacen.objects.create(proyecto=self.proyecto, nombre='Almacén Central', codigo='ALM-01')
+            self.categoria = Categoria.objects.create(nombre='Albañilería', codigo='ALB')
+            self.cemento = Material.objects.create(codigo='CEM-001', descripcion='Cemento Sol', unidad_medida='BOL', categoria=self.categoria)
+
+    def _material(self, codigo='FIE-001', descripcion='Fierro 1/2', unidad_medida='VAR', **campos):
+        return Material.objects.create(codigo=codigo, descripcion=descripcion, unidad_medida=unidad_medida, categoria=self.categoria, **campos)
+
+    def _ingreso(self, cantidad, costo=20, almacen=None, material=None, documento=None):
+        """Confirma un ingreso por compra de stock libre (por defecto cemento al Almacén Central)."""
+        with self.captureOnCommitCallbacks(execute=True):
+            ingreso = Movimiento.objects.create(
+                proyecto=self.proyecto, tipo='INGRESO_COMPRA', almacen_destino=almacen or self.almacen,
+                creado_por=self.user, documento_referencia=documento or f'FAC-{cantidad}'
+            )
+            DetalleMovimiento.objects.create(
+                movimiento=ingreso, material=material or self.cemento, cantidad=cantidad, costo_unitario=costo, es_stock_libre=True
+            )
+            KardexService.confirmar_movimiento(ingreso.id)
+        return ingreso
+
+    def _salida(self, cantidad, almacen=None, material=None, tipo='SALIDA_OFICINA', **campos):
+        """Confirma una salida de stock libre (por defecto cemento del Almacén Central)."""
+        with self.captureOnCommitCallbacks(execute=True):
+            salida = Movimiento.objects.create(
+                proyecto=self.proyecto, tipo=tipo, almacen_origen=almacen or self.almacen,
+                creado_por=self.user, documento_referencia=f'VALE-{cantidad}', **campos
+            )
+            DetalleMovimiento.objects.create(movimiento=salida, material=material or self.cemento, cantidad=cantidad, es_stock_libre=True)
+            KardexService.confirmar_movimiento(salida.id)
+        return salida
 
 class KardexReservaTest(TestCase):
     """
@@ -133,4 +190,1119 @@ class ImportarDatosFormTest(TestCase):
         
         self.assertFalse(form.is_valid())
         self.assertIn('archivo_excel', form.errors)
-        self.assertEqual(form.errors['archivo_excel'][0], "Formato inválido. Solo se permiten archivos Excel (.xlsx).")
\ No newline at end of file
+        self.assertEqual(form.errors['archivo_excel'][0], "Formato inválido. Solo se permiten archivos Excel (.xlsx).")
+
+class InvalidacionCacheTest(TestCase):
+    """
+    El bus de invalidación debe avisar (tras el commit) qué almacén y material cambió.
+    """
+
+    def setUp(self):
+        User = get_user_model()
+        # Los datos base se "confirman" antes de escuchar: cada test emite su propio evento
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_user('tester', 'test@obra.com', 'password')
+            self.proyecto = Proyecto.objects.create(codigo='PRJ-001', nombre='Proyecto Demo')
+            self.almacen = Almacen.objects.create(proyecto=self.proyecto, nombre='Almacén Central', codigo='ALM-01')
+            self.categoria = Categoria.objects.create(nombre='Albañilería', codigo='ALB')
+            self.material = Material.objects.create(codigo='CEM-001', descripcion='Cemento Sol', unidad_medida='BOL', categoria=self.categoria)
+
+        self.eventos = []
+        suscribir(self.eventos.append)
+        self.addCleanup(desuscribir, self.eventos.append)
+
+    def test_confirmar_movimiento_publica_claves(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingreso = Movimiento.objects.create(
+                proyecto=self.proyecto,
+                tipo='INGRESO_COMPRA',
+                almacen_destino=self.almacen,
+                creado_por=self.user,
+                documento_referencia='FAC-001'
+            )
+            DetalleMovimiento.objects.create(movimiento=ingreso, material=self.material, cantidad=10, costo_unitario=25, es_stock_libre=True)
+            KardexService.confirmar_movimiento(ingreso.id)
+
+        evento = self.eventos[-1]
+        self.assertIn(str(self.almacen.id), evento['almacenes'])
+        self.assertIn(str(self.material.id), evento['materiales'])
+        self.assertIn(str(self.proyecto.id), evento['proyectos'])
+
+    def test_sin_commit_no_hay_evento(self):
+        # Fuera de captureOnCommitCallbacks el TestCase nunca hace commit
+        self.material.descripcion = 'Cemento Andino'
+        self.material.save()
+        self.assertEqual(self.eventos, [])
+
+    def test_evento_de_savepoint_revertido(self):
+        """Lo publicado en un savepoint revertido se descarta; lo siguiente va en un único aviso nuevo."""
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    publicar(materiales=['revertido'])
+                    raise ValueError
+            except ValueError:
+                pass
+            publicar(materiales=[self.material.id])
+            publicar(almacenes=[self.almacen.id])
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.eventos, [{
+            'almacenes': [str(self.almacen.id)], 'materiales': [str(self.material.id)],
+            'proyectos': [], 'catalogos': [], 'todo': False,
+        }])
+
+    def test_cache_stock_se_refresca_al_confirmar(self):
+        cache_stock.limpiar()
+        self.addCleanup(cache_stock.limpiar)
+
+        datos = cache_stock.obtener(self.almacen.id, self.material.id, StockService.consultar_stock)
+        self.assertEqual(datos['stock'], 0)
+
+        # Segunda lectura: sale de memoria, sin consultas
+        with self.assertNumQueries(0):
+            cache_stock.obtener(self.almacen.id, self.material.id, StockService.consultar_stock)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ingreso = Movimiento.objects.create(
+                proyecto=self.proyecto,
+                tipo='INGRESO_COMPRA',
+                almacen_destino=self.almacen,
+                creado_por=self.user,
+                documento_referencia='FAC-002'
+            )
+            DetalleMovimiento.objects.create(movimiento=ingreso, material=self.material, cantidad=10, costo_unitario=25, es_stock_libre=True)
+            KardexService.confirmar_movimiento(ingreso.id)
+
+        datos = cache_stock.obtener(self.almacen.id, self.material.id, StockService.consultar_stock)
+        self.assertEqual(datos['stock'], 10)
+        self.assertEqual(datos['stock_libre'], 10)
+
+    def test_invalidacion_durante_el_calculo(self):
+        """Un valor leído mientras otro worker hacía commit no se guarda en la caché."""
+        cache_stock.limpiar()
+        self.addCleanup(cache_stock.limpiar)
+        evento = {'materiales': [str(self.material.id)]}
+
+        def con_commit_concurrente(calcular):
+            def envoltura(*args):
+                valor = calcular(*args)
+                cache_stock.invalidar(evento)
+                return valor
+            return envoltura
+
+        datos = cache_stock.obtener(self.almacen.id, self.material.id, con_commit_concurrente(StockService.consultar_stock))
+        self.assertEqual(datos['stock'], 0)
+        resultado = cache_stock.obtener_lote([self.almacen.id], [self.material.id], con_commit_concurrente(StockService.consultar_stock_lote))
+        self.assertEqual(len(resultado), 1)
+        self.assertEqual(cache_stock.estadisticas()['items'], 0)
+
+        cache_stock.obtener(self.almacen.id, self.material.id, StockService.consultar_stock)
+        self.assertEqual(cache_stock.estadisticas()['items'], 1)
+
+class StockLoteTest(DatosObraTestCase):
+    """
+    La consulta por lote debe resolver todas las combinaciones almacén x material con una consulta por tabla.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.almacen_1 = self.almacen
+        self.almacen_2 = Almacen.objects.create(proyecto=self.proyecto, nombre='Almacén Torre', codigo='ALM-02')
+        self.fierro = self._material()
+        self._ingreso(30, 25)
+        self._ingreso(5, 40, material=self.fierro)
+
+    def test_una_consulta_por_tabla(self):
+        with self.assertNumQueries(4):
+            resultado = StockService.consultar_stock_lote(
+                [self.almacen_1.id, self.almacen_2.id], [self.cemento.id, self.fierro.id]
+            )
+
+        self.assertEqual(len(resultado), 4)
+        cemento = resultado[(str(self.almacen_1.id), str(self.cemento.id))]
+        self.assertEqual(cemento['stock'], 30)
+        self.assertEqual(cemento['stock_libre'], 30)
+        self.assertEqual(resultado[(str(self.almacen_2.id), str(self.fierro.id))]['stock'], 0)
+
+    def test_api_lote(self):
+        cache_stock.limpiar()
+        self.addCleanup(cache_stock.limpiar)
+        self.client.force_login(self.user)
+        response = self.client.get('/logistica/api/stock/lote/', {
+            'almacenes': str(self.almacen_1.id),
+            'materiales': f'{self.cemento.id},{self.fierro.id}',
+        })
+        self.assertEqual(response.status_code, 200)
+        stocks = {r['material_id']: r['stock'] for r in response.json()['results']}
+        self.assertEqual(Decimal(stocks[str(self.fierro.id)]), 5)
+
+class VersionDatosTest(DatosObraTestCase):
+    """
+    El Kardex debe responder 304 mientras no cambie el almacén, y 200 después de un movimiento.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.url = f'/logistica/kardex/{self.almacen.id}/{self.cemento.id}/'
+        cache.clear()
+
+    def test_etag_kardex(self):
+        primera = self.client.get(self.url)
+        self.assertEqual(primera.status_code, 200)
+        etag = primera['ETag']
+
+        segunda = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(segunda.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            ingreso = Movimiento.objects.create(
+                proyecto=self.proyecto,
+                tipo='INGRESO_COMPRA',
+                almacen_destino=self.almacen,
+                creado_por=self.user,
+                documento_referencia='FAC-001'
+            )
+            DetalleMovimiento.objects.create(movimiento=ingreso, material=self.cemento, cantidad=10, costo_unitario=25, es_stock_libre=True)
+            KardexService.confirmar_movimiento(ingreso.id)
+
+        # Las señales de Stock/Movimiento y el Kardex se agrupan en un solo evento
+        self.assertEqual(len(callbacks), 1)
+
+        tercera = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(tercera.status_code, 200)
+        self.assertNotEqual(tercera['ETag'], etag)
+
+    def test_fragmento_inventario_se_renueva(self):
+        self.assertNotContains(self.client.get('/logistica/inventario/'), 'CEM-001')
+        self._ingreso(10, 25)
+        self.assertContains(self.client.get('/logistica/inventario/'), 'CEM-001')
+
+class InventarioPaginadoTest(DatosObraTestCase):
+    """
+    Inventario paginado por almacén, con orden y semáforo calculados en SQL, y renovación
+    del fragmento/ETag cuando cambia el PMP del proyecto.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.alm_a = self.almacen
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alm_b = Almacen.objects.create(proyecto=self.proyecto, nombre='Almacén Torre', codigo='ALM-02')
+        materiales = Material.objects.bulk_create([
+            Material(codigo=f'MAT-{i:03d}', descripcion=f'Material {i}', unidad_medida='UND', categoria=self.categoria)
+            for i in range(55)
+        ])
+        # MAT-000..MAT-004 críticos (stock <= mínimo) y MAT-005 en advertencia (<= mínimo + 20%)
+        Stock.objects.bulk_create([
+            Stock(almacen=self.alm_a, material=m, cantidad=i + 1, cantidad_minima=10 if i < 5 else (5 if i == 5 else 0))
+            for i, m in enumerate(materiales)
+        ])
+        Existencia.objects.create(proyecto=self.proyecto, material=materiales[1], stock_total_proyecto=2, costo_promedio=500)
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def _stocks(self, almacen_pagina, **params):
+        response = self.client.get('/logistica/inventario/', params)
+        return next(a for a in response.context['almacenes'] if a.id == almacen_pagina.id).pagina_stocks
+
+    def test_paginacion_por_almacen(self):
+        pagina = self._stocks(self.alm_a)
+        self.assertEqual((len(pagina), pagina.paginator.count, pagina.paginator.num_pages), (50, 55, 2))
+        self.assertEqual(len(self._stocks(self.alm_b)), 0)
+
+        pagina = self._stocks(self.alm_a, almacen=self.alm_a.id, page=2)
+        self.assertEqual([s.material.codigo for s in pagina], [f'MAT-{i:03d}' for i in range(50, 55)])
+        # El almacén que no se navega se queda en su primera página
+        self.assertEqual(self._stocks(self.alm_b, almacen=self.alm_a.id, page=2).number, 1)
+
+    def test_ordenes_y_alerta(self):
+        self.assertEqual(self._stocks(self.alm_a, orden='cantidad')[0].cantidad, 55)
+
+        pagina = self._stocks(self.alm_a, orden='alerta')
+        self.assertEqual([s.nivel_alerta for s in pagina[:7]], [0, 0, 0, 0, 0, 1, 2])
+        self.assertEqual([s.nivel_alerta == 0 for s in pagina[:6]], [s.estado_alerta == 'CRITICO' for s in pagina[:6]])
+        self.assertEqual(pagina[5].estado_alerta, 'ADVERTENCIA')
+
+        pagina = self._stocks(self.alm_a, orden='valor')
+        self.assertEqual((pagina[0].material.codigo, pagina[0].valor), ('MAT-001', 1000))
+        self.assertIsNone(pagina[1].valor)  # Sin PMP: al final, por código
+
+        pagina = self._stocks(self.alm_a, filtro='critico')
+        self.assertEqual(pagina.paginator.count, 5)
+
+    def test_pmp_de_otro_almacen_renueva_cache(self):
+        session = self.client.session
+        session['almacen_activo_id'] = str(self.alm_a.id)
+        session.save()
+
+        self._ingreso(10, 20, self.alm_a)
+        primera = self.client.get('/logistica/inventario/', {'q': 'CEM'})
+        self.assertContains(primera, '200,00')
+        self._ingreso(30, 40, self.alm_b)
+
+        # El ingreso al almacén B sube el PMP a 35: el almacén A se valoriza en 350
+        segunda = self.client.get('/logistica/inventario/', {'q': 'CEM'}, HTTP_IF_NONE_MATCH=primera['ETag'])
+        self.assertEqual(segunda.status_code, 200)
+        self.assertContains(segunda, '350,00')
+
+class PaginaKeysetTest(TestCase):
+    """
+    La paginación por cursor debe recorrer todos los movimientos sin repetir ni saltar filas.
+    """
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_superuser('admin', 'admin@obra.com', 'password')
+        self.proyecto = Proyecto.objects.create(codigo='PRJ-001', nombre='Proyecto Demo')
+        self.almacen = Almacen.objects.create(proyecto=self.proyecto, nombre='Almacén Central', codigo='ALM-01')
+        for i in range(25):
+            Movimiento.objects.create(
+                proyecto=self.proyecto,
+                tipo='INGRESO_COMPRA',
+                almacen_destino=self.almacen,
+                creado_por=self.user,
+                documento_referencia=f'FAC-{i:03d}'
+            )
+
+    def test_recorrido_completo(self):
+        vistos = []
+        cursor = None
+        while True:
+            pagina = PaginaKeyset(Movimiento.objects.all(), 'fecha', cursor=cursor, por_pagina=10)
+            vistos.extend(m.documento_referencia for m in pagina)
+            if not pagina.tiene_siguiente:
+                break
+            cursor = pagina.cursor_siguiente
+
+        self.assertEqual(len(vistos), 25)
+        self.assertEqual(len(set(vistos)), 25)
+        self.assertEqual(vistos[0], 'FAC-024')
+
+        # Volver una página desde la última
+        anterior = PaginaKeyset(Movimiento.objects.all(), 'fecha', cursor=pagina.cursor_anterior, direccion='ant', por_pagina=10)
+        self.assertEqual([m.documento_referencia for m in anterior], vistos[10:20])
+
+
+class KardexPaginadoTest(DatosObraTestCase):
+    """
+    Cada página del Kardex debe arrastrar el saldo correcto aunque solo lea sus propias filas.
+    """
+
+    def setUp(self):
+        super().setUp()
+        for i in range(5):
+            self._ingreso(10, 25, documento=f'FAC-{i:03d}')
+        self.client.force_login(self.user)
+        self.url = f'/logistica/kardex/{self.almacen.id}/{self.cemento.id}/'
+
+    @mock.patch('apps.logistica.views.KARDEX_POR_PAGINA', 2)
+    def test_saldo_de_arrastre(self):
+        primera = self.client.get(self.url)
+        self.assertEqual([f['saldo_calculado'] for f in primera.context['movimientos']], [50, 40])
+
+        segunda = self.client.get(self.url, {'cursor': primera.context['pagina'].cursor_siguiente})
+        self.assertEqual([f['saldo_calculado'] for f in segunda.context['movimientos']], [30, 20])
+        self.assertEqual(segunda.context['movimientos'][0]['documento_referencia'], 'FAC-002')
+
+
+class BuscadorMaterialTest(TestCase):
+    """
+    El buscador del catálogo debe priorizar el código y respetar filtros y límite.
+    """
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user('tester', 'test@obra.com', 'password')
+        self.categoria = Categoria.objects.create(nombre='Albañilería', codigo='ALB')
+        self.cemento = Material.objects.create(codigo='CEM-001', descripcion='Cemento Sol Tipo I', unidad_medida='BOL', categoria=self.categoria)
+        self.mortero = Material.objects.create(codigo='MOR-001', descripcion='Mortero con cemento', unidad_medida='BOL', categoria=self.categoria)
+        self.taladro = Material.objects.create(codigo='HER-001', descripcion='Taladro percutor', unidad_medida='UND', categoria=self.categoria, tipo='ACTIVO_FIJO')
+        Material.objects.create(codigo='CEM-999', descripcion='Cemento descontinuado', unidad_medida='BOL', categoria=self.categoria, activo=False)
+
+    def test_ranking_y_filtros(self):
+        codigos = [m['codigo'] for m in MaterialService.buscar('cem')]
+        self.assertEqual(codigos, ['CEM-001', 'MOR-001'])  # Prefijo de código primero; inactivos fuera
+
+        self.assertEqual([m['codigo'] for m in MaterialService.buscar('cemento sol')], ['CEM-001'])
+        self.assertEqual([m['codigo'] for m in MaterialService.buscar('001', tipo='ACTIVO_FIJO')], ['HER-001'])
+        self.assertEqual(len(MaterialService.buscar('001', limite=1)), 1)
+
+    def test_api(self):
+        self.client.force_login(self.user)
+        respuesta = self.client.get('/logistica/api/materiales/buscar/', {'q': 'taladro'})
+        self.assertEqual(respuesta.json()['results'][0]['tipo'], 'ACTIVO_FIJO')
+        self.assertEqual(respuesta.json()['results'][0]['unidad_medida'], 'UND')
+
+
+class BuscadorTrabajadorTest(TestCase):
+    """
+    La búsqueda de trabajadores ignora tildes y ordena por relevancia (DNI exacto primero).
+    """
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user('tester', 'test@obra.com', 'password')
+        Trabajador.objects.create(nombres='José', apellidos='Núñez', dni='11111111')
+        Trabajador.objects.create(nombres='Ana', apellidos='Jose Ramos', dni='22111111')
+        self.client.force_login(self.user)
+
+    def test_normalizado_y_relevancia(self):
+        respuesta = self.client.get('/logistica/api/trabajador/buscar/', {'q': 'jose nunez'})
+        self.assertEqual([t['dni'] for t in respuesta.json()['results']], ['11111111'])
+
+        respuesta = self.client.get('/logistica/api/trabajador/buscar/', {'q': '22111111'})
+        self.assertEqual(respuesta.json()['results'][0]['dni'], '22111111')
+
+        # Prefijo del nombre antes que coincidencia parcial en apellidos
+        respuesta = self.client.get('/logistica/api/trabajador/buscar/', {'q': 'JOSÉ'})
+        self.assertEqual([t['dni'] for t in respuesta.json()['results']], ['11111111', '22111111'])
+        self.assertEqual(set(respuesta.json()['results'][0]), {'id', 'nombres', 'apellidos', 'dni'})
+
+
+class ListarActivosTest(TestCase):
+    """
+    El selector de activos se pagina por código y admite búsqueda.
+    """
+
+    def setUp(self):
+        User = get_user_model()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_user('tester', 'test@obra.com', 'password')
+            self.proyecto = Proyecto.objects.create(codigo='PRJ-001', nombre='Proyecto Demo')
+            self.almacen = Almacen.objects.create(proyecto=self.proyecto, nombre='Almacén Central', codigo='ALM-01')
+            for i in range(5):
+                Activo.objects.create(codigo=f'TAL-{i:02d}', serie=f'SN{i}', nombre='Taladro', ubicacion=self.almacen)
+            Activo.objects.create(codigo='AMO-01', serie='X9', nombre='Amoladora', ubicacion=self.almacen)
+        self.client.force_login(self.user)
+        self.url = '/logistica/api/activos/listar/'
+
+    def test_paginacion_y_busqueda(self):
+        primera = self.client.get(self.url, {'almacen_id': self.almacen.id, 'limite': 4}).json()
+        self.assertEqual([a['text'][:6] for a in primera['results']], ['AMO-01', 'TAL-00', 'TAL-01', 'TAL-02'])
+        self.assertEqual(primera['siguiente'], 'TAL-02')
+
+        segunda = self.client.get(self.url, {'almacen_id': self.almacen.id, 'limite': 4, 'cursor': primera['siguiente']}).json()
+        self.assertEqual(len(segunda['results']), 2)
+        self.assertIsNone(segunda['siguiente'])
+
+        busqueda = self.client.get(self.url, {'almacen_id': self.almacen.id, 'q': 'x9'}).json()
+        self.assertEqual([a['text'] for a in busqueda['results']], ['AMO-01 - X9 | Amoladora'])
+
+
+class FormsetOpcionesCompartidasTest(TestCase):
+    """
+    Las opciones de requerimientos se consultan una vez por formset, no una vez por fila.
+    """
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user('tester', 'test@obra.com', 'password')
+        self.proyecto = Proyecto.objects.create(codigo='PRJ-001', nombre='Proyecto Demo')
+        self.almacen = Almacen.objects.create(proyecto=self.proyecto, nombre='Almacén Central', codigo='ALM-01')
+        self.categoria = Categoria.objects.create(nombre='Albañilería', codigo='ALB')
+        self.req = Requerimiento.objects.create(proyecto=self.proyecto, solicitante='Residente', fecha_solicitud='2024-01-01', creado_por=self.user)
+        self.movimiento = Movimiento.objects.create(
+            proyecto=self.proyecto, tipo='SALIDA_OBRA', almacen_origen=self.almacen,
+            creado_por=self.user, documento_referencia='VALE-001'
+        )
+        for i in range(12):
+            material = Material.objects.create(codigo=f'MAT-{i:03d}', descripcion=f'Material {i}', unidad_medida='UND', categoria=self.categoria)
+            DetalleMovimiento.objects.create(
+                movimiento=self.movimiento, material=material, cantidad=1,
+                requerimiento=self.req if i % 2 else None, es_stock_libre=not i % 2
+            )
+
+    def _consultas_al_renderizar(self, filas):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from apps.logistica.forms import DetalleMovimientoFormSet
+
+        with CaptureQueriesContext(connection) as contexto:
+            formset = DetalleMovimientoFormSet(
+                instance=self.movimiento,
+                queryset=DetalleMovimiento.objects.filter(material__codigo__lt=f'MAT-{filas:03d}'),
+                form_kwargs={'tipo_accion': 'salida', 'almacen_id': self.almacen.id, 'tipo_movimiento': 'SALIDA_OBRA'}
+            )
+            for form in formset:
+                str(form['seleccion_requerimiento'])
+                form.instance.material.codigo
+        return len(contexto), formset
+
+    def test_consultas_constantes(self):
+        pocas, _ = self._consultas_al_renderizar(2)
+        muchas, formset = self._consultas_al_renderizar(12)
+        self.assertEqual(pocas, muchas)
+
+        fila = next(f for f in formset if f.instance.requerimiento_id)
+        html = str(fila['seleccion_requerimiento'])
+        self.assertIn(str(self.req.id), html)
+        self.assertNotIn('STOCK_LIBRE', html)  # Solo la opción elegida; el resto se copia en el navegador
+        self.assertEqual(len(formset.opciones_requerimiento), 2)
+
+class MatrizStockTest(DatosObraTestCase):
+    """
+    Matriz Material x Almacén: celdas alineadas a las columnas, totales por almacén y valor a PMP.
+    """
+
+    def setUp(self):
+        super().setUp()
+        Almacen.objects.filter(id=self.almacen.id).update(es_principal=True)
+        self.almacen_2 = Almacen.objects.create(proyecto=self.proyecto, nombre='Almacén Torre', codigo='ALM-02')
+        self.fierro = self._material()
+
+        self._ingreso(30)
+        self._ingreso(10, almacen=self.almacen_2)
+        self._ingreso(5, 40, self.almacen_2, self.fierro)
+
+    def test_api_matriz(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/logistica/api/stock/matriz/', {'proyecto': self.proyecto.id})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+
+        self.assertEqual([a['codigo'] for a in data['almacenes']], ['ALM-01', 'ALM-02'])
+        filas = {f['codigo']: f for f in data['filas']}
+        self.assertEqual([Decimal(c) if c is not None else None for c in filas['FIE-001']['celdas']], [None, 5])
+        self.assertEqual(Decimal(filas['CEM-001']['total']), 40)
+        self.assertEqual(Decimal(filas['CEM-001']['valor']), 800)
+        self.assertEqual(Decimal(data['almacenes'][1]['valor']), 400)  # 10 x 20 + 5 x 40
+        self.assertEqual(Decimal(data['totales']['valor']), 1000)
+
+    def test_exportar(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/logistica/inventario/matriz/exportar/', {'proyecto': self.proyecto.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Matriz_Stock_PRJ-001', response['Content-Disposition'])
+
+class ExportacionCsvTest(DatosObraTestCase):
+    """
+    ?export=csv responde en streaming con las mismas columnas que el Excel.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self._ingreso(30)
+        self._ingreso(10)
+
+    def _lineas(self, response):
+        self.assertTrue(response.streaming)
+        self.assertIn('.csv', response['Content-Disposition'])
+        return b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+
+    def test_transacciones_csv(self):
+        self.client.force_login(self.user)
+        lineas = self._lineas(self.client.get('/logistica/reportes/transacciones/', {'export': 'csv', 'tipo_reporte': 'ingreso'}))
+        self.assertEqual(lineas[0].split(',')[:3], ['Fecha', 'Nota Ingreso', 'Proveedor / Origen'])
+        self.assertEqual(len(lineas), 3)
+
+    def test_kardex_csv_saldo(self):
+        self.client.force_login(self.user)
+        lineas = self._lineas(self.client.get(f'/logistica/kardex/exportar/{self.almacen.id}/{self.cemento.id}/', {'export': 'csv'}))
+        saldos = [Decimal(l.split(',')[6]) for l in lineas[1:]]
+        self.assertEqual(saldos, [40, 30])  # Más reciente primero
+
+class CacheReportesTest(DatosObraTestCase):
+    """
+    Los reportes se reutilizan mientras la versión de datos de los proyectos no cambie.
+    """
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        ajustes = override_settings(MEDIA_ROOT=self.media.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        cache.clear()
+        super().setUp()
+
+    def _archivos(self):
+        carpeta = os.path.join(self.media.name, 'reportes_cache')
+        return sorted(os.listdir(carpeta)) if os.path.isdir(carpeta) else []
+
+    def test_excel_reutilizado_hasta_cambio_de_datos(self):
+        self._ingreso(30)
+        self.client.force_login(self.user)
+        url = '/logistica/reportes/transacciones/'
+
+        self.client.get(url, {'export': 'excel', 'fecha_inicio': ''}).close()
+        archivos = self._archivos()
+        self.assertEqual(len(archivos), 1)
+
+        # Mismos parámetros (normalizados): se sirve el mismo archivo
+        self.client.get(url, {'export': 'excel'}).close()
+        self.assertEqual(self._archivos(), archivos)
+
+        # Nuevo movimiento en el proyecto: nueva versión, nuevo archivo
+        self._ingreso(10)
+        self.client.get(url, {'export': 'excel'}).close()
+        self.assertEqual(len(self._archivos()), 2)
+
+    def test_purga_lru(self):
+        from apps.logistica.cache_reportes import carpeta_archivos, purgar_archivos
+
+        os.makedirs(carpeta_archivos())
+        for i, nombre in enumerate(['viejo', 'medio', 'nuevo']):
+            ruta = os.path.join(carpeta_archivos(), f'{nombre}.xlsx')
+            with open(ruta, 'wb') as archivo:
+                archivo.write(b'x' * 100)
+            os.utime(ruta, (1000 + i, 1000 + i))
+
+        self.assertEqual(purgar_archivos(max_bytes=250, max_edad=10 ** 12), 1)
+        self.assertEqual(self._archivos(), ['medio.xlsx', 'nuevo.xlsx'])
+        self.assertEqual(purgar_archivos(max_bytes=10 ** 9, max_edad=0), 2)
+
+    def test_archivo_mayor_al_limite_y_fallo_al_guardar(self):
+        self._ingreso(30)
+        self.client.force_login(self.user)
+        url = '/logistica/reportes/transacciones/'
+
+        # Un archivo que por sí solo supera el límite se sirve igual (la purga no lo toca)
+        with override_settings(CACHE_REPORTES_MAX_MB=0):
+            response = self.client.get(url, {'export': 'excel'})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(b''.join(response.streaming_content).startswith(b'PK'))
+            response.close()
+
+        # Si falla el guardado (ya escrito el .tmp) no queda el .tmp
+        guardar = LibroExcel.guardar
+
+        def guardar_y_fallar(libro, destino):
+            guardar(libro, destino)
+            raise OSError('disco lleno')
+
+        cache.clear()
+        self._ingreso(10)
+        with mock.patch('apps.logistica.cache_reportes.LibroExcel.guardar', autospec=True, side_effect=guardar_y_fallar):
+            with self.assertRaises(OSError):
+                self.client.get(url, {'export': 'excel'})
+        self.assertFalse([a for a in self._archivos() if a.endswith('.tmp')])
+
+
+class ReporteTransaccionesTest(DatosObraTestCase):
+    """
+    La sábana pagina las líneas y calcula los totales del filtro completo en la BD.
+    """
+
+    def setUp(self):
+        super().setUp()
+        for cantidad in (30, 10, 5):
+            self._ingreso(cantidad)
+        cache.clear()
+        self.client.force_login(self.user)
+
+    @mock.patch('apps.logistica.views.TRANSACCIONES_POR_PAGINA', 2)
+    def test_pagina_y_totales(self):
+        response = self.client.get('/logistica/reportes/transacciones/', {'tipo_reporte': 'ingreso'})
+        self.assertEqual(len(list(response.context['detalles'])), 2)
+        self.assertTrue(response.context['pagina'].tiene_siguiente)
+
+        totales = response.context['totales']
+        self.assertEqual(totales['lineas'], 3)
+        self.assertEqual(totales['total'], Decimal('900'))
+        self.assertEqual(totales['por_material'][0]['cantidad'], Decimal('45'))
+
+        siguiente = self.client.get('/logistica/reportes/transacciones/', {
+            'tipo_reporte': 'ingreso', 'cursor': response.context['pagina'].cursor_siguiente
+        })
+        self.assertEqual(len(list(siguiente.context['detalles'])), 1)
+
+    def test_filtro_por_rango_de_fechas(self):
+        from django.utils import timezone
+        hoy = timezone.localdate().isoformat()
+        response = self.client.get('/logistica/reportes/transacciones/', {'fecha_inicio': hoy, 'fecha_fin': hoy})
+        self.assertEqual(response.context['totales']['lineas'], 3)
+        response = self.client.get('/logistica/reportes/transacciones/', {'fecha_fin': '2000-01-01'})
+        self.assertEqual(response.context['totales']['lineas'], 0)
+
+class KardexAlmacenTest(DatosObraTestCase):
+    """
+    El Kardex del almacén completo acumula el saldo de cada material en una sola pasada.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.fierro = self._material()
+        self._ingreso(30)
+        self._ingreso(8, 40, material=self.fierro)
+        self._salida(12)
+
+    def test_secciones_y_saldos(self):
+        self.client.force_login(self.user)
+        response = self.client.get(f'/logistica/kardex/exportar/{self.almacen.id}/', {'export': 'csv'})
+        lineas = [l.split(',') for l in b''.join(response.streaming_content).decode('utf-8-sig').splitlines()]
+
+        saldos_finales = [Decimal(l[7]) for l in lineas if l[6] == 'SALDO FINAL']
+        self.assertEqual(saldos_finales, [18, 8])  # CEM-001, FIE-001
+        self.assertEqual(saldos_finales[0], Stock.objects.get(almacen=self.almacen, material=self.cemento).cantidad)
+        self.assertEqual([l[0] for l in lineas if l[0] in ('CEM-001', 'FIE-001') and l[2] == ''], ['CEM-001', 'FIE-001'])
+
+class ActivoUltimoMovimientoTest(DatosObraTestCase):
+    """
+    KardexService mantiene Activo.ultimo_movimiento; el reporte de devueltos lo usa sin consultas por fila.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.taladro = self._material('TAL-001', 'Taladro', 'UND', tipo='ACTIVO_FIJO')
+
+        self.ingreso = Movimiento.objects.create(
+            proyecto=self.proyecto, tipo='INGRESO_COMPRA', almacen_destino=self.almacen,
+            creado_por=self.user, documento_referencia='FAC-001'
+        )
+        DetalleMovimiento.objects.create(movimiento=self.ingreso, material=self.taladro, cantidad=2, costo_unitario=500, series_temporales='SN-1,SN-2')
+        KardexService.confirmar_movimiento(self.ingreso.id)
+
+    def test_devolucion_lima(self):
+        activo = Activo.objects.get(serie='SN-1')
+        self.assertEqual(activo.ultimo_movimiento_id, self.ingreso.id)
+
+        devolucion = Movimiento.objects.create(
+            proyecto=self.proyecto, tipo='DEVOLUCION_LIMA', almacen_origen=self.almacen,
+            creado_por=self.user, documento_referencia='GR-777'
+        )
+        DetalleMovimiento.objects.create(movimiento=devolucion, material=self.taladro, cantidad=1, activo=activo, es_stock_libre=True)
+        KardexService.confirmar_movimiento(devolucion.id)
+
+        activo.refresh_from_db()
+        self.assertEqual(activo.estado, 'DEVUELTO_EXTERNO')
+        self.assertEqual(activo.ultimo_movimiento_id, devolucion.id)
+        self.assertEqual(activo.fecha_ultimo_movimiento, Movimiento.objects.get(id=devolucion.id).fecha)
+
+        self.client.force_login(self.user)
+        response = self.client.get('/logistica/exportar/activos-externos/')
+        import openpyxl
+        from io import BytesIO
+        ws = openpyxl.load_workbook(BytesIO(b''.join(response.streaming_content))).active
+        self.assertEqual(ws.max_row, 2)
+        self.assertIn('GR-777', ws['G2'].value)
+
+class ConsumoCuboTest(DatosObraTestCase):
+    """
+    El cubo ConsumoMensual sigue a las Salidas a Obra (confirmar/anular) y coincide con su reconstrucción.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.fierro = self._material()
+        self.trabajador = Trabajador.objects.create(nombres='JUAN', apellidos='PEREZ', dni='12345678', activo=True)
+        self.tramo = Tramo.objects.create(proyecto=self.proyecto, nombre='Tramo 1', codigo='T1')
+        self.t01 = Torre.objects.create(tramo=self.tramo, codigo='T-01', tipo='SUSPENSION')
+        self.t02 = Torre.objects.create(tramo=self.tramo, codigo='T-02', tipo='ANCLAJE')
+
+        self._ingreso(100)
+        self._ingreso(50, 40, material=self.fierro)
+
+        self.salida_t01 = self._salida_obra(self.t01, [(self.cemento, 10), (self.fierro, 5)])
+        self.salida_t02 = self._salida_obra(self.t02, [(self.cemento, 4)])
+
+    def _salida_obra(self, torre, lineas):
+        salida = Movimiento.objects.create(
+            proyecto=self.proyecto, tipo='SALIDA_OBRA', almacen_origen=self.almacen, torre_destino=torre,
+            trabajador=self.trabajador, creado_por=self.user, documento_referencia='VALE'
+        )
+        for material, cantidad in lineas:
+            DetalleMovimiento.objects.create(movimiento=salida, material=material, cantidad=cantidad, es_stock_libre=True)
+        KardexService.confirmar_movimiento(salida.id)
+        return salida
+
+    def _celdas(self):
+        return sorted(
+            (c.torre.codigo, c.material.codigo, c.cantidad, c.costo_total)
+            for c in ConsumoMensual.objects.select_related('torre', 'material')
+        )
+
+    def test_incremental_igual_a_reconstruccion(self):
+        esperado = [('T-01', 'CEM-001', 10, 200), ('T-01', 'FIE-001', 5, 200), ('T-02', 'CEM-001', 4, 80)]
+        self.assertEqual(self._celdas(), esperado)
+        self.assertEqual(ConsumoService.reconstruir(), 3)
+        self.assertEqual(self._celdas(), esperado)
+
+        KardexService.anular_movimiento(self.salida_t02.id)
+        self.assertEqual(self._celdas(), esperado[:2])
+        self.assertEqual(Stock.objects.get(almacen=self.almacen, material=self.cemento).cantidad, 90)
+
+    def test_costo_redondeado_por_vale(self):
+        """Con PMP de 4 decimales, el cubo suma céntimos por línea igual que la reconstrucción y la anulación lo deja en cero."""
+        arena = self._material('ARE-001', 'Arena gruesa', 'M3')
+        self._ingreso(3, Decimal('33.3333'), material=arena)
+        vales = [self._salida_obra(self.t01, [(arena, 1)]) for _ in range(3)]
+
+        celda = ConsumoMensual.objects.get(material=arena)
+        self.assertEqual(celda.costo_total, Decimal('99.99'))  # 3 x 33.33, no round(99.9999) = 100.00
+        ConsumoService.reconstruir()
+        self.assertEqual(ConsumoMensual.objects.get(material=arena).costo_total, Decimal('99.99'))
+
+        for vale in vales:
+            KardexService.anular_movimiento(vale.id)
+        self.assertFalse(ConsumoMensual.objects.filter(material=arena).exists())
+
+    def test_carga_inicial_igual_a_reconstruccion(self):
+        """La migración que siembra el cubo redondea por línea como reconstruir: anular un vale viejo deja la celda en cero."""
+        from django.apps import apps as registro
+        from importlib import import_module
+        poblar_cubo = import_module('apps.logistica.migrations.0022_consumo_mensual').poblar_cubo
+
+        arena = self._material('ARE-001', 'Arena gruesa', 'M3')
+        self._ingreso(3, Decimal('33.3333'), material=arena)
+        vales = [self._salida_obra(self.t02, [(arena, 1)]) for _ in range(3)]
+
+        ConsumoMensual.objects.all().delete()
+        poblar_cubo(registro, None)
+        sembradas = self._celdas()
+        ConsumoService.reconstruir()
+        self.assertEqual(sembradas, self._celdas())
+        self.assertIn(('T-02', 'ARE-001', 3, Decimal('99.99')), sembradas)
+
+        ConsumoMensual.objects.all().delete()
+        poblar_cubo(registro, None)
+        for vale in vales:
+            KardexService.anular_movimiento(vale.id)
+        self.assertFalse(ConsumoMensual.objects.filter(material=arena).exists())
+
+    def test_drill_down_y_rollup(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/logistica/reportes/consumo-torre/', {'proyecto': self.proyecto.id, 'tramo': self.tramo.id})
+        self.assertEqual(response.context['nivel'], 'torre')
+        self.assertEqual([(f['codigo'], f['costo']) for f in response.context['resumen']], [('T-01', 400), ('T-02', 80)])
+        self.assertEqual(response.context['total'], 480)
+
+        response = self.client.get('/logistica/reportes/consumo-torre/', {'export': 'csv'})
+        lineas = [l.split(',') for l in b''.join(response.streaming_content).decode('utf-8-sig').splitlines()]
+        subtotales = [(l[0], l[1], l[2], l[3], Decimal(l[7])) for l in lineas if l[3].startswith('SUBTOTAL') or l[0] == 'TOTAL GENERAL']
+        self.assertEqual(subtotales, [
+            ('PRJ-001', 'T1', 'T-01', 'SUBTOTAL TORRE', 400),
+            ('PRJ-001', 'T1', 'T-02', 'SUBTOTAL TORRE', 80),
+            ('PRJ-001', 'T1', '', 'SUBTOTAL TRAMO', 480),
+            ('PRJ-001', '', '', 'SUBTOTAL PROYECTO', 480),
+            ('TOTAL GENERAL', '', '', '', 480),
+        ])
+
+class RequerimientoListTest(DatosObraTestCase):
+    """
+    La lista de requerimientos calcula el avance y el atraso en SQL, filtra y pagina de a 25.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.otro_proyecto = Proyecto.objects.create(codigo='PRJ-002', nombre='Proyecto Norte')
+        self.fierro = self._material()
+        hoy = timezone.localdate()
+
+        # Línea 1: 5/10 ingresado, 2/10 atendido. Línea 2: 8/4 ingresado (tope 100%), nada atendido
+        self.parcial = Requerimiento.objects.create(
+            proyecto=self.proyecto, solicitante='Capataz', fecha_solicitud=hoy - timedelta(days=10),
+            fecha_necesaria=hoy - timedelta(days=1), prioridad='URGENTE', estado='PARCIAL', creado_por=self.user
+        )
+        DetalleRequerimiento.objects.create(
+            requerimiento=self.parcial, material=self.cemento, cantidad_solicitada=10, cantidad_ingresada=5, cantidad_atendida=2
+        )
+        DetalleRequerimiento.objects.create(
+            requerimiento=self.parcial, material=self.fierro, cantidad_solicitada=4, cantidad_ingresada=8
+        )
+        # Fecha necesaria pasada pero ya atendido: no está vencido
+        self.atendido = Requerimiento.objects.create(
+            proyecto=self.otro_proyecto, codigo='REQ-N0001', solicitante='Residente', fecha_solicitud=hoy - timedelta(days=20),
+            fecha_necesaria=hoy - timedelta(days=5), prioridad='MEDIA', estado='ATENDIDO', creado_por=self.user
+        )
+        DetalleRequerimiento.objects.create(
+            requerimiento=self.atendido, material=self.cemento, cantidad_solicitada=6, cantidad_ingresada=6, cantidad_atendida=6
+        )
+
+    def _lista(self, **filtros):
+        response = self.client.get('/logistica/requerimientos/', filtros)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_avance_y_vencido(self):
+        self.client.force_login(self.user)
+        filas = {r.id: r for r in self._lista().context['requerimientos']}
+
+        parcial = filas[self.parcial.id]
+        self.assertEqual(parcial.num_lineas, 2)
+        self.assertAlmostEqual(parcial.pct_ingresado, 75.0)  # (50% + 100%) / 2
+        self.assertAlmostEqual(parcial.pct_atendido, 10.0)   # (20% + 0%) / 2
+        self.assertTrue(parcial.vencido)
+
+        atendido = filas[self.atendido.id]
+        self.assertAlmostEqual(atendido.pct_atendido, 100.0)
+        self.assertFalse(atendido.vencido)
+
+    def test_filtros(self):
+        self.client.force_login(self.user)
+        hoy = timezone.localdate()
+
+        def ids(**filtros):
+            return [r.id for r in self._lista(**filtros).context['requerimientos']]
+
+        self.assertEqual(ids(), [self.parcial.id, self.atendido.id])
+        self.assertEqual(ids(estado='ATENDIDO'), [self.atendido.id])
+        self.assertEqual(ids(prioridad='URGENTE'), [self.parcial.id])
+        self.assertEqual(ids(proyecto=str(self.otro_proyecto.id)), [self.atendido.id])
+        self.assertEqual(ids(desde=(hoy - timedelta(days=15)).isoformat()), [self.parcial.id])
+        self.assertEqual(ids(hasta=(hoy - timedelta(days=15)).isoformat()), [self.atendido.id])
+        self.assertEqual(ids(vencidos='1'), [self.parcial.id])
+        # Un proyecto mal formado se ignora en lugar de fallar
+        self.assertEqual(len(ids(proyecto='no-es-uuid')), 2)
+
+    def test_paginacion_de_25(self):
+        hoy = timezone.localdate()
+        for i in range(28):
+            Requerimiento.objects.create(
+                proyecto=self.proyecto, solicitante=f'Solicitante {i}', fecha_solicitud=hoy, creado_por=self.user
+            )
+
+        self.client.force_login(self.user)
+        primera = self._lista().context['page_obj']
+        self.assertEqual((primera.paginator.count, primera.paginator.num_pages, len(primera)), (30, 2, 25))
+        segunda = self._lista(page=2, prioridad='MEDIA').context['page_obj']
+        self.assertEqual((segunda.paginator.count, len(segunda)), (29, 4))
+        self.assertEqual(segunda[-1].id, self.atendido.id)  # El más antiguo al final
+
+    def test_detalle_con_consultas_fijas(self):
+        self.client.force_login(self.user)
+        url = f'/logistica/requerimientos/{self.parcial.id}/'
+        with CaptureQueriesContext(connection) as con_dos:
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['req'].detalles.all()), 2)
+
+        for i in range(3):
+            material = self._material(f'MAT-{i}', f'Material {i}', 'UND')
+            DetalleRequerimiento.objects.create(requerimiento=self.parcial, material=material, cantidad_solicitada=1)
+        with CaptureQueriesContext(connection) as con_cinco:
+            self.client.get(url)
+        self.assertEqual(len(con_cinco), len(con_dos))
+
+
+class BacklogAntiguedadTest(DatosObraTestCase):
+    """
+    El backlog calcula antigüedad, atraso, prioridad y cobertura con stock en la base de datos.
+    """
+
+    def setUp(self):
+        super().setUp()
+        hoy = timezone.localdate()
+
+        self.reciente = Requerimiento.objects.create(
+            proyecto=self.proyecto, solicitante='Residente', fecha_solicitud=hoy - timedelta(days=2),
+            prioridad='MEDIA', creado_por=self.user
+        )
+        DetalleRequerimiento.objects.create(requerimiento=self.reciente, material=self.cemento, cantidad_solicitada=10)
+        self.urgente = Requerimiento.objects.create(
+            proyecto=self.proyecto, solicitante='Capataz', fecha_solicitud=hoy - timedelta(days=40),
+            fecha_necesaria=hoy - timedelta(days=5), prioridad='URGENTE', creado_por=self.user
+        )
+        DetalleRequerimiento.objects.create(requerimiento=self.urgente, material=self.cemento, cantidad_solicitada=50)
+        self._ingreso(30)
+
+    def test_antiguedad_y_cobertura(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/logistica/reportes/backlog/')
+        lineas = list(response.context['pendientes'])
+        self.assertEqual([l.requerimiento_id for l in lineas], [self.urgente.id, self.reciente.id])
+
+        urgente, reciente = lineas
+        self.assertEqual((urgente.antiguedad.days, urgente.tramo, urgente.atraso.days), (40, '31-60 días', 5))
+        self.assertEqual((reciente.antiguedad.days, reciente.tramo, reciente.atraso), (2, '0-7 días', None))
+        # El stock libre (30) va primero a la línea urgente: no queda nada para la reciente
+        self.assertEqual((urgente.cubierto, reciente.cubierto), (30, 0))
+
+        fila = next(f for f in response.context['matriz'] if f['tramo'] == '31-60 días')
+        self.assertEqual(fila['celdas'][0], {'tramo': '31-60 días', 'requerimiento__prioridad': 'URGENTE', 'lineas': 1, 'vencidas': 1, 'cubiertas': 0})
+
+        response = self.client.get('/logistica/reportes/backlog/', {'export': 'csv', 'vencidos': '1'})
+        lineas = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lineas), 2)
+        self.assertEqual([Decimal(v) for v in lineas[1].split(',')[-3:]], [50, 30, 60])
+
+    def test_lineas_compiten_por_el_stock(self):
+        """El stock libre se reparte en el orden del backlog, sin contarlo dos veces y sin depender de los filtros."""
+        alta = Requerimiento.objects.create(
+            proyecto=self.proyecto, solicitante='Almacenero', fecha_solicitud=timezone.localdate(),
+            prioridad='ALTA', creado_por=self.user
+        )
+        # 8 ya ingresados para esta línea (reservados): se cubren aunque el stock libre se agote
+        DetalleRequerimiento.objects.create(requerimiento=alta, material=self.cemento, cantidad_solicitada=12, cantidad_ingresada=8)
+        Stock.objects.filter(almacen=self.almacen, material=self.cemento).update(cantidad=F('cantidad') + 8)
+        self.cemento.existencias_proyecto.filter(proyecto=self.proyecto).update(stock_total_proyecto=F('stock_total_proyecto') + 8)
+        # Libre = 38 - 8 reservados = 30: urgente (necesita 50) se lo lleva todo
+
+        self.client.force_login(self.user)
+        response = self.client.get('/logistica/reportes/backlog/')
+        cubierto = {l.requerimiento_id: l.cubierto for l in response.context['pendientes']}
+        self.assertEqual(cubierto, {self.urgente.id: 30, alta.id: 8, self.reciente.id: 0})
+        self.assertEqual(sum(f['celdas'][3 - 1]['cubiertas'] for f in response.context['matriz']), 0)
+
+        # Con 70 unidades libres: urgente 50, alta 4 + 8 reservadas, reciente el resto (16 -> 10)
+        self.cemento.existencias_proyecto.filter(proyecto=self.proyecto).update(stock_total_proyecto=F('stock_total_proyecto') + 40)
+        response = self.client.get('/logistica/reportes/backlog/', {'prioridad': 'MEDIA'})
+        self.assertEqual([l.cubierto for l in response.context['pendientes']], [10])
+        response = self.client.get('/logistica/reportes/backlog/')
+        cubierto = {l.requerimiento_id: l.cubierto for l in response.context['pendientes']}
+        self.assertEqual(cubierto, {self.urgente.id: 50, alta.id: 12, self.reciente.id: 10})
+
+class KardexValorizadoTest(DatosObraTestCase):
+    """
+    El Kardex valorizado reproduce en una pasada el PMP que KardexService guardó en Existencia.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.alm_a = self.almacen
+        self.alm_b = Almacen.objects.create(proyecto=self.proyecto, nombre='Almacén Torre', codigo='ALM-02')
+
+        self._ingreso(10, 20, self.alm_a)
+        self._ingreso(10, 30, self.alm_b)   # PMP 25
+        self._salida(5, self.alm_a)
+        self._ingreso(5, 40, self.alm_a)    # PMP (15 x 25 + 5 x 40) / 20 = 28.75
+
+    def test_proyecto_y_almacen(self):
+        lineas = list(StockService.kardex_valorizado(self.proyecto, self.cemento.id))
+        self.assertEqual([l['pmp'] for l in lineas], [20, 25, 25, Decimal('28.75')])
+        self.assertEqual([l['valor_movimiento'] for l in lineas], [200, 300, -125, 200])
+        existencia = self.cemento.existencias_proyecto.get(proyecto=self.proyecto)
+        self.assertEqual((lineas[-1]['saldo'], lineas[-1]['pmp']), (existencia.stock_total_proyecto, existencia.costo_promedio))
+        self.assertEqual(lineas[-1]['valor_inventario'], 575)
+
+        lineas = list(StockService.kardex_valorizado(self.proyecto, self.cemento.id, self.alm_a.id))
+        self.assertEqual([(l['saldo'], l['pmp']) for l in lineas], [(10, 20), (5, 25), (10, Decimal('28.75'))])
+
+        self.client.force_login(self.user)
+        response = self.client.get(f'/logistica/kardex/valorizado/{self.proyecto.id}/{self.cemento.id}/', {'almacen': self.alm_a.id})
+        self.assertEqual(response.context['actual']['valor_inventario'], Decimal('287.5'))
+        response = self.client.get(f'/logistica/kardex/valorizado/{self.proyecto.id}/{self.cemento.id}/exportar/', {'export': 'csv'})
+        filas = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(filas), 5)
+
+    @mock.patch('apps.logistica.views.KARDEX_VALORIZADO_POR_PAGINA', 2)
+    def test_pagina_sin_recorrer_todo(self):
+        """La página 2 (las filas más antiguas) se arma leyendo solo esas filas del generador."""
+        leidas = []
+        original = StockService.kardex_valorizado
+
+        def contando(*args):
+            for linea in original(*args):
+                leidas.append(linea)
+                yield linea
+
+        self.client.force_login(self.user)
+        url = f'/logistica/kardex/valorizado/{self.proyecto.id}/{self.cemento.id}/'
+        with mock.patch('apps.logistica.views.StockService.kardex_valorizado', side_effect=contando):
+            response = self.client.get(url, {'page': 2})
+        pagina = response.context['lineas']
+        self.assertEqual((pagina.paginator.count, pagina.paginator.num_pages), (4, 2))
+        self.assertEqual([l['pmp'] for l in pagina], [25, 20])
+        self.assertEqual(len(leidas), 2)
+        self.assertEqual(response.context['actual']['valor_inventario'], 575)
+
+        response = self.client.get(url, {'almacen': self.alm_a.id})
+        self.assertEqual(response.context['lineas'].paginator.count, 3)
+        self.assertEqual([(l['saldo'], l['pmp']) for l in response.context['lineas']], [(10, Decimal('28.75')), (5, 25)])
+
+    def test_anulacion_en_su_fecha(self):
+        """Anular un ingreso con movimientos posteriores: el Kardex aplica la fórmula inversa, como Existencia."""
+        fierro = self._material()
+        primero = self._ingreso(10, 10, self.alm_a, fierro)
+        self._salida(5, self.alm_a, fierro)
+        self._ingreso(10, 20, self.alm_a, fierro)
+        KardexService.anular_movimiento(primero.id)
+
+        existencia = fierro.existencias_proyecto.get(proyecto=self.proyecto)
+        self.assertEqual((existencia.stock_total_proyecto, existencia.costo_promedio), (5, Decimal('30.0001')))
+
+        lineas = list(StockService.kardex_valorizado(self.proyecto, fierro.id))
+        self.assertEqual([l['saldo'] for l in lineas], [10, 5, 15, 5])
+        self.assertTrue(lineas[-1]['anulacion'])
+        self.assertEqual(lineas[-1]['pmp'], existencia.costo_promedio)
+        self.assertEqual(lineas[-1]['valor_inventario'], Decimal('150.0005'))
+
+        lineas = list(StockService.kardex_valorizado(self.proyecto, fierro.id, self.alm_a.id))
+        self.assertEqual(lineas[-1]['saldo'], Stock.objects.get(almacen=self.alm_a, material=fierro).cantidad)
+
+        # El conteo en SQL (para paginar) coincide con las filas del generador, con anulaciones incluidas
+        for almacen_id in (None, self.alm_a.id, self.alm_b.id):
+            self.assertEqual(
+                StockService.contar_kardex_valorizado(self.proyecto, fierro.id, almacen_id),
+                len(list(StockService.kardex_valorizado(self.proyecto, fierro.id, almacen_id)))
+            )
+
+    def test_etag_incluye_almacen(self):
+        request = RequestFactory().get('/', {'almacen': str(self.alm_a.id)})
+        claves = alcance_proyecto_url(request, proyecto_id=self.proyecto.id)
+        self.assertIn(('ALMACEN', str(self.alm_a.id)), claves)
+        self.assertEqual(len(alcance_proyecto_url(RequestFactory().get('/'), proyecto_id=self.proyecto.id)), 2)
+
+class InventarioAFechaTest(DatosObraTestCase):
+    """
+    El inventario a una fecha se reconstruye igual con o sin cierre, y los cierres se descartan
+    cuando cambia un movimiento anterior al corte.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.alm_a = self.almacen
+        self.alm_b = Almacen.objects.create(proyecto=self.proyecto, nombre='Almacén Torre', codigo='ALM-02')
+
+        self.primero = self._movimiento('INGRESO_COMPRA', self.alm_a, 10, 20, datetime(2026, 1, 10))
+        self._movimiento('INGRESO_COMPRA', self.alm_a, 10, 30, datetime(2026, 2, 10))   # PMP 25
+        self.salida = self._movimiento('SALIDA_OFICINA', self.alm_a, 5, 0, datetime(2026, 2, 20))
+        self._movimiento('INGRESO_COMPRA', self.alm_b, 5, 40, datetime(2026, 3, 5))     # PMP 28.75
+
+    def _movimiento(self, tipo, almacen, cantidad, costo, fecha):
+        if tipo == 'INGRESO_COMPRA':
+            movimiento = self._ingreso(cantidad, costo, almacen)
+        else:
+            movimiento = self._salida(cantidad, almacen, tipo=tipo)
+        Movimiento.objects.filter(id=movimiento.id).update(fecha=timezone.make_aware(fecha))
+        return movimiento
+
+    def _saldos(self, dia):
+        stocks, costos, cierre = InventarioHistoricoService.saldos(self.proyecto, timezone.make_aware(dia))
+        return {a: c for (a, _), c in stocks.items() if c}, costos[self.cemento.id], cierre
+
+    def test_saldos_y_cierres(self):
+        self.assertEqual(self._saldos(datetime(2026, 2, 1))[:2], ({self.alm_a.id: 10}, (10, 20)))
+        self.assertEqual(self._saldos(datetime(2026, 3, 1))[:2], ({self.alm_a.id: 15}, (15, 25)))
+
+        existencia = self.cemento.existencias_proyecto.get(proyecto=self.proyecto)
+        actual = ({self.alm_a.id: 15, self.alm_b.id: 5}, (existencia.stock_total_proyecto, existencia.costo_promedio))
+        self.assertEqual(self._saldos(datetime(2026, 4, 1))[:2], actual)
+
+        cierre = InventarioHistoricoService.guardar_cierre(self.proyecto, timezone.make_aware(datetime(2026, 3, 1)))
+        stocks, costos, usado = self._saldos(datetime(2026, 4, 1))
+        self.assertEqual(((stocks, costos), usado), (actual, cierre))
+
+        # La anulación cuenta en su propia fecha: el cierre de marzo sigue valiendo para marzo
+        KardexService.anular_movimiento(self.salida.id)
+        self.assertEqual(self._saldos(datetime(2026, 4, 1))[:2], actual)
+        stocks, _, usado = self._saldos(datetime(2026, 11, 1))
+        self.assertEqual(usado, cierre)
+        self.assertEqual(stocks[self.alm_a.id], Stock.objects.get(almacen=self.alm_a, material=self.cemento).cantidad)
+
+        # Confirmar un vale (fechado hoy) descarta los cierres posteriores a hoy
+        futuro = InventarioHistoricoService.guardar_cierre(self.proyecto, timezone.now() + timedelta(days=30))
+        self._ingreso(1, 10, self.alm_b)
+        self.assertFalse(CierreInventario.objects.filter(id=futuro.id).exists())
+
+    def test_saldos_actuales_tras_anular_ingreso(self):
+        """Anular un ingreso con movimientos posteriores: los saldos de hoy coinciden con Stock y Existencia."""
+        InventarioHistoricoService.guardar_cierre(self.proyecto, timezone.make_aware(datetime(2026, 3, 1)))
+        KardexService.anular_movimiento(self.primero.id)
+
+        stocks, costos, usado = InventarioHistoricoService.saldos(self.proyecto, timezone.now())
+        self.assertIsNotNone(usado)
+        for stock in Stock.objects.filter(material=self.cemento):
+            self.assertEqual(stocks[(stock.almacen_id, self.cemento.id)], stock.cantidad)
+        existencia = self.cemento.existencias_proyecto.get(proyecto=self.proyecto)
+        self.assertEqual(costos[self.cemento.id], (existencia.stock_total_proyecto, existencia.costo_promedio))
+        self.assertEqual(costos[self.cemento.id], (10, Decimal('37.5')))
+
+    def test_reporte(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/logistica/reportes/inventario-a-fecha/', {'fecha': '2026-02-28'})
+        self.assertEqual(list(response.context['filas']), [['PRJ-001', 'Almacén Central', 'CEM-001', 'Cemento Sol', 'BOL', 15, 25, 375]])
+
+        response = self.client.get('/logistica/reportes/inventario-a-fecha/', {'fecha': '2026-03-31', 'export': 'csv'})
+        filas = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual([f.split(',')[1] for f in filas[1:]], ['Almacén Central', 'Almacén Torre'])
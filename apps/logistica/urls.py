@@ -9,6 +9,8 @@ from .views import(
     editar_movimiento,
     kardex_producto,
     api_consultar_stock,
+    api_consultar_stock_lote,
+    api_estadisticas_cache,
     requerimiento_list,
     requerimiento_detail,
     requerimiento_create,
@@ -17,8 +19,15 @@ from .views import(
     generar_requerimiento_pdf, # <--- Importar vista
     exportar_inventario_excel,
     exportar_kardex_excel,
+    exportar_kardex_almacen_excel,
+    kardex_valorizado,
+    exportar_kardex_valorizado,
     api_crear_trabajador,
     api_buscar_trabajador,
+    api_buscar_material,
+    matriz_stock,
+    api_matriz_stock,
+    exportar_matriz_stock_excel,
     api_listar_activos,
     cambiar_almacen_sesion,
     limpiar_almacen_sesion, # <--- Importar nueva vista
@@ -27,6 +36,7 @@ from .views import(
     reporte_consumo_torre, # <--- Nuevos reportes
     reporte_backlog,
     reporte_epp_trabajador,
+    reporte_inventario_a_fecha,
     reporte_reposicion,
     importar_datos_excel,
     descargar_plantilla_importacion
@@ -47,16 +57,26 @@ urlpatterns = [
     path('requerimientos/cerrar/<uuid:req_id>/', cerrar_requerimiento, name='cerrar_requerimiento'),
     path('requerimientos/pdf/<uuid:req_id>/', generar_requerimiento_pdf, name='generar_requerimiento_pdf'), # <--- Nueva ruta
     path('inventario/exportar/', exportar_inventario_excel, name='exportar_inventario_excel'),
+    path('inventario/matriz/', matriz_stock, name='matriz_stock'),
+    path('inventario/matriz/exportar/', exportar_matriz_stock_excel, name='exportar_matriz_stock_excel'),
+    path('api/stock/matriz/', api_matriz_stock, name='api_matriz_stock'),
     path('exportar/activos-externos/', exportar_activos_externos_excel, name='exportar_activos_externos_excel'),
     path('kardex/exportar/<uuid:almacen_id>/<uuid:material_id>/', exportar_kardex_excel, name='exportar_kardex_excel'),
+    path('kardex/exportar/<uuid:almacen_id>/', exportar_kardex_almacen_excel, name='exportar_kardex_almacen_excel'),
+    path('kardex/valorizado/<uuid:proyecto_id>/<uuid:material_id>/', kardex_valorizado, name='kardex_valorizado'),
+    path('kardex/valorizado/<uuid:proyecto_id>/<uuid:material_id>/exportar/', exportar_kardex_valorizado, name='exportar_kardex_valorizado'),
     path('reportes/transacciones/', reporte_transacciones, name='reporte_transacciones'), # <--- Nueva ruta
     path('reportes/consumo-torre/', reporte_consumo_torre, name='reporte_consumo_torre'),
     path('reportes/backlog/', reporte_backlog, name='reporte_backlog'),
     path('reportes/epp-trabajador/', reporte_epp_trabajador, name='reporte_epp_trabajador'),
+    path('reportes/inventario-a-fecha/', reporte_inventario_a_fecha, name='reporte_inventario_a_fecha'),
     path('reportes/reposicion/', reporte_reposicion, name='reporte_reposicion'),
     path('api/stock/<uuid:almacen_id>/<uuid:material_id>/', api_consultar_stock, name='api_consultar_stock'),
+    path('api/stock/lote/', api_consultar_stock_lote, name='api_consultar_stock_lote'),
+    path('api/cache/estadisticas/', api_estadisticas_cache, name='api_estadisticas_cache'),
     path('api/trabajador/nuevo/', api_crear_trabajador, name='api_crear_trabajador'),
     path('api/trabajador/buscar/', api_buscar_trabajador, name='api_buscar_trabajador'),
+    path('api/materiales/buscar/', api_buscar_material, name='api_buscar_material'),
     path('api/activos/listar/', api_listar_activos, name='api_listar_activos'),
     path('config/reset-db/', reset_database, name='reset_database'),
     path('config/cambiar-almacen/<uuid:almacen_id>/', cambiar_almacen_sesion, name='cambiar_almacen_sesion'), # <--- Nueva ruta
@@ -0,0 +1,192 @@
+"""
+VERSIONES DE DATOS Y GET CONDICIONAL (ETag / Last-Modified).
+
+El bus de invalidación (invalidacion.py) incrementa, tras cada commit, los contadores
+`VersionDatos` de los ámbitos afectados. Las vistas decoradas con
+`condicional_por_version(...)` calculan su ETag leyendo SOLO esos contadores
+(una consulta pequeña): si el navegador ya tiene esa versión, se responde 304
+sin ejecutar la vista. Útil en los campamentos con enlace satelital.
+"""
+import hashlib
+import uuid
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+# Ámbitos generales (sin clave)
+TODO = ('TODO', '')          # Reinicios / eventos "invalidar todo": afecta a todas las vistas
+GLOBAL = ('GLOBAL', '')      # Cualquier cambio
+CATALOGO = ('CATALOGO', '')  # Materiales, categorías, trabajadores, torres, etc.
+
+
+def claves_evento(evento):
+    """Traduce un evento del bus a las claves (ambito, clave) que se deben incrementar."""
+    if evento.get('todo'):
+        return [TODO, GLOBAL]
+    claves = {GLOBAL}
+    claves.update(('ALMACEN', a) for a in evento.get('almacenes', []))
+    claves.update(('PROYECTO', p) for p in evento.get('proyectos', []))
+    if evento.get('catalogos'):
+        claves.add(CATALOGO)
+    return sorted(claves)  # Orden fijo: evita deadlocks entre workers
+
+
+def incrementar_versiones(evento):
+    from .models import VersionDatos
+
+    ahora = timezone.now()
+    with transaction.atomic():
+        for ambito, clave in claves_evento(evento):
+            actualizados = VersionDatos.objects.filter(ambito=ambito, clave=clave).update(
+                version=F('version') + 1, fecha_actualizacion=ahora
+            )
+            if not actualizados:
+                VersionDatos.objects.get_or_create(
+                    ambito=ambito, clave=clave,
+                    defaults={'version': 1, 'fecha_actualizacion': ahora}
+                )
+
+
+def estado_versiones(claves):
+    """
+    Devuelve (firma, ultima_fecha) de las claves pedidas en una sola consulta.
+    Los ámbitos que nunca cambiaron cuentan como versión 0.
+    """
+    from .models import VersionDatos
+
+    filtro = Q()
+    for ambito, clave in claves:
+        filtro |= Q(ambito=ambito, clave=clave)
+
+    filas = VersionDatos.objects.filter(filtro).values_list('ambito', 'clave', 'version', 'fecha_actualizacion')
+    firma = '|'.join(sorted(f"{a}:{c}:{v}" for a, c, v, _ in filas))
+    ultima = max((f for *_, f in filas), default=None)
+    return firma, ultima
+
+
+def versiones_almacenes(almacenes):
+    """
+    Firma de versión por almacén en una sola consulta: la del almacén, la de su proyecto
+    (el PMP de Existencia cambia con ingresos a otros almacenes del proyecto), catálogos y reinicios.
+    Se usa como parte de la clave de los fragmentos cacheados de plantillas.
+    """
+    from .models import VersionDatos
+
+    ids = [str(a.id) for a in almacenes]
+    proyectos = {str(a.proyecto_id) for a in almacenes}
+    filas = VersionDatos.objects.filter(
+        Q(ambito='ALMACEN', clave__in=ids) | Q(ambito='PROYECTO', clave__in=proyectos)
+        | Q(ambito__in=[TODO[0], CATALOGO[0]], clave='')
+    ).values_list('ambito', 'clave', 'version')
+
+    por_ambito = {(a, c): v for a, c, v in filas}
+    sufijo = f"{por_ambito.get(TODO, 0)}.{por_ambito.get(CATALOGO, 0)}"
+    return {
+        str(a.id): f"{por_ambito.get(('ALMACEN', str(a.id)), 0)}.{por_ambito.get(('PROYECTO', str(a.proyecto_id)), 0)}.{sufijo}"
+        for a in almacenes
+    }
+
+
+# ==========================================
+# ALCANCES HABITUALES
+# ==========================================
+
+def alcance_almacen_activo(request, *args, **kwargs):
+    """El almacén de la sesión (o todo el sistema en Vista Global) y los catálogos."""
+    almacen = getattr(request, 'almacen_activo', None)
+    return [('ALMACEN', str(almacen.id)) if almacen else GLOBAL, CATALOGO]
+
+
+def alcance_inventario(request, *args, **kwargs):
+    """Como alcance_almacen_activo, más el proyecto del almacén: la valorización usa su PMP."""
+    almacen = getattr(request, 'almacen_activo', None)
+    claves = alcance_almacen_activo(request)
+    if almacen:
+        claves.append(('PROYECTO', str(almacen.proyecto_id)))
+    return claves
+
+
+def alcance_almacen_url(request, *args, **kwargs):
+    """El almacén indicado en la URL (`almacen_id`) y los catálogos. Ej: Kardex."""
+    return [('ALMACEN', str(kwargs['almacen_id'])), CATALOGO]
+
+
+def alcance_proyecto_url(request, *args, **kwargs):
+    """
+    El proyecto indicado en la URL (`proyecto_id`) y los catálogos. Ej: Kardex valorizado.
+    Con `?almacen=` también ese almacén: recibe vales de otros proyectos que no cambian la versión del proyecto.
+    """
+    claves = [('PROYECTO', str(kwargs['proyecto_id'])), CATALOGO]
+    try:
+        claves.append(('ALMACEN', str(uuid.UUID(request.GET['almacen']))))
+    except (KeyError, ValueError):
+        pass
+    return claves
+
+
+def alcance_global(request, *args, **kwargs):
+    return [GLOBAL]
+
+
+def alcance_proyectos(request, *args, **kwargs):
+    """
+    Todos los proyectos y los catálogos (etiquetas de torres, proveedores, trabajadores).
+    Para reportes que agregan movimientos y requerimientos de toda la empresa:
+    a diferencia de GLOBAL, no cambia por ediciones de stock mínimo, activos o permisos.
+    """
+    from apps.proyectos.models import Proyecto
+
+    return [('PROYECTO', str(p)) for p in Proyecto.objects.values_list('id', flat=True)] + [CATALOGO]
+
+
+# ==========================================
+# DECORADOR
+# ==========================================
+
+def condicional_por_version(alcance):
+    """
+    Agrega ETag/Last-Modified a una vista GET y responde 304 si el cliente ya tiene la versión.
+    `alcance(request, *args, **kwargs)` devuelve la lista de (ambito, clave) de la que dependen los datos.
+
+    El ETag incluye además la URL completa (filtros), el usuario, el almacén activo y la fecha
+    (los reportes calculan antigüedades con "hoy").
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            # Los mensajes flash se muestran una sola vez: esa respuesta no se puede reutilizar
+            if request.method not in ('GET', 'HEAD') or len(get_messages(request)):
+                return vista(request, *args, **kwargs)
+
+            firma, ultima = estado_versiones([TODO, *alcance(request, *args, **kwargs)])
+            almacen = getattr(request, 'almacen_activo', None)
+            base = '#'.join([
+                firma,
+                request.get_full_path(),
+                str(request.user.pk),
+                str(almacen.id) if almacen else '',
+                timezone.localdate().isoformat(),
+            ])
+            etag = hashlib.md5(base.encode('utf-8')).hexdigest()
+            last_modified = int(ultima.timestamp()) if ultima else None
+
+            respuesta = get_conditional_response(request, etag=quote_etag(etag), last_modified=last_modified)
+            if respuesta is None:
+                respuesta = vista(request, *args, **kwargs)
+
+            if respuesta.status_code in (200, 304):
+                respuesta.headers.setdefault('ETag', quote_etag(etag))
+                if last_modified:
+                    respuesta.headers.setdefault('Last-Modified', http_date(last_modified))
+
+            # Siempre revalidar: la respuesta es por usuario y puede cambiar en cualquier momento
+            patch_cache_control(respuesta, private=True, no_cache=True)
+            patch_vary_headers(respuesta, ['Cookie'])
+            return respuesta
+        return envoltura
+    return decorador
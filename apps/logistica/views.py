@@ -5,29 +5,45 @@ from django.contrib import messages
 from django.core.exceptions import ValidationError
 from django.http import HttpResponse, JsonResponse
 from django.template.loader import get_template
-from django.db.models import Prefetch, Q, F, Case, When, Value, DecimalField, Window, Sum
+from django.db.models import Prefetch, Q, F, Case, When, Value, CharField, DecimalField, IntegerField, FloatField, BooleanField, DateField, DurationField, Sum, Count, Avg, Max, Subquery, OuterRef, ExpressionWrapper
+from django.core.paginator import Paginator
 from django.db.models.functions import Coalesce
-from django.db.models.functions import Coalesce, Concat
+from django.db.models.functions import Coalesce, Concat, Greatest, Least
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal
+from itertools import islice
 from xhtml2pdf import pisa
 import qrcode
 from io import BytesIO
 import base64
 import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill
+from openpyxl.styles import Font, PatternFill
 import json
+import uuid
+from urllib.parse import urlencode
 from django.urls import reverse
+from django.conf import settings
 
 # Importamos modelos y formularios locales
-from .models import Movimiento, DetalleMovimiento, Stock, Almacen, Material, Proyecto, Requerimiento, Existencia, DetalleRequerimiento
+from .models import Movimiento, DetalleMovimiento, Stock, Almacen, Material, Proyecto, Requerimiento, Existencia, DetalleRequerimiento, ConsumoMensual, CierreInventario
 from .forms import MovimientoForm, DetalleMovimientoFormSet, RequerimientoForm, DetalleRequerimientoFormSet, ImportarDatosForm
-from .services import KardexService
-from apps.rrhh.models import Trabajador
+from .services import KardexService, StockService, MaterialService, ConsumoService, InventarioHistoricoService
+from .cache import cache_stock
+from .paginacion import PaginaKeyset
+from .invalidacion import publicar
+from .versiones import (
+    condicional_por_version, estado_versiones, versiones_almacenes,
+    alcance_almacen_activo, alcance_inventario, alcance_almacen_url, alcance_proyecto_url, alcance_global, alcance_proyectos, TODO,
+)
+from .cache_reportes import CacheReporte, normalizar_parametros
+from apps.rrhh.models import Trabajador, normalizar_texto
 from apps.activos.models import Activo, AsignacionActivo, Kit
 from apps.catalogo.models import Categoria, Proveedor # Necesario para crear categorías al vuelo y filtros
 from apps.core.models import Configuracion
-from apps.proyectos.models import Torre # Necesario para reporte de consumo
+from apps.core.exportacion import LibroExcel, FilaDestacada, exportar, por_lotes, TAMANO_LOTE, FORMATOS, ROJO
+from apps.proyectos.models import Tramo, Torre # Necesario para reporte de consumo
 
 # ==========================================
 # 1. REPORTES Y PDF
@@ -166,17 +182,38 @@ def generar_requerimiento_pdf(request, req_id):
 # 2. VISTAS DE INVENTARIO Y LISTADOS
 # ==========================================
 
+# Ordenamientos permitidos del inventario (clave GET 'orden' -> order_by)
+ORDENES_INVENTARIO = {
+    'codigo': ['material__codigo'],
+    'cantidad': ['-cantidad', 'material__codigo'],
+    'alerta': ['nivel_alerta', 'material__codigo'],
+    'valor': [F('valor').desc(nulls_last=True), 'material__codigo'],
+}
+INVENTARIO_POR_PAGINA = 50
+
+def _querystring_sin(request, *claves):
+    """GET actual sin las claves indicadas (para armar links de paginación/orden)."""
+    params = request.GET.copy()
+    for clave in claves:
+        params.pop(clave, None)
+    return params.urlencode()
+
 @login_required
+@condicional_por_version(alcance_inventario)
 def inventario_list(request):
     """
     Reporte de Stock Físico con Búsqueda Inteligente.
+    Paginado por almacén (?almacen=<id>&page=N) y ordenable (?orden=codigo|cantidad|alerta|valor).
     """
     query = request.GET.get('q')
     filtro = request.GET.get('filtro') # Nuevo parámetro para filtrar alertas
+    orden = request.GET.get('orden') if request.GET.get('orden') in ORDENES_INVENTARIO else 'codigo'
+    almacen_pagina = request.GET.get('almacen') # Almacén cuya página se está navegando
 
-    stocks_filter = Stock.objects.select_related('material')
+    stocks_filter = Stock.objects.select_related('material', 'material__categoria')
 
     if query:
+        # Búsqueda respaldada por índices trigram sobre UPPER(codigo/descripcion) (ver catalogo 0003)
         stocks_filter = stocks_filter.filter(
             Q(material__codigo__icontains=query) |
             Q(material__descripcion__icontains=query)
@@ -197,30 +234,89 @@ def inventario_list(request):
             cantidad_minima__gt=0
         )
 
+    # Totales por almacén en UNA consulta (el paginador no hace un COUNT por almacén)
+    conteos = dict(
+        stocks_filter.order_by().values('almacen_id').annotate(total=Count('id')).values_list('almacen_id', 'total')
+    )
+
+    # Costo promedio del proyecto (Existencia) y valorización, para la columna Valor y el orden
+    stocks_filter = stocks_filter.annotate(
+        costo_promedio=Subquery(
+            Existencia.objects.filter(
+                proyecto_id=OuterRef('almacen__proyecto_id'),
+                material_id=OuterRef('material_id')
+            ).values('costo_promedio')[:1]
+        ),
+        valor=ExpressionWrapper(F('cantidad') * F('costo_promedio'), output_field=DecimalField(max_digits=18, decimal_places=2)),
+        # Mismo semáforo que Stock.estado_alerta, pero en SQL para poder ordenar
+        nivel_alerta=Case(
+            When(cantidad_minima__gt=0, cantidad__lte=F('cantidad_minima'), then=Value(0)),
+            When(cantidad_minima__gt=0, cantidad__lte=F('cantidad_minima') * Decimal('1.2'), then=Value(1)),
+            default=Value(2),
+            output_field=IntegerField()
+        ),
+    ).order_by(*ORDENES_INVENTARIO[orden])
+
     # Si hay almacén activo, solo mostramos ese almacén en la lista
     if almacen_activo:
-        # CORRECCIÓN: Usamos filter(id=...) para mantener el prefetch_related con el filtro de stocks (búsqueda/alertas)
-        almacenes = Almacen.objects.filter(id=almacen_activo.id).prefetch_related(
-            Prefetch('stocks', queryset=stocks_filter)
-        ).distinct()
+        almacenes = list(Almacen.objects.filter(id=almacen_activo.id))
     else:
-        almacenes = Almacen.objects.prefetch_related(
-            Prefetch('stocks', queryset=stocks_filter)
-        ).distinct()
+        almacenes = list(Almacen.objects.all())
+
+    # CACHÉ DE FRAGMENTOS: cada almacén se pinta desde caché mientras su versión no cambie.
+    # La página de stocks es perezosa: solo se consulta si el fragmento no está en caché.
+    versiones = versiones_almacenes(almacenes)
+    parametros = _querystring_sin(request, 'page', 'almacen')
+    for i, almacen in enumerate(almacenes):
+        paginator = Paginator(stocks_filter.filter(almacen=almacen), INVENTARIO_POR_PAGINA)
+        paginator.count = conteos.get(almacen.id, 0)
+
+        es_navegado = str(almacen.id) == almacen_pagina
+        almacen.pagina_stocks = paginator.get_page(request.GET.get('page') if es_navegado else 1)
+        almacen.expandido = es_navegado or bool(query) or (not almacen_pagina and i == 0)
+        almacen.version_datos = versiones[str(almacen.id)]
+        almacen.parametros_pagina = '&'.join(filter(None, [parametros, f'almacen={almacen.id}']))
 
     context = {
         'almacenes': almacenes,
-        'busqueda': query
+        'busqueda': query,
+        'filtro': filtro,
+        'orden': orden,
+        'cache_segundos': settings.CACHE_FRAGMENTOS_SEGUNDOS,
     }
     return render(request, 'logistica/inventario.html', context)
 
+def _rango_fechas(desde, hasta):
+    """
+    Convierte fechas 'YYYY-MM-DD' (inclusive) en un rango [inicio, fin) de datetimes con zona horaria.
+    Así el filtro compara la columna directamente (usa índices), en vez de fecha__date.
+    """
+    inicio = fin = None
+    fecha = parse_date(desde or '')
+    if fecha:
+        inicio = timezone.make_aware(datetime.combine(fecha, time.min))
+    fecha = parse_date(hasta or '')
+    if fecha:
+        fin = timezone.make_aware(datetime.combine(fecha + timedelta(days=1), time.min))
+    return inicio, fin
+
+MOVIMIENTOS_POR_PAGINA = 50
+
 @login_required
 def movimiento_list(request):
     """
     Pantalla Principal de Movimientos.
-    Permite filtrar por estado (ej: ?estado=BORRADOR)
+    Filtros combinables: estado, tipo, desde/hasta (fecha), trabajador (DNI o nombre),
+    torre (código) y documento (referencia o NI/VS).
+    Paginación por cursor sobre (fecha, id): las páginas profundas cuestan lo mismo que la primera.
     """
     estado = request.GET.get('estado')
+    tipo = request.GET.get('tipo')
+    desde = request.GET.get('desde')
+    hasta = request.GET.get('hasta')
+    trabajador = (request.GET.get('trabajador') or '').strip()
+    torre = (request.GET.get('torre') or '').strip()
+    documento = (request.GET.get('documento') or '').strip()
     
     qs = Movimiento.objects.select_related(
         'almacen_origen', 
@@ -228,8 +324,9 @@ def movimiento_list(request):
         'torre_destino',
         'proyecto',
         'proveedor',   # Optimización para evitar N+1 queries
-        'trabajador'   # Optimización para evitar N+1 queries
-    ).order_by('-fecha')
+        'trabajador',  # Optimización para evitar N+1 queries
+        'creado_por'
+    )
 
     # FILTRO POR CONTEXTO DE ALMACÉN
     almacen_activo = getattr(request, 'almacen_activo', None)
@@ -241,26 +338,70 @@ def movimiento_list(request):
 
     if estado:
         qs = qs.filter(estado=estado)
-    else:
-        qs = qs[:50] # Filtramos los últimos 50 para no saturar si no hay filtro
+    if tipo:
+        qs = qs.filter(tipo=tipo)
+
+    inicio, fin = _rango_fechas(desde, hasta)
+    if inicio:
+        qs = qs.filter(fecha__gte=inicio)
+    if fin:
+        qs = qs.filter(fecha__lt=fin)
+
+    if trabajador:
+        qs = qs.filter(
+            Q(trabajador__dni=trabajador) |
+            Q(trabajador__busqueda__contains=normalizar_texto(trabajador))
+        )
+    if torre:
+        qs = qs.filter(torre_destino__codigo__icontains=torre)
+    if documento:
+        qs = qs.filter(
+            Q(documento_referencia__icontains=documento) |
+            Q(nota_ingreso__iexact=documento)
+        )
+
+    # Página perezosa: solo se consulta si el fragmento de la tabla no está en caché
+    movimientos = PaginaKeyset(
+        qs, 'fecha',
+        cursor=request.GET.get('cursor'),
+        direccion=request.GET.get('dir'),
+        por_pagina=MOVIMIENTOS_POR_PAGINA
+    )
+
+    # La tabla se cachea por URL completa (filtros + cursor) + versión de datos
+    version_datos, _ = estado_versiones([TODO, *alcance_almacen_activo(request)])
     
     context = {
-        'movimientos': qs,
-        'estado_filtro': estado
+        'movimientos': movimientos,
+        'estado_filtro': estado,
+        'tipo_filtro': tipo,
+        'filtros': {
+            'desde': desde or '', 'hasta': hasta or '', 'trabajador': trabajador,
+            'torre': torre, 'documento': documento,
+        },
+        'tipos': Movimiento.TIPOS_MOVIMIENTO,
+        'estados': Movimiento.ESTADOS,
+        'parametros': _querystring_sin(request, 'cursor', 'dir'),
+        'version_datos': version_datos,
+        'cache_segundos': settings.CACHE_FRAGMENTOS_SEGUNDOS,
     }
     return render(request, 'logistica/movimiento_list.html', context)
 
+KARDEX_POR_PAGINA = 100
+
 @login_required
+@condicional_por_version(alcance_almacen_url)
 def kardex_producto(request, almacen_id, material_id):
     """
     Muestra la historia clínica de un material específico en un almacén.
+    Paginado por cursor (lo más reciente primero): solo se leen las filas visibles.
+    El saldo de la página sale de UNA suma en BD hasta su fila más reciente (saldo de arrastre).
     """
     almacen = get_object_or_404(Almacen, id=almacen_id)
     material = get_object_or_404(Material, id=material_id)
 
-    # 1. Consulta Optimizada con Window Functions
-    # Calculamos el saldo acumulado y clasificamos E/S directamente en la BD
-    movimientos = DetalleMovimiento.objects.filter(
+    # 1. Líneas confirmadas del material en el almacén, con el flujo (+/-) calculado en la BD
+    lineas = DetalleMovimiento.objects.filter(
         material=material,
         movimiento__estado='CONFIRMADO'
     ).filter(
@@ -273,73 +414,266 @@ def kardex_producto(request, almacen_id, material_id):
             When(movimiento__almacen_origen=almacen, then=F('cantidad') * -1), # Es Salida (-)
             default=Value(0),
             output_field=DecimalField(max_digits=12, decimal_places=2)
-        ),
-        # Clasificación visual para el template (0 o valor)
-        cant_entrada=Case(
-            When(movimiento__almacen_destino=almacen, then=F('cantidad')),
-            default=Value(0),
-            output_field=DecimalField(max_digits=12, decimal_places=2)
-        ),
-        cant_salida=Case(
-            When(movimiento__almacen_origen=almacen, then=F('cantidad')),
-            default=Value(0),
-            output_field=DecimalField(max_digits=12, decimal_places=2)
-        )
-    ).annotate(
-        # Calcular Saldo Acumulado (Running Total) cronológicamente
-        saldo_historico=Window(
-            expression=Sum('flujo_cantidad'),
-            order_by=[F('movimiento__fecha').asc(), F('id').asc()]
         )
-    ).select_related('movimiento', 'movimiento__creado_por', 'requerimiento').order_by('-movimiento__fecha', '-id')
+    )
 
+    # 2. Filas livianas (values) en vez de instancias completas
+    filas = lineas.values(
+        'id', 'flujo_cantidad', 'es_stock_libre', 'requerimiento__codigo',
+        'movimiento_id', 'movimiento__fecha', 'movimiento__tipo', 'movimiento__nota_ingreso',
+        'movimiento__documento_referencia', 'movimiento__requerimiento__codigo',
+        'movimiento__creado_por__username', 'movimiento__creado_por__first_name', 'movimiento__creado_por__last_name',
+    )
+    pagina = PaginaKeyset(
+        filas, 'movimiento__fecha', campo_pk='id',
+        cursor=request.GET.get('cursor'),
+        direccion=request.GET.get('dir'),
+        por_pagina=KARDEX_POR_PAGINA
+    )
+    filas_pagina = list(pagina)
+
+    # 3. Saldo de arrastre: acumulado hasta la fila más reciente de la página (incluida)
+    saldo = Decimal(0)
+    if filas_pagina:
+        tope = filas_pagina[0]
+        saldo = lineas.filter(
+            Q(movimiento__fecha__lt=tope['movimiento__fecha']) |
+            Q(movimiento__fecha=tope['movimiento__fecha'], id__lte=tope['id'])
+        ).aggregate(total=Sum('flujo_cantidad'))['total'] or Decimal(0)
+
+    tipos = dict(Movimiento.TIPOS_MOVIMIENTO)
     movimientos_visuales = []
     
-    # 2. Procesamiento ligero para etiquetas visuales
-    for detalle in movimientos:
-        mov = detalle.movimiento
-        tipo_original = mov.tipo
-        
+    # 4. Procesamiento ligero para etiquetas visuales (de la más reciente a la más antigua)
+    for fila in filas_pagina:
+        flujo = fila['flujo_cantidad']
+        tipo_visual = fila['movimiento__tipo']
         # Ajuste de etiqueta visual para transferencias
-        tipo_visual = tipo_original
-        if detalle.cant_entrada > 0 and 'SALIDA' in tipo_original:
-             tipo_visual = 'TRANSFERENCIA_ENTRADA'
+        if flujo > 0 and 'SALIDA' in tipo_visual:
+            tipo_visual = 'TRANSFERENCIA_ENTRADA'
 
-        detalle.tipo_visual = tipo_visual
-        
-        # Mapeo de campos anotados a los nombres que espera el template
-        detalle.cantidad_entrada = detalle.cant_entrada
-        detalle.cantidad_salida = detalle.cant_salida
-        detalle.saldo_calculado = detalle.saldo_historico # Usamos el valor calculado por BD
-        
         # Lógica de etiqueta de Asignación
-        if detalle.es_stock_libre:
-            detalle.asignacion_visual = "STOCK LIBRE"
-        elif detalle.requerimiento:
-            detalle.asignacion_visual = f"{detalle.requerimiento.codigo}"
-        elif mov.requerimiento:
-            detalle.asignacion_visual = f"{mov.requerimiento.codigo}"
+        if fila['es_stock_libre']:
+            asignacion = "STOCK LIBRE"
         else:
-            detalle.asignacion_visual = "STOCK LIBRE"
-
-        movimientos_visuales.append(detalle)
+            asignacion = fila['requerimiento__codigo'] or fila['movimiento__requerimiento__codigo'] or "STOCK LIBRE"
+
+        nombre_usuario = f"{fila['movimiento__creado_por__first_name']} {fila['movimiento__creado_por__last_name']}".strip()
+
+        movimientos_visuales.append({
+            'movimiento_id': fila['movimiento_id'],
+            'fecha': fila['movimiento__fecha'],
+            'tipo_visual': tipos.get(tipo_visual, tipo_visual),
+            'es_ingreso': flujo > 0,
+            'nota_ingreso': fila['movimiento__nota_ingreso'],
+            'documento_referencia': fila['movimiento__documento_referencia'],
+            'asignacion_visual': asignacion,
+            'cantidad_entrada': flujo if flujo > 0 else 0,
+            'cantidad_salida': -flujo if flujo < 0 else 0,
+            'saldo_calculado': saldo,
+            'usuario': nombre_usuario or fila['movimiento__creado_por__username'],
+        })
+        saldo -= flujo
 
     context = {
         'almacen': almacen,
         'material': material,
-        'movimientos': movimientos_visuales
+        'movimientos': movimientos_visuales,
+        'pagina': pagina,
+        'parametros': _querystring_sin(request, 'cursor', 'dir'),
     }
     return render(request, 'logistica/kardex_producto.html', context)
 
+KARDEX_VALORIZADO_POR_PAGINA = 100
+
+def _contexto_kardex_valorizado(request, proyecto_id, material_id):
+    """Proyecto, material y almacén (opcional, ?almacen=) del Kardex valorizado."""
+    proyecto = get_object_or_404(Proyecto, id=proyecto_id)
+    material = get_object_or_404(Material, id=material_id)
+    almacen = None
+    if request.GET.get('almacen'):
+        try:
+            almacen = Almacen.objects.filter(id=uuid.UUID(request.GET['almacen'])).first()
+        except ValueError:
+            pass
+    return proyecto, material, almacen
+
+class _KardexRecientePrimero:
+    """
+    Secuencia para Paginator sobre el generador cronológico del Kardex valorizado, mostrada al revés.
+    Cada corte recorre el generador (que arrastra saldo y PMP) solo hasta la última fila que necesita.
+    """
+
+    def __init__(self, generar, total):
+        self.generar = generar
+        self.total = total
+
+    def count(self):
+        return self.total
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, corte):
+        inicio, fin = max(self.total - corte.stop, 0), max(self.total - corte.start, 0)
+        lineas = list(islice(self.generar(), inicio, fin))
+        lineas.reverse()
+        return lineas
+
+def _tipo_kardex_valorizado(linea, tipos):
+    """Etiqueta del tipo de operación (las reversiones de vales anulados se marcan como tales)."""
+    etiqueta = tipos.get(linea['tipo'], linea['tipo'])
+    return f"Anulación: {etiqueta}" if linea['anulacion'] else etiqueta
+
+@login_required
+@condicional_por_version(alcance_proyecto_url)
+def kardex_valorizado(request, proyecto_id, material_id):
+    """
+    Kardex Valorizado de un material en un proyecto (todos sus almacenes) o en un almacén.
+    Costo unitario, valor del movimiento, saldo, PMP y valor del inventario línea por línea,
+    calculados en una sola pasada ordenada (StockService.kardex_valorizado).
+    La pantalla muestra lo más reciente primero: el total se cuenta en SQL y el recorrido se
+    corta al final de la página pedida, sin guardar en memoria más que esa página.
+    """
+    proyecto, material, almacen = _contexto_kardex_valorizado(request, proyecto_id, material_id)
+    almacen_id = almacen.id if almacen else None
+
+    lineas = _KardexRecientePrimero(
+        lambda: StockService.kardex_valorizado(proyecto, material.id, almacen_id),
+        StockService.contar_kardex_valorizado(proyecto, material.id, almacen_id),
+    )
+    pagina = Paginator(lineas, KARDEX_VALORIZADO_POR_PAGINA).get_page(request.GET.get('page'))
+    tipos = dict(Movimiento.TIPOS_MOVIMIENTO)
+    for linea in pagina:
+        linea['tipo_visual'] = _tipo_kardex_valorizado(linea, tipos)
+
+    # Saldo actual desde Stock/Existencia (coinciden con la última fila) sin recorrer todo el Kardex
+    existencia = material.existencias_proyecto.filter(proyecto=proyecto).first()
+    pmp = existencia.costo_promedio if existencia else Decimal(0)
+    if almacen:
+        saldo = Stock.objects.filter(almacen=almacen, material=material).values_list('cantidad', flat=True).first() or Decimal(0)
+    else:
+        saldo = existencia.stock_total_proyecto if existencia else Decimal(0)
+
+    context = {
+        'proyecto': proyecto,
+        'material': material,
+        'almacen': almacen,
+        'almacenes': Almacen.objects.filter(proyecto=proyecto).only('id', 'nombre'),
+        'actual': {'saldo': saldo, 'pmp': pmp, 'valor_inventario': saldo * pmp},
+        'lineas': pagina,
+        'parametros': _querystring_sin(request, 'page'),
+    }
+    return render(request, 'logistica/kardex_valorizado.html', context)
+
+@login_required
+@condicional_por_version(alcance_proyecto_url)
+def exportar_kardex_valorizado(request, proyecto_id, material_id):
+    """Kardex Valorizado en Excel (o CSV con ?export=csv), en orden cronológico y en streaming."""
+    proyecto, material, almacen = _contexto_kardex_valorizado(request, proyecto_id, material_id)
+    tipos = dict(Movimiento.TIPOS_MOVIMIENTO)
+
+    def generar():
+        for l in StockService.kardex_valorizado(proyecto, material.id, almacen.id if almacen else None):
+            yield [
+                timezone.localtime(l['fecha']).strftime("%d/%m/%Y %H:%M"),
+                _tipo_kardex_valorizado(l, tipos),
+                f"{l['nota_ingreso'] or ''} {l['documento'] or ''}",
+                l['almacen'],
+                l['entrada'], l['salida'], l['saldo'],
+                round(l['costo_unitario'], 4), round(l['valor_movimiento'], 2),
+                l['pmp'], round(l['valor_inventario'], 2),
+                l['usuario'],
+            ]
+
+    return exportar(
+        request.GET.get('export', 'excel'),
+        f"Kardex_Valorizado_{material.codigo}",
+        f"Kardex Valorizado {material.codigo}",
+        ["Fecha", "Tipo Operación", "Documento", "Almacén", "Entrada", "Salida", "Saldo",
+         "Costo Unit. (S/.)", "Valor Mov. (S/.)", "PMP (S/.)", "Valor Inventario (S/.)", "Usuario"],
+        generar(),
+        preambulo=[
+            ["Material:", f"{material.codigo} - {material.descripcion}"],
+            ["Proyecto:", str(proyecto)],
+            ["Almacén:", almacen.nombre if almacen else "Todos los almacenes del proyecto"],
+            [],
+        ],
+        anchos={'B': 30, 'C': 25, 'D': 25}
+    )
+
+REQUERIMIENTOS_POR_PAGINA = 25
+
 @login_required
 def requerimiento_list(request):
     """
     Lista de seguimiento de Requerimientos (Pedidos de Obra).
+    Filtros: estado, prioridad, proyecto, desde/hasta (fecha de solicitud) y vencidos.
+    El avance de cada pedido se calcula en SQL (una consulta agrupada por página).
     """
-    requerimientos = Requerimiento.objects.select_related('proyecto', 'creado_por').order_by('-fecha_solicitud')
+    estado = request.GET.get('estado')
+    prioridad = request.GET.get('prioridad')
+    proyecto_id = request.GET.get('proyecto')
+    desde = parse_date(request.GET.get('desde') or '')
+    hasta = parse_date(request.GET.get('hasta') or '')
+    solo_vencidos = request.GET.get('vencidos') == '1'
+    hoy = timezone.localdate()
+
+    requerimientos = Requerimiento.objects.all()
+    if estado:
+        requerimientos = requerimientos.filter(estado=estado)
+    if prioridad:
+        requerimientos = requerimientos.filter(prioridad=prioridad)
+    if proyecto_id:
+        try:
+            requerimientos = requerimientos.filter(proyecto_id=uuid.UUID(proyecto_id))
+        except ValueError:
+            pass
+    if desde:
+        requerimientos = requerimientos.filter(fecha_solicitud__gte=desde)
+    if hasta:
+        requerimientos = requerimientos.filter(fecha_solicitud__lte=hasta)
+    if solo_vencidos:
+        requerimientos = requerimientos.filter(fecha_necesaria__lt=hoy, estado__in=['PENDIENTE', 'PARCIAL'])
+
+    # Avance por línea (0..1), promediado: no mezcla unidades (bolsas vs metros)
+    def avance(campo):
+        return Avg(Case(
+            When(detalles__cantidad_solicitada__gt=0, then=Least(
+                ExpressionWrapper(F(f'detalles__{campo}') * 1.0 / F('detalles__cantidad_solicitada'), output_field=FloatField()),
+                Value(1.0)
+            )),
+            default=Value(0.0),
+            output_field=FloatField()
+        )) * 100
+
+    con_avance = requerimientos.select_related('proyecto', 'creado_por').annotate(
+        num_lineas=Count('detalles'),
+        pct_ingresado=avance('cantidad_ingresada'),
+        pct_atendido=avance('cantidad_atendida'),
+        vencido=Case(
+            When(fecha_necesaria__lt=hoy, estado__in=['PENDIENTE', 'PARCIAL'], then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField()
+        ),
+    ).order_by('-fecha_solicitud', '-fecha_creacion', '-id')
+
+    paginator = Paginator(con_avance, REQUERIMIENTOS_POR_PAGINA)
+    paginator.count = requerimientos.count()  # COUNT simple, sin el GROUP BY de los agregados
+    page_obj = paginator.get_page(request.GET.get('page'))
     
     context = {
-        'requerimientos': requerimientos
+        'requerimientos': page_obj,
+        'page_obj': page_obj,
+        'parametros': _querystring_sin(request, 'page'),
+        'filtros': {
+            'estado': estado or '', 'prioridad': prioridad or '', 'proyecto': proyecto_id or '',
+            'desde': request.GET.get('desde', ''), 'hasta': request.GET.get('hasta', ''),
+            'vencidos': solo_vencidos,
+        },
+        'estados': Requerimiento.ESTADOS,
+        'prioridades': Requerimiento.PRIORIDADES,
+        'proyectos': Proyecto.objects.filter(activo=True).only('id', 'codigo', 'nombre'),
     }
     return render(request, 'logistica/requerimiento_list.html', context)
 
@@ -347,10 +681,18 @@ def requerimiento_list(request):
 def requerimiento_detail(request, req_id):
     """
     Ver el progreso de un requerimiento: Qué se pidió vs Qué se ha entregado.
+    Número fijo de consultas: cabecera, detalles+material, salidas, detalles de salidas+material.
     """
-    req = get_object_or_404(Requerimiento, id=req_id)
-    # Salidas confirmadas que han atendido este requerimiento
-    salidas = req.salidas.filter(estado='CONFIRMADO').order_by('-fecha')
+    req = get_object_or_404(
+        Requerimiento.objects.select_related('proyecto', 'creado_por').prefetch_related(
+            Prefetch('detalles', queryset=DetalleRequerimiento.objects.select_related('material'))
+        ),
+        id=req_id
+    )
+    # Salidas confirmadas que han atendido este requerimiento (con sus materiales)
+    salidas = req.salidas.filter(estado='CONFIRMADO').select_related('creado_por').prefetch_related(
+        Prefetch('detalles', queryset=DetalleMovimiento.objects.select_related('material'))
+    ).order_by('-fecha')
     
     context = {
         'req': req,
@@ -395,11 +737,124 @@ def requerimiento_create(request):
         'formset': formset,
         'titulo': "Nuevo Requerimiento",
         'boton_texto': "Crear Pedido",
-        'materiales_disponibles': Material.objects.filter(activo=True).order_by('codigo'),
         'trabajadores_disponibles': Trabajador.objects.filter(activo=True).order_by('nombres'),
     }
     return render(request, 'logistica/requerimiento_form.html', context)
 
+MATRIZ_FILAS_POR_PAGINA = 100
+MATRIZ_COLUMNAS_POR_PAGINA = 30
+
+def _contexto_matriz(request):
+    """
+    Proyecto elegido (?proyecto=, o el del almacén activo), proyectos visibles
+    y almacenes del proyecto a los que el usuario tiene acceso (columnas de la matriz).
+    """
+    almacenes_visibles = Almacen.objects.all() if request.user.is_superuser else request.almacenes_permitidos
+    proyectos = Proyecto.objects.filter(almacenes__in=almacenes_visibles).distinct().order_by('codigo')
+
+    proyecto_id = request.GET.get('proyecto')
+    almacen_activo = getattr(request, 'almacen_activo', None)
+    proyecto = None
+    if proyecto_id:
+        try:
+            proyecto = proyectos.filter(id=proyecto_id).first()
+        except ValidationError:
+            proyecto = None
+    if proyecto is None:
+        proyecto = almacen_activo.proyecto if almacen_activo else proyectos.first()
+
+    almacenes = list(
+        almacenes_visibles.filter(proyecto=proyecto).order_by('-es_principal', 'nombre').values('id', 'codigo', 'nombre')
+    ) if proyecto else []
+    return proyecto, proyectos, almacenes
+
+@login_required
+def matriz_stock(request):
+    """
+    Matriz de stock Material x Almacén de un proyecto.
+    La página solo dibuja el esqueleto: filas y columnas se cargan por páginas desde api_matriz_stock
+    (scroll infinito en filas, ventanas de columnas), así cientos de almacenes x miles de materiales
+    no se renderizan de una vez.
+    """
+    proyecto, proyectos, almacenes = _contexto_matriz(request)
+    context = {
+        'proyecto': proyecto,
+        'proyectos': proyectos,
+        'num_almacenes': len(almacenes),
+        'q': request.GET.get('q', ''),
+        'columnas_por_pagina': MATRIZ_COLUMNAS_POR_PAGINA,
+    }
+    return render(request, 'logistica/matriz_stock.html', context)
+
+@login_required
+@condicional_por_version(alcance_global)
+def api_matriz_stock(request):
+    """
+    Página de la matriz: GET proyecto, q, page (filas de materiales), col (ventana de almacenes).
+    Consultas: filas agrupadas (1) + conteo (1) + celdas de la página (1) + PMP (1) + totales por almacén (1).
+    """
+    proyecto, _, almacenes = _contexto_matriz(request)
+    if not proyecto:
+        return JsonResponse({'almacenes': [], 'filas': [], 'paginacion': {'page': 1, 'num_pages': 0, 'count': 0}})
+    q = request.GET.get('q', '').strip()
+    almacen_ids = [a['id'] for a in almacenes]
+
+    # Ventana de columnas (almacenes)
+    paginas_columnas = Paginator(almacenes, MATRIZ_COLUMNAS_POR_PAGINA)
+    columnas = paginas_columnas.get_page(request.GET.get('col'))
+    ids_columnas = [str(a['id']) for a in columnas]
+
+    # Página de filas (materiales), agrupadas sobre TODOS los almacenes del proyecto
+    pagina = Paginator(StockService.matriz_filas(almacen_ids, q), MATRIZ_FILAS_POR_PAGINA).get_page(request.GET.get('page'))
+    material_ids = [str(f['material_id']) for f in pagina]
+
+    celdas = StockService.matriz_celdas(ids_columnas, material_ids)
+    costos = StockService.matriz_costos(proyecto.id, material_ids)
+    totales = StockService.matriz_totales_almacen(almacen_ids, proyecto.id, q)
+
+    filas = []
+    for fila in pagina:
+        material_id = str(fila['material_id'])
+        costo = costos.get(material_id, Decimal(0))
+        filas.append({
+            'material_id': material_id,
+            'codigo': fila['material__codigo'],
+            'descripcion': fila['material__descripcion'],
+            'unidad': fila['material__unidad_medida'],
+            'celdas': [celdas.get((material_id, a_id)) for a_id in ids_columnas],
+            'total': fila['total'],
+            'costo_promedio': costo,
+            'valor': fila['total'] * costo,
+        })
+
+    return JsonResponse({
+        'proyecto': {'id': proyecto.id, 'nombre': str(proyecto)},
+        'almacenes': [
+            {
+                'id': a['id'], 'codigo': a['codigo'], 'nombre': a['nombre'],
+                'cantidad': totales.get(str(a['id']), (0, 0))[0],
+                'valor': totales.get(str(a['id']), (0, 0))[1],
+            }
+            for a in columnas
+        ],
+        'filas': filas,
+        'totales': {
+            'cantidad': sum((c for c, _ in totales.values()), Decimal(0)),
+            'valor': sum((v for _, v in totales.values()), Decimal(0)),
+        },
+        'paginacion': {
+            'page': pagina.number,
+            'num_pages': pagina.paginator.num_pages,
+            'count': pagina.paginator.count,
+            'tiene_siguiente': pagina.has_next(),
+        },
+        'columnas': {
+            'pagina': columnas.number,
+            'num_paginas': paginas_columnas.num_pages,
+            'total': len(almacenes),
+        },
+    })
+
 # ==========================================
 # 3. CREACIÓN Y GESTIÓN DE MOVIMIENTOS
 # ==========================================
@@ -538,10 +993,8 @@ def operacion_almacen(request, tipo_accion, almacen_id):
         'almacen': almacen,
         'titulo': f"{'Salida' if tipo_accion == 'salida' else 'Ingreso'} de Materiales{' - ' + almacen.nombre if almacen else ''}",
         'boton_texto': f"Confirmar {'Salida' if tipo_accion == 'salida' else 'Ingreso'}",
-        'materiales_disponibles': Material.objects.filter(activo=True).order_by('codigo'),
         'reqs_materiales_json': json.dumps(reqs_map),
         'mats_reqs_json': json.dumps(mats_reqs_map), # Enviamos el nuevo mapa al template
-        'materiales_tipos_json': json.dumps({str(id): tipo for id, tipo in Material.objects.values_list('id', 'tipo')}), # Mapa de tipos para JS
     }
     return render(request, 'logistica/operacion_form.html', context)
 
@@ -642,26 +1095,91 @@ def anular_movimiento(request, movimiento_id):
 @login_required
 def api_consultar_stock(request, almacen_id, material_id):
     """
-    API JSON: Devuelve el stock actual de un material y su costo promedio.
+    API JSON: Devuelve el stock actual de un material, su costo promedio y el stock libre.
+    Se sirve desde la caché local (invalidada por KardexService al confirmar/anular).
     """
     try:
         if str(almacen_id) == '00000000-0000-0000-0000-000000000000':
-            return JsonResponse({'stock': 0, 'precio': 0})
+            return JsonResponse({'stock': 0, 'precio': 0, 'stock_libre': 0})
 
-        item = Stock.objects.filter(almacen_id=almacen_id, material_id=material_id).first()
-        stock_actual = item.cantidad if item else 0
-        
-        # Obtener Costo Promedio (Existencia del Proyecto)
-        precio = 0
-        almacen = item.almacen if item else Almacen.objects.filter(id=almacen_id).first()
-        if almacen and almacen.proyecto:
-            existencia = Existencia.objects.filter(proyecto=almacen.proyecto, material_id=material_id).first()
-            if existencia:
-                precio = existencia.costo_promedio
-
-        return JsonResponse({'stock': stock_actual, 'precio': precio})
+        datos = cache_stock.obtener(almacen_id, material_id, StockService.consultar_stock)
+
+        return JsonResponse({
+            'stock': datos['stock'],
+            'precio': datos['precio'],
+            'stock_libre': datos['stock_libre'],
+        })
     except Exception as e:
-        return JsonResponse({'stock': 0, 'precio': 0, 'error': str(e)})
+        return JsonResponse({'stock': 0, 'precio': 0, 'stock_libre': 0, 'error': str(e)})
+
+MAX_MATERIALES_LOTE = 1000
+MAX_ALMACENES_LOTE = 50
+
+def _ids_parametro(datos, nombre):
+    """Lee una lista de UUIDs de `?nombre=a,b,c` o `?nombre=a&nombre=b` (sin duplicados, en orden)."""
+    ids = []
+    for valor in datos.getlist(nombre):
+        for parte in valor.split(','):
+            parte = parte.strip()
+            if parte:
+                ids.append(str(uuid.UUID(parte)))
+    return list(dict.fromkeys(ids))
+
+@login_required
+def api_consultar_stock_lote(request):
+    """
+    API JSON: Stock, costo promedio, stock reservado y stock libre de VARIOS materiales
+    en uno o varios almacenes (una consulta por tabla, no una petición por fila).
+    Parámetros (GET o POST): materiales=<uuid,...> y opcionalmente almacenes=<uuid,...>
+    (por defecto, el almacén activo de la sesión).
+    """
+    datos = request.POST if request.method == 'POST' else request.GET
+    try:
+        material_ids = _ids_parametro(datos, 'materiales')
+        almacen_ids = _ids_parametro(datos, 'almacenes')
+    except ValueError:
+        return JsonResponse({'error': 'Identificador inválido'}, status=400)
+
+    if not almacen_ids and request.almacen_activo:
+        almacen_ids = [str(request.almacen_activo.id)]
+    if not material_ids or not almacen_ids:
+        return JsonResponse({'results': []})
+    if len(material_ids) > MAX_MATERIALES_LOTE or len(almacen_ids) > MAX_ALMACENES_LOTE:
+        return JsonResponse({
+            'error': f'Máximo {MAX_MATERIALES_LOTE} materiales y {MAX_ALMACENES_LOTE} almacenes por consulta'
+        }, status=400)
+
+    # Seguridad: solo almacenes permitidos al usuario
+    if not request.user.is_superuser:
+        permitidos = {str(pk) for pk in request.almacenes_permitidos.filter(id__in=almacen_ids).values_list('id', flat=True)}
+        almacen_ids = [a for a in almacen_ids if a in permitidos]
+
+    resultado = cache_stock.obtener_lote(almacen_ids, material_ids, StockService.consultar_stock_lote)
+
+    results = []
+    for almacen_id in almacen_ids:
+        for material_id in material_ids:
+            item = resultado.get((almacen_id, material_id))
+            if item is None:
+                continue
+            results.append({
+                'almacen_id': almacen_id,
+                'material_id': material_id,
+                'stock': item['stock'],
+                'precio': item['precio'],
+                'stock_reservado': item['stock_reservado'],
+                'stock_libre': item['stock_libre'],
+            })
+    return JsonResponse({'results': results})
+
+@login_required
+def api_estadisticas_cache(request):
+    """
+    API JSON (Solo Admin): Contadores de aciertos/fallos de la caché de stock de este worker.
+    """
+    if not request.user.is_superuser:
+        return JsonResponse({'error': 'Acceso denegado'}, status=403)
+    return JsonResponse({'stock': cache_stock.estadisticas()})
 
 @login_required
 def api_crear_trabajador(request):
@@ -699,30 +1217,76 @@ def api_crear_trabajador(request):
 def api_buscar_trabajador(request):
     """
     Buscador optimizado para miles de registros.
+    Filtra sobre la columna normalizada `busqueda` (sin tildes, mayúsculas; índice trigram)
+    y ordena por relevancia: DNI exacto > prefijo (DNI o nombre) > coincidencia parcial.
     """
     q = request.GET.get('q', '').strip()
     if len(q) < 2:
         return JsonResponse({'results': []})
-    
-    qs = Trabajador.objects.filter(activo=True).filter(
-        Q(nombres__icontains=q) | Q(apellidos__icontains=q) | Q(dni__icontains=q)
-    ).values('id', 'nombres', 'apellidos', 'dni')[:20] # Limitamos a 20 resultados
-    # Concatenamos nombres + espacio + apellidos para permitir búsquedas como "Juan Perez"
-    qs = Trabajador.objects.filter(activo=True).annotate(
-        nombre_completo=Concat('nombres', Value(' '), 'apellidos')
-    ).filter(
-        Q(nombre_completo__icontains=q) | Q(dni__icontains=q)
-    ).values('id', 'nombres', 'apellidos', 'dni')[:20]
-    
+
+    texto = normalizar_texto(q)
+    qs = Trabajador.objects.filter(activo=True, busqueda__contains=texto).annotate(
+        relevancia=Case(
+            When(dni=q, then=Value(0)),
+            When(Q(dni__startswith=q) | Q(busqueda__startswith=texto), then=Value(1)),
+            default=Value(2),
+            output_field=IntegerField()
+        )
+    ).order_by('relevancia', 'apellidos', 'nombres').values('id', 'nombres', 'apellidos', 'dni')[:20] # Limitamos a 20 resultados
+
     return JsonResponse({'results': list(qs)})
 
 @login_required
+def api_buscar_material(request):
+    """
+    Buscador del catálogo para los formularios (typeahead).
+    GET: q, categoria, tipo, requerimiento (solo sus materiales), limite (máx. 50).
+    """
+    q = request.GET.get('q', '').strip()
+    if not q:
+        return JsonResponse({'results': []})
+
+    try:
+        limite = int(request.GET.get('limite') or 10)
+        requerimiento_id = request.GET.get('requerimiento') or None
+        categoria_id = request.GET.get('categoria') or None
+        for valor in (requerimiento_id, categoria_id):
+            if valor:
+                uuid.UUID(valor)
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+
+    resultados = MaterialService.buscar(
+        q,
+        categoria_id=categoria_id,
+        tipo=request.GET.get('tipo') or None,
+        requerimiento_id=requerimiento_id,
+        limite=limite
+    )
+    return JsonResponse({'results': resultados})
+
+ACTIVOS_POR_PAGINA = 50
+
+@login_required
+@condicional_por_version(alcance_global)
 def api_listar_activos(request):
     """
     API para llenar dinámicamente el select de activos según la operación.
+    GET: tipo_operacion, almacen_id, material, q (código / serie / nombre), cursor, limite.
+    Paginada por cursor sobre `codigo` (único): devuelve {'results': [...], 'siguiente': cursor | None}.
     """
     tipo_operacion = request.GET.get('tipo_operacion', '')
     almacen_id = request.GET.get('almacen_id', '')
+    material_id = request.GET.get('material', '')
+    q = request.GET.get('q', '').strip()
+    cursor = request.GET.get('cursor', '')
+    try:
+        limite = max(1, min(int(request.GET.get('limite') or ACTIVOS_POR_PAGINA), 200))
+        for valor in (almacen_id, material_id):
+            if valor:
+                uuid.UUID(valor)
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
     
     qs = Activo.objects.all()
     
@@ -740,9 +1304,22 @@ def api_listar_activos(request):
         qs = qs.filter(estado='DISPONIBLE')
         if almacen_id and almacen_id != '00000000-0000-0000-0000-000000000000':
             qs = qs.filter(ubicacion_id=almacen_id)
-            
-    data = [{'id': a.id, 'text': f"{a.codigo} - {a.serie} | {a.nombre}"} for a in qs]
-    return JsonResponse({'results': data})
+
+    if material_id:
+        qs = qs.filter(material_id=material_id)
+    if q:
+        qs = qs.filter(Q(codigo__icontains=q) | Q(serie__icontains=q) | Q(nombre__icontains=q))
+    if cursor:
+        qs = qs.filter(codigo__gt=cursor)
+
+    # El texto se arma en la BD (sin instanciar modelos); índice activo_estado_ubic_kit_idx
+    filas = list(qs.order_by('codigo').annotate(
+        text=Concat('codigo', Value(' - '), 'serie', Value(' | '), 'nombre', output_field=CharField())
+    ).values('id', 'codigo', 'text')[:limite + 1])
+
+    siguiente = filas[limite - 1]['codigo'] if len(filas) > limite else None
+    data = [{'id': f['id'], 'text': f['text']} for f in filas[:limite]]
+    return JsonResponse({'results': data, 'siguiente': siguiente})
 
 # ==========================================
 # 6. ZONA DE PELIGRO (ADMINISTRACIÓN)
@@ -789,6 +1366,9 @@ def reset_database(request):
                     # 5. Eliminar Requerimientos
                     DetalleRequerimiento.objects.all().delete()
                     Requerimiento.objects.all().delete()
+
+                    # 6. Todas las cachés (y ETags) quedan obsoletas
+                    publicar(todo=True)
                 
                 messages.success(request, "✅ Base de datos operativa reiniciada correctamente.")
                 return redirect('dashboard')
@@ -829,238 +1409,311 @@ def cerrar_requerimiento(request, req_id):
 # ==========================================
 
 @login_required
+@condicional_por_version(alcance_global)
 def exportar_inventario_excel(request):
     """
     Genera un Excel con el stock actual filtrado por la búsqueda.
+    Se escribe fila por fila (LibroExcel): la memoria no crece con el tamaño del inventario.
     """
     query = request.GET.get('q')
-    stocks_filter = Stock.objects.select_related('material', 'material__categoria', 'almacen', 'almacen__proyecto')
+    # PMP del proyecto del almacén, resuelto en la misma consulta (sin mapas en memoria)
+    costo = Existencia.objects.filter(
+        proyecto_id=OuterRef('almacen__proyecto_id'), material_id=OuterRef('material_id')
+    ).values('costo_promedio')[:1]
+    stocks_filter = Stock.objects.annotate(
+        pmp=Coalesce(Subquery(costo), Value(Decimal(0)), output_field=DecimalField(max_digits=12, decimal_places=2))
+    )
 
     if query:
         stocks_filter = stocks_filter.filter(
             Q(material__codigo__icontains=query) |
             Q(material__descripcion__icontains=query)
         )
-    
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Inventario Físico"
 
-    # Encabezados
-    headers = ["Almacén", "Código", "Material", "Categoría", "Unidad", "Stock Actual", "Costo Promedio (S/.)", "Valor Total (S/.)", "Mínimo", "Ubicación"]
-    ws.append(headers)
-    
-    # Estilo Encabezado
-    for cell in ws[1]:
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color="2C3E50", end_color="2C3E50", fill_type="solid")
-        cell.alignment = Alignment(horizontal="center")
+    filas = stocks_filter.order_by('almacen__nombre', 'material__codigo').values_list(
+        'almacen__nombre', 'material__codigo', 'material__descripcion', 'material__categoria__nombre',
+        'material__unidad_medida', 'cantidad', 'pmp', 'cantidad_minima', 'ubicacion_pasillo'
+    ).iterator(chunk_size=TAMANO_LOTE)
 
-    # Optimización: Cargar existencias (costos) en memoria para evitar N+1 queries
-    # Mapa: {(proyecto_id, material_id): costo_promedio}
-    proyectos_ids = set(s.almacen.proyecto_id for s in stocks_filter)
-    materiales_ids = set(s.material_id for s in stocks_filter)
-    
-    existencias = Existencia.objects.filter(
-        proyecto_id__in=proyectos_ids, 
-        material_id__in=materiales_ids
-    ).values('proyecto_id', 'material_id', 'costo_promedio')
-    
-    costos_map = {(e['proyecto_id'], e['material_id']): e['costo_promedio'] for e in existencias}
-
-    # Datos
-    for stock in stocks_filter:
-        pmp = costos_map.get((stock.almacen.proyecto_id, stock.material_id), Decimal(0))
-        valor_total = stock.cantidad * pmp
-
-        ws.append([
-            stock.almacen.nombre,
-            stock.material.codigo,
-            stock.material.descripcion,
-            stock.material.categoria.nombre if stock.material.categoria else '-',
-            stock.material.unidad_medida,
-            stock.cantidad,
-            pmp,
-            valor_total,
-            stock.cantidad_minima,
-            stock.ubicacion_pasillo
-        ])
+    def generar():
+        for almacen, codigo, descripcion, categoria, unidad, cantidad, pmp, minimo, ubicacion in filas:
+            yield [almacen, codigo, descripcion, categoria or '-', unidad, cantidad, pmp, cantidad * pmp, minimo, ubicacion]
 
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename="Inventario_{timezone.now().strftime("%Y%m%d")}.xlsx"'
-    wb.save(response)
-    return response
+    libro = LibroExcel()
+    libro.hoja(
+        "Inventario Físico",
+        ["Almacén", "Código", "Material", "Categoría", "Unidad", "Stock Actual", "Costo Promedio (S/.)", "Valor Total (S/.)", "Mínimo", "Ubicación"],
+        generar()
+    )
+    return libro.respuesta(f"Inventario_{timezone.now().strftime('%Y%m%d')}.xlsx")
 
 @login_required
+@condicional_por_version(alcance_almacen_url)
 def exportar_kardex_excel(request, almacen_id, material_id):
     """
-    Genera el Kardex de un producto específico en Excel.
+    Genera el Kardex de un producto específico en Excel (o CSV con ?export=csv).
+    Las líneas se leen de la más reciente a la más antigua y el saldo se reconstruye
+    hacia atrás desde el stock actual, sin acumular las filas en memoria.
     """
     almacen = get_object_or_404(Almacen, id=almacen_id)
     material = get_object_or_404(Material, id=material_id)
 
-    # Reutilizamos la lógica de cálculo de saldos
     stock_item = Stock.objects.filter(almacen=almacen, material=material).first()
-    saldo_actual = stock_item.cantidad if stock_item else Decimal(0)
+    saldo_inicial = stock_item.cantidad if stock_item else Decimal(0)
 
-    movimientos = DetalleMovimiento.objects.filter(
+    lineas = DetalleMovimiento.objects.filter(
         material=material,
         movimiento__estado='CONFIRMADO'
     ).filter(
         Q(movimiento__almacen_origen=almacen) | 
         Q(movimiento__almacen_destino=almacen)
-    ).select_related('movimiento', 'movimiento__creado_por').order_by('-movimiento__fecha')
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = f"Kardex {material.codigo}"
-
-    # Información General
-    ws.append(["Material:", f"{material.codigo} - {material.descripcion}"])
-    ws.append(["Almacén:", almacen.nombre])
-    ws.append([]) # Espacio
-
-    # Encabezados Tabla
-    headers = ["Fecha", "Tipo Operación", "Documento", "Asignación / Destino", "Entrada", "Salida", "Saldo", "Usuario"]
-    ws.append(headers)
-    
-    # Estilo Encabezado
-    for cell in ws[4]: # Fila 4 porque agregamos 3 filas antes
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color="2C3E50", end_color="2C3E50", fill_type="solid")
-
-    # Procesar datos (Misma lógica que la vista web)
-    rows = []
-    for detalle in movimientos:
-        mov = detalle.movimiento
-        
-        # Determinar si es entrada o salida para este almacén
-        id_actual = str(almacen.id)
-        id_destino = str(mov.almacen_destino_id) if mov.almacen_destino_id else ''
-        id_origen = str(mov.almacen_origen_id) if mov.almacen_origen_id else ''
-
-        soy_destino = (id_destino == id_actual)
-        soy_origen = (id_origen == id_actual)
-
-        es_ingreso = False
-        es_salida = False
-
-        if soy_destino:
-            es_ingreso = True
-        elif soy_origen:
-            es_salida = True
-        else:
-            # Fallback
-            if 'INGRESO' in mov.tipo or 'DEVOLUCION' in mov.tipo or 'ENTRADA' in mov.tipo: es_ingreso = True
-            elif 'SALIDA' in mov.tipo or 'CONSUMO' in mov.tipo: es_salida = True
+    ).annotate(
+        # Flujo (+/-) respecto al almacén actual
+        flujo_cantidad=Case(
+            When(movimiento__almacen_destino=almacen, then=F('cantidad')),
+            When(movimiento__almacen_origen=almacen, then=F('cantidad') * -1),
+            default=Value(0),
+            output_field=DecimalField(max_digits=12, decimal_places=2)
+        )
+    ).order_by('-movimiento__fecha', '-id').values_list(
+        'flujo_cantidad', 'es_stock_libre', 'requerimiento__codigo',
+        'movimiento__fecha', 'movimiento__tipo', 'movimiento__nota_ingreso',
+        'movimiento__documento_referencia', 'movimiento__requerimiento__codigo',
+        'movimiento__creado_por__username', 'movimiento__creado_por__first_name', 'movimiento__creado_por__last_name',
+    ).iterator(chunk_size=TAMANO_LOTE)
+
+    tipos = dict(Movimiento.TIPOS_MOVIMIENTO)
+
+    def generar():
+        saldo = saldo_inicial
+        for flujo, libre, req_linea, fecha, tipo, nota, doc, req_mov, usuario, nombres, apellidos in lineas:
+            asignacion = "STOCK LIBRE" if libre else (req_linea or req_mov or "STOCK LIBRE")
+            yield [
+                timezone.localtime(fecha).strftime("%d/%m/%Y %H:%M"),
+                tipos.get(tipo, tipo),
+                f"{nota or ''} {doc or ''}",
+                asignacion,
+                flujo if flujo > 0 else 0,
+                -flujo if flujo < 0 else 0,
+                saldo,
+                f"{nombres} {apellidos}".strip() or usuario,
+            ]
+            saldo -= flujo  # Saldo anterior a esta línea
+
+    return exportar(
+        request.GET.get('export', 'excel'),
+        f"Kardex_{material.codigo}",
+        f"Kardex {material.codigo}",
+        ["Fecha", "Tipo Operación", "Documento", "Asignación / Destino", "Entrada", "Salida", "Saldo", "Usuario"],
+        generar(),
+        preambulo=[
+            ["Material:", f"{material.codigo} - {material.descripcion}"],
+            ["Almacén:", almacen.nombre],
+            [],
+        ]
+    )
 
-        entrada = detalle.cantidad if es_ingreso else 0
-        salida = detalle.cantidad if es_salida else 0
-        
-        # Lógica de visualización de asignación
-        asignacion_str = "STOCK LIBRE"
-        if detalle.es_stock_libre:
-            asignacion_str = "STOCK LIBRE"
-        elif detalle.requerimiento:
-            asignacion_str = detalle.requerimiento.codigo
-        elif mov.requerimiento:
-            asignacion_str = mov.requerimiento.codigo
-
-        # Guardamos en lista temporal para invertir el orden si quisiéramos, 
-        # pero aquí lo agregamos directo y calculamos saldo hacia atrás
-        rows.append([
-            mov.fecha.strftime("%d/%m/%Y %H:%M"),
-            mov.get_tipo_display(),
-            f"{mov.nota_ingreso or ''} {mov.documento_referencia or ''}",
-            asignacion_str,
-            entrada,
-            salida,
-            saldo_actual,
-            mov.creado_por.get_full_name() or mov.creado_por.username
-        ])
-
-        # Recalcular saldo anterior
-        if es_ingreso: saldo_actual -= detalle.cantidad
-        elif es_salida: saldo_actual += detalle.cantidad
-
-    # Escribir filas
-    for row in rows:
-        ws.append(row)
+@login_required
+@condicional_por_version(alcance_almacen_url)
+def exportar_kardex_almacen_excel(request, almacen_id):
+    """
+    Kardex de TODOS los materiales de un almacén (auditoría), en una sola lectura.
+    Un único cursor recorre las líneas confirmadas ordenadas por (material, fecha) y el saldo
+    de cada material se acumula hacia adelante; cada material es una sección de la hoja.
+    """
+    almacen = get_object_or_404(Almacen, id=almacen_id)
 
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename="Kardex_{material.codigo}.xlsx"'
-    wb.save(response)
-    return response
+    lineas = DetalleMovimiento.objects.filter(
+        movimiento__estado='CONFIRMADO'
+    ).filter(
+        Q(movimiento__almacen_origen=almacen) |
+        Q(movimiento__almacen_destino=almacen)
+    ).annotate(
+        flujo_cantidad=Case(
+            When(movimiento__almacen_destino=almacen, then=F('cantidad')),
+            When(movimiento__almacen_origen=almacen, then=F('cantidad') * -1),
+            default=Value(0),
+            output_field=DecimalField(max_digits=12, decimal_places=2)
+        )
+    ).order_by('material__codigo', 'material_id', 'movimiento__fecha', 'id').values_list(
+        'material_id', 'material__codigo', 'material__descripcion', 'material__unidad_medida',
+        'flujo_cantidad', 'es_stock_libre', 'requerimiento__codigo',
+        'movimiento__fecha', 'movimiento__tipo', 'movimiento__nota_ingreso',
+        'movimiento__documento_referencia', 'movimiento__requerimiento__codigo',
+        'movimiento__creado_por__username', 'movimiento__creado_por__first_name', 'movimiento__creado_por__last_name',
+    ).iterator(chunk_size=TAMANO_LOTE)
+
+    tipos = dict(Movimiento.TIPOS_MOVIMIENTO)
+
+    def generar():
+        actual, saldo = None, Decimal(0)
+        for (material_id, codigo, descripcion, unidad, flujo, libre, req_linea, fecha, tipo, nota, doc,
+             req_mov, usuario, nombres, apellidos) in lineas:
+            if material_id != actual:
+                if actual is not None:
+                    yield FilaDestacada(["", "", "", "", "", "", "SALDO FINAL", saldo, ""])
+                actual, saldo = material_id, Decimal(0)
+                yield FilaDestacada([codigo, f"{descripcion} ({unidad})", "", "", "", "", "", "", ""])
+
+            saldo += flujo
+            asignacion = "STOCK LIBRE" if libre else (req_linea or req_mov or "STOCK LIBRE")
+            yield [
+                codigo,
+                timezone.localtime(fecha).strftime("%d/%m/%Y %H:%M"),
+                tipos.get(tipo, tipo),
+                f"{nota or ''} {doc or ''}",
+                asignacion,
+                flujo if flujo > 0 else 0,
+                -flujo if flujo < 0 else 0,
+                saldo,
+                f"{nombres} {apellidos}".strip() or usuario,
+            ]
+        if actual is not None:
+            yield FilaDestacada(["", "", "", "", "", "", "SALDO FINAL", saldo, ""])
+
+    return exportar(
+        request.GET.get('export', 'excel'),
+        f"Kardex_{almacen.codigo or 'Almacen'}_{timezone.now().strftime('%Y%m%d')}",
+        "Kardex Almacén",
+        ["Código", "Fecha", "Tipo Operación", "Documento", "Asignación / Destino", "Entrada", "Salida", "Saldo", "Usuario"],
+        generar(),
+        preambulo=[["Almacén:", almacen.nombre], ["Generado:", timezone.localtime().strftime("%d/%m/%Y %H:%M")], []],
+        anchos={'A': 14, 'B': 17, 'C': 24, 'D': 26, 'E': 18},
+        congelar="A5"
+    )
 
 @login_required
+@condicional_por_version(alcance_global)
 def exportar_activos_externos_excel(request):
     """
     Genera un reporte Excel de los activos que están actualmente en Sede Central (Devueltos).
-    Busca el último movimiento de salida 'DEVOLUCION_LIMA' para obtener la fecha y guía.
+    La fecha y guía salen del último movimiento del activo (el DEVOLUCION_LIMA que lo devolvió),
+    denormalizado en Activo.ultimo_movimiento: una sola consulta con JOIN.
     """
     # Filtramos activos que ya no están en obra
-    activos_externos = Activo.objects.filter(estado='DEVUELTO_EXTERNO').order_by('codigo')
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Activos en Sede Central"
-
-    # Encabezados
-    headers = ["Código", "Activo", "Marca", "Modelo", "Serie", "Fecha Devolución", "Guía Remisión / Ref.", "Usuario Devolvió"]
-    ws.append(headers)
-
-    # Estilo Encabezado (Rojo para diferenciar que son externos)
-    for cell in ws[1]:
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color="C0392B", end_color="C0392B", fill_type="solid") 
-        cell.alignment = Alignment(horizontal="center")
-
-    for activo in activos_externos:
-        # Buscamos el movimiento que causó esta devolución (El último DEVOLUCION_LIMA)
-        ultimo_mov = DetalleMovimiento.objects.filter(
-            activo=activo,
-            movimiento__tipo='DEVOLUCION_LIMA'
-        ).select_related('movimiento', 'movimiento__creado_por').order_by('-movimiento__fecha').first()
-
-        fecha_dev = "S/D"
-        guia = "-"
-        usuario = "-"
-
-        if ultimo_mov:
-            fecha_dev = ultimo_mov.movimiento.fecha.strftime("%d/%m/%Y %H:%M")
-            guia = f"{ultimo_mov.movimiento.nota_ingreso} / {ultimo_mov.movimiento.documento_referencia}"
-            usuario = ultimo_mov.movimiento.creado_por.get_full_name() or ultimo_mov.movimiento.creado_por.username
-
-        ws.append([
-            activo.codigo,
-            activo.nombre,
-            activo.marca,
-            activo.modelo,
-            activo.serie,
-            fecha_dev,
-            guia,
-            usuario
-        ])
-
-    # Ajuste visual de columnas
-    ws.column_dimensions['B'].width = 35
-    ws.column_dimensions['F'].width = 20
-    ws.column_dimensions['G'].width = 25
+    activos_externos = Activo.objects.filter(estado='DEVUELTO_EXTERNO').order_by('codigo').values_list(
+        'codigo', 'nombre', 'marca', 'modelo', 'serie', 'ultimo_movimiento__tipo',
+        'fecha_ultimo_movimiento', 'ultimo_movimiento__nota_ingreso', 'ultimo_movimiento__documento_referencia',
+        'ultimo_movimiento__creado_por__username', 'ultimo_movimiento__creado_por__first_name',
+        'ultimo_movimiento__creado_por__last_name',
+    ).iterator(chunk_size=TAMANO_LOTE)
+
+    def generar():
+        for codigo, nombre, marca, modelo, serie, tipo, fecha, nota, doc, usuario, nombres, apellidos in activos_externos:
+            if tipo == 'DEVOLUCION_LIMA':
+                yield [
+                    codigo, nombre, marca, modelo, serie,
+                    timezone.localtime(fecha).strftime("%d/%m/%Y %H:%M"),
+                    f"{nota} / {doc}",
+                    f"{nombres} {apellidos}".strip() or usuario,
+                ]
+            else:
+                yield [codigo, nombre, marca, modelo, serie, "S/D", "-", "-"]
+
+    libro = LibroExcel()
+    # Encabezado rojo para diferenciar que son externos
+    libro.hoja(
+        "Activos en Sede Central",
+        ["Código", "Activo", "Marca", "Modelo", "Serie", "Fecha Devolución", "Guía Remisión / Ref.", "Usuario Devolvió"],
+        generar(),
+        color=ROJO,
+        anchos={'B': 35, 'F': 20, 'G': 25}
+    )
+    return libro.respuesta(f"Activos_SedeCentral_{timezone.now().strftime('%Y%m%d')}.xlsx")
 
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename="Activos_SedeCentral_{timezone.now().strftime("%Y%m%d")}.xlsx"'
-    wb.save(response)
-    return response
+@login_required
+@condicional_por_version(alcance_global)
+def exportar_matriz_stock_excel(request):
+    """
+    Matriz Material x Almacén completa del proyecto (todas las columnas) con totales y valor a PMP.
+    Celdas y costos se consultan por lotes de materiales mientras se escribe.
+    """
+    proyecto, _, almacenes = _contexto_matriz(request)
+    if not proyecto:
+        messages.warning(request, "No hay almacenes disponibles para generar la matriz.")
+        return redirect('matriz_stock')
+    q = request.GET.get('q', '').strip()
+    almacen_ids = [a['id'] for a in almacenes]
+    ids_texto = [str(a_id) for a_id in almacen_ids]
+    totales = StockService.matriz_totales_almacen(almacen_ids, proyecto.id, q)
+
+    def generar():
+        for lote in por_lotes(StockService.matriz_filas(almacen_ids, q).iterator(chunk_size=TAMANO_LOTE), 500):
+            material_ids = [str(f['material_id']) for f in lote]
+            celdas = StockService.matriz_celdas(almacen_ids, material_ids)
+            costos = StockService.matriz_costos(proyecto.id, material_ids)
+            for fila in lote:
+                material_id = str(fila['material_id'])
+                costo = costos.get(material_id, Decimal(0))
+                yield (
+                    [fila['material__codigo'], fila['material__descripcion'], fila['material__unidad_medida']]
+                    + [celdas.get((material_id, a_id)) for a_id in ids_texto]
+                    + [fila['total'], costo, fila['total'] * costo]
+                )
+
+    libro = LibroExcel()
+    libro.hoja(
+        "Matriz de Stock",
+        ["Código", "Material", "Unidad"] + [a['nombre'] for a in almacenes] + ["Total", "PMP (S/.)", "Valor Total (S/.)"],
+        generar(),
+        congelar="D2",
+        pie=[
+            ["", "TOTAL CANTIDAD", ""]
+            + [totales.get(a_id, (0, 0))[0] for a_id in ids_texto]
+            + [sum((c for c, _ in totales.values()), Decimal(0)), "", ""],
+            ["", "TOTAL VALORIZADO (S/.)", ""]
+            + [totales.get(a_id, (0, 0))[1] for a_id in ids_texto]
+            + ["", "", sum((v for _, v in totales.values()), Decimal(0))],
+        ]
+    )
+    return libro.respuesta(f"Matriz_Stock_{proyecto.codigo}_{timezone.now().strftime('%Y%m%d')}.xlsx")
 
 # ==========================================
 # 7.5 REPORTE DETALLADO DE TRANSACCIONES
 # ==========================================
 
+TRANSACCIONES_POR_PAGINA = 100
+TRANSACCIONES_TOP_MATERIALES = 20
+
+def _totales_transacciones(detalles):
+    """
+    Total general y subtotales (por tipo, proveedor y material) del reporte, agregados en la BD.
+    Materiales: los de mayor importe (TRANSACCIONES_TOP_MATERIALES).
+    """
+    base = detalles.order_by()
+    tipos = dict(Movimiento.TIPOS_MOVIMIENTO)
+
+    general = base.aggregate(lineas=Count('id'), cantidad=Sum('cantidad'), total=Sum('total_linea'))
+    por_tipo = [
+        {'etiqueta': tipos.get(f['movimiento__tipo'], f['movimiento__tipo']), 'lineas': f['lineas'], 'total': f['total']}
+        for f in base.values('movimiento__tipo').annotate(lineas=Count('id'), total=Sum('total_linea')).order_by('-total')
+    ]
+    por_proveedor = [
+        {'etiqueta': f['movimiento__proveedor__razon_social'] or 'Sin proveedor', 'lineas': f['lineas'], 'total': f['total']}
+        for f in base.values('movimiento__proveedor__razon_social').annotate(lineas=Count('id'), total=Sum('total_linea')).order_by('-total')
+    ]
+    por_material = list(
+        base.values('material__codigo', 'material__descripcion', 'material__unidad_medida').annotate(
+            cantidad=Sum('cantidad'), total=Sum('total_linea')
+        ).order_by('-total')[:TRANSACCIONES_TOP_MATERIALES]
+    )
+    return {
+        'lineas': general['lineas'],
+        'cantidad': general['cantidad'] or Decimal(0),
+        'total': general['total'] or Decimal(0),
+        'por_tipo': por_tipo,
+        'por_proveedor': por_proveedor,
+        'por_material': por_material,
+    }
+
 @login_required
+@condicional_por_version(alcance_proyectos)
 def reporte_transacciones(request):
     """
     Reporte detallado de movimientos (Sábana de datos) para gestión y contabilidad.
     Permite filtrar por fecha, tipo (Ingreso/Salida) y proveedor.
+    La pantalla lee una sola página (cursor por fecha); totales y subtotales salen de la BD
+    y se reutilizan (CacheReporte) mientras no cambien los datos de los proyectos, igual que el Excel.
     """
     fecha_inicio = request.GET.get('fecha_inicio')
     fecha_fin = request.GET.get('fecha_fin')
@@ -1078,13 +1731,16 @@ def reporte_transacciones(request):
         'movimiento__torre_destino',
         'movimiento__trabajador',
         'material'
+    ).annotate(
+        total_linea=ExpressionWrapper(F('cantidad') * F('costo_unitario'), output_field=DecimalField(max_digits=18, decimal_places=2))
     ).order_by('-movimiento__fecha')
 
-    # Filtros de Fecha
-    if fecha_inicio:
-        detalles = detalles.filter(movimiento__fecha__date__gte=fecha_inicio)
-    if fecha_fin:
-        detalles = detalles.filter(movimiento__fecha__date__lte=fecha_fin)
+    # Filtros de Fecha (rango sobre la columna: usa el índice de movimientos)
+    inicio, fin = _rango_fechas(fecha_inicio, fecha_fin)
+    if inicio:
+        detalles = detalles.filter(movimiento__fecha__gte=inicio)
+    if fin:
+        detalles = detalles.filter(movimiento__fecha__lt=fin)
 
     # Filtros de Tipo
     if tipo_reporte == 'ingreso':
@@ -1096,47 +1752,64 @@ def reporte_transacciones(request):
         tipos = ['SALIDA_OBRA', 'SALIDA_EPP', 'SALIDA_OFICINA', 'TRANSFERENCIA_SALIDA', 'DEVOLUCION_LIMA']
         detalles = detalles.filter(movimiento__tipo__in=tipos)
 
-    # --- EXPORTACIÓN EXCEL ---
-    if request.GET.get('export') == 'excel':
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = f"Reporte {tipo_reporte.capitalize()}"
-        
+    reporte = CacheReporte(
+        'transacciones',
+        normalizar_parametros(request, ['fecha_inicio', 'fecha_fin', 'tipo_reporte', 'proveedor']),
+        alcance_proyectos(request)
+    )
+
+    # --- EXPORTACIÓN EXCEL / CSV ---
+    if request.GET.get('export') in FORMATOS:
         if tipo_reporte == 'ingreso':
             headers = ["Fecha", "Nota Ingreso", "Proveedor / Origen", "Doc. Referencia", "Código", "Material", "Unidad", "Cantidad", "Costo Unit.", "Total"]
         else:
             headers = ["Fecha", "Vale Salida", "Destino", "Código", "Material", "Unidad", "Cantidad", "Costo Promedio", "Total"]
-        
-        ws.append(headers)
-        
-        # Estilo
-        for cell in ws[1]:
-            cell.font = Font(bold=True, color="FFFFFF")
-            cell.fill = PatternFill(start_color="2C3E50", end_color="2C3E50", fill_type="solid")
-        
-        for d in detalles:
-            mov = d.movimiento
-            fecha = mov.fecha.strftime("%d/%m/%Y")
-            doc_interno = mov.nota_ingreso or "-"
-            
-            if tipo_reporte == 'ingreso':
-                origen = mov.proveedor.razon_social if mov.proveedor else (mov.almacen_origen.nombre if mov.almacen_origen else "Obra/Trabajador")
-                ws.append([fecha, doc_interno, origen, mov.documento_referencia, d.material.codigo, d.material.descripcion, d.material.unidad_medida, d.cantidad, d.costo_unitario, d.cantidad * d.costo_unitario])
-            else:
-                destino = "-"
-                if mov.torre_destino: destino = f"Torre {mov.torre_destino}"
-                elif mov.trabajador: destino = str(mov.trabajador)
-                elif mov.almacen_destino: destino = mov.almacen_destino.nombre
-                elif mov.tipo == 'DEVOLUCION_LIMA': destino = "Sede Central"
-                ws.append([fecha, doc_interno, destino, d.material.codigo, d.material.descripcion, d.material.unidad_medida, d.cantidad, d.costo_unitario, d.cantidad * d.costo_unitario])
-        
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="Reporte_{tipo_reporte}_{timezone.now().strftime("%Y%m%d")}.xlsx"'
-        wb.save(response)
-        return response
+
+        lineas = detalles.values_list(
+            'movimiento__fecha', 'movimiento__nota_ingreso', 'movimiento__documento_referencia', 'movimiento__tipo',
+            'movimiento__proveedor__razon_social', 'movimiento__almacen_origen__nombre', 'movimiento__almacen_destino__nombre',
+            'movimiento__torre_destino__codigo', 'movimiento__torre_destino__tramo__codigo', 'movimiento__torre_destino__tipo',
+            'movimiento__trabajador__nombres', 'movimiento__trabajador__apellidos',
+            'material__codigo', 'material__descripcion', 'material__unidad_medida', 'cantidad', 'costo_unitario',
+        ).iterator(chunk_size=TAMANO_LOTE)
+        tipos_torre = dict(Torre.TIPO_TORRE)
+
+        def generar():
+            for (fecha, nota, doc_ref, tipo, proveedor, alm_origen, alm_destino, torre, tramo, tipo_torre,
+                 nombres, apellidos, codigo, descripcion, unidad, cantidad, costo) in lineas:
+                fecha = timezone.localtime(fecha).strftime("%d/%m/%Y")
+                doc_interno = nota or "-"
+                if tipo_reporte == 'ingreso':
+                    origen = proveedor or alm_origen or "Obra/Trabajador"
+                    yield [fecha, doc_interno, origen, doc_ref, codigo, descripcion, unidad, cantidad, costo, cantidad * costo]
+                else:
+                    destino = "-"
+                    if torre: destino = f"Torre {tramo} - {torre} ({tipos_torre.get(tipo_torre, tipo_torre)})"
+                    elif nombres is not None: destino = f"{nombres} {apellidos}"
+                    elif alm_destino: destino = alm_destino
+                    elif tipo == 'DEVOLUCION_LIMA': destino = "Sede Central"
+                    yield [fecha, doc_interno, destino, codigo, descripcion, unidad, cantidad, costo, cantidad * costo]
+
+        return reporte.descarga(
+            request.GET['export'],
+            f"Reporte_{tipo_reporte}_{timezone.now().strftime('%Y%m%d')}",
+            f"Reporte {tipo_reporte.capitalize()}",
+            headers,
+            generar()
+        )
+
+    pagina = PaginaKeyset(
+        detalles, 'movimiento__fecha', campo_pk='id',
+        cursor=request.GET.get('cursor'),
+        direccion=request.GET.get('dir'),
+        por_pagina=TRANSACCIONES_POR_PAGINA
+    )
 
     context = {
-        'detalles': detalles,
+        'detalles': pagina,
+        'pagina': pagina,
+        'parametros': _querystring_sin(request, 'cursor', 'dir'),
+        'totales': reporte.resultado(lambda: _totales_transacciones(detalles)),
         'proveedores': Proveedor.objects.filter(activo=True),
         'fecha_inicio': fecha_inicio,
         'fecha_fin': fecha_fin,
@@ -1149,99 +1822,360 @@ def reporte_transacciones(request):
 # 7.6 REPORTES GERENCIALES (NUEVOS)
 # ==========================================
 
+def _mes(valor):
+    """'AAAA-MM' (o una fecha 'AAAA-MM-DD') -> primer día del mes; None si no es válido."""
+    try:
+        return datetime.strptime((valor or '')[:7], '%Y-%m').date()
+    except ValueError:
+        return None
+
 @login_required
+@condicional_por_version(alcance_proyectos)
 def reporte_consumo_torre(request):
     """
-    Reporte 1: Consumo acumulado por Torre/Frente (Control de Costos).
+    Reporte 1: Consumo por Centro de Costos (Proyecto > Tramo > Torre > Material).
+    Lee el cubo ConsumoMensual: cada clic baja un nivel (drill-down) y el Excel/CSV
+    trae el detalle completo con subtotales por torre, tramo y proyecto.
     """
-    fecha_inicio = request.GET.get('fecha_inicio')
-    fecha_fin = request.GET.get('fecha_fin')
-    
-    # Filtramos salidas a obra confirmadas
-    consumos = DetalleMovimiento.objects.filter(
-        movimiento__tipo='SALIDA_OBRA',
-        movimiento__estado='CONFIRMADO',
-        movimiento__torre_destino__isnull=False
+    fecha_inicio = request.GET.get('fecha_inicio', '')[:7]
+    fecha_fin = request.GET.get('fecha_fin', '')[:7]
+
+    cubo = ConsumoMensual.objects.all()
+    desde, hasta = _mes(fecha_inicio), _mes(fecha_fin)
+    if desde:
+        cubo = cubo.filter(periodo__gte=desde)
+    if hasta:
+        cubo = cubo.filter(periodo__lte=hasta)
+
+    # Ruta de drill-down: cada nivel elegido filtra el cubo y baja al siguiente
+    base = {k: v for k, v in (('fecha_inicio', fecha_inicio), ('fecha_fin', fecha_fin)) if v}
+    parametros = dict(base)
+    migas = [{'etiqueta': 'Todos los proyectos', 'parametros': urlencode(base)}]
+    nivel = 'proyecto'
+    for campo, modelo, siguiente in (('proyecto', Proyecto, 'tramo'), ('tramo', Tramo, 'torre'), ('torre', Torre, 'material')):
+        try:
+            valor = uuid.UUID(request.GET.get(campo, ''))
+        except ValueError:
+            break
+        cubo = cubo.filter(**{f'{campo}_id': valor})
+        parametros[campo] = str(valor)
+        codigo = modelo.objects.filter(pk=valor).values_list('codigo', flat=True).first()
+        migas.append({'etiqueta': codigo or '?', 'parametros': urlencode(parametros)})
+        nivel = siguiente
+
+    reporte = CacheReporte(
+        'consumo_torre',
+        normalizar_parametros(request, ['fecha_inicio', 'fecha_fin', 'proyecto', 'tramo', 'torre']),
+        alcance_proyectos(request)
     )
 
-    if fecha_inicio:
-        consumos = consumos.filter(movimiento__fecha__date__gte=fecha_inicio)
-    if fecha_fin:
-        consumos = consumos.filter(movimiento__fecha__date__lte=fecha_fin)
-
-    # Agrupación por Torre
-    resumen_torres = consumos.values(
-        'movimiento__torre_destino__codigo'
-    ).annotate(
-        total_soles=Sum(F('cantidad') * F('costo_unitario'))
-    ).order_by('-total_soles')
+    # Exportación Excel / CSV: detalle con subtotales (ROLLUP) bajo el nivel actual
+    if request.GET.get('export') in FORMATOS:
+        return reporte.descarga(
+            request.GET['export'],
+            f"Consumo_Centro_Costo_{timezone.now().strftime('%Y%m%d')}",
+            "Consumo por Centro de Costo",
+            ["Proyecto", "Tramo", "Torre", "Código", "Material", "Unidad", "Cantidad", "Costo Total (S/.)"],
+            ConsumoService.filas_rollup(cubo),
+            anchos={'E': 45, 'H': 18}
+        )
 
-    # Exportación Excel
-    if request.GET.get('export') == 'excel':
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Consumo por Torre"
-        ws.append(["Torre / Frente", "Código", "Costo Total (S/.)"])
-        
-        for item in resumen_torres:
-            ws.append([
-                item['movimiento__torre_destino__codigo'],
-                item['movimiento__torre_destino__codigo'],
-                item['total_soles']
-            ])
-            
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="Consumo_Torres_{timezone.now().strftime("%Y%m%d")}.xlsx"'
-        wb.save(response)
-        return response
+    def calcular():
+        codigo, nombre = ConsumoService.NIVELES[nivel]
+        tipos_torre = dict(Torre.TIPO_TORRE)
+        filas = [
+            {
+                'id': fila[f'{nivel}_id'],
+                'codigo': fila[codigo],
+                'nombre': tipos_torre.get(fila[nombre], fila[nombre]) if nivel == 'torre' else fila[nombre],
+                'cantidad': fila['total_cantidad'],
+                'costo': fila['total_costo'] or Decimal(0),
+            }
+            for fila in ConsumoService.resumen(cubo, nivel)
+        ]
+        return {'filas': filas, 'periodos': list(ConsumoService.por_periodo(cubo))}
+
+    resultado = reporte.resultado(calcular)
+    total = sum((f['costo'] for f in resultado['filas']), Decimal(0))
+    for fila in resultado['filas']:
+        fila['porcentaje'] = fila['costo'] * 100 / total if total else 0
 
     context = {
-        'resumen': resumen_torres,
+        'nivel': nivel,
+        'resumen': resultado['filas'],
+        'periodos': resultado['periodos'],
+        'total': total,
+        'migas': migas,
+        'parametros_detalle': urlencode(parametros),
         'fecha_inicio': fecha_inicio,
         'fecha_fin': fecha_fin
     }
     return render(request, 'logistica/reporte_consumo_torre.html', context)
 
+BACKLOG_POR_PAGINA = 100
+# Tramos de antigüedad (días desde la solicitud): (hasta N días, etiqueta); el resto es "> 60 días"
+BACKLOG_TRAMOS = [(7, '0-7 días'), (15, '8-15 días'), (30, '16-30 días'), (60, '31-60 días')]
+BACKLOG_TRAMO_FINAL = '> 60 días'
+PESO_PRIORIDAD = {'URGENTE': 4, 'ALTA': 3, 'MEDIA': 2, 'BAJA': 1}
+# Orden de atención del backlog: (campo, descendente). Primero lo vencido, luego por prioridad,
+# fecha necesaria (sin fecha al final) y antigüedad. También decide a quién se asigna el stock libre.
+ORDEN_BACKLOG = [
+    ('vencido', True), ('peso', True), ('necesaria_orden', False), ('requerimiento__fecha_solicitud', False), ('id', False),
+]
+
+def _backlog_base(hoy):
+    """Líneas pendientes de requerimientos abiertos con los campos del orden de atención y su necesidad de stock."""
+    cantidad = DecimalField(max_digits=14, decimal_places=2)
+    cero = Value(Decimal(0), output_field=cantidad)
+
+    return DetalleRequerimiento.objects.filter(
+        requerimiento__estado__in=['PENDIENTE', 'PARCIAL']
+    ).annotate(
+        pendiente=ExpressionWrapper(F('cantidad_solicitada') - F('cantidad_atendida'), output_field=cantidad)
+    ).filter(pendiente__gt=0).annotate(
+        vencido=Case(
+            When(requerimiento__fecha_necesaria__lt=hoy, then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField()
+        ),
+        peso=Case(
+            *[When(requerimiento__prioridad=clave, then=Value(peso)) for clave, peso in PESO_PRIORIDAD.items()],
+            default=Value(0),
+            output_field=IntegerField()
+        ),
+        necesaria_orden=Coalesce(F('requerimiento__fecha_necesaria'), Value(date.max)),
+        # Lo ya ingresado para la línea (reservado) y lo que le falta pedir al stock libre
+        reserva=Greatest(F('cantidad_ingresada') - F('cantidad_atendida'), cero),
+        necesidad=Greatest(F('pendiente') - F('reserva'), cero),
+    )
+
+def _antes_en_backlog():
+    """Q de las líneas que van antes que OuterRef en ORDEN_BACKLOG (comparación lexicográfica)."""
+    antes = None
+    for campo, descendente in reversed(ORDEN_BACKLOG):
+        adelante = Q(**{f"{campo}__{'gt' if descendente else 'lt'}": OuterRef(campo)})
+        antes = adelante if antes is None else adelante | (Q(**{campo: OuterRef(campo)}) & antes)
+    return antes
+
+def _backlog(hoy):
+    """
+    Líneas pendientes de requerimientos abiertos con su antigüedad, atraso, peso de prioridad
+    y cuánto del pendiente se puede cubrir hoy con stock del proyecto, todo calculado en la BD.
+    Cada línea se cubre primero con lo ya ingresado para ella y luego con el stock libre del
+    proyecto (Stock - Reservado, igual que KardexService._procesar_salida) que dejan las líneas
+    del mismo material que van antes en ORDEN_BACKLOG: el mismo stock no se cuenta dos veces.
+    La asignación se calcula sobre todo el backlog, así que no cambia con los filtros del reporte.
+    """
+    cantidad = DecimalField(max_digits=14, decimal_places=2)
+    cero = Value(Decimal(0), output_field=cantidad)
+    dias = DurationField()
+
+    stock_proyecto = Existencia.objects.filter(
+        proyecto_id=OuterRef('requerimiento__proyecto_id'), material_id=OuterRef('material_id')
+    ).values('stock_total_proyecto')[:1]
+    reservado_proyecto = DetalleRequerimiento.objects.filter(
+        requerimiento__proyecto_id=OuterRef('requerimiento__proyecto_id'),
+        material_id=OuterRef('material_id'),
+        requerimiento__estado__in=['PENDIENTE', 'PARCIAL'],
+        cantidad_ingresada__gt=F('cantidad_atendida'),
+    ).order_by().values('material_id').annotate(
+        total=Sum(F('cantidad_ingresada') - F('cantidad_atendida'))
+    ).values('total')
+    # Suma acumulada de la necesidad de las líneas previas del mismo proyecto y material
+    necesidad_previa = _backlog_base(hoy).filter(
+        _antes_en_backlog(),
+        requerimiento__proyecto_id=OuterRef('requerimiento__proyecto_id'),
+        material_id=OuterRef('material_id'),
+    ).order_by().values('material_id').annotate(total=Sum('necesidad')).values('total')
+
+    stock_libre = Greatest(
+        Coalesce(Subquery(stock_proyecto), cero) - Coalesce(Subquery(reservado_proyecto, output_field=cantidad), cero),
+        cero
+    )
+    libre_restante = Greatest(stock_libre - Coalesce(Subquery(necesidad_previa, output_field=cantidad), cero), cero)
+
+    return _backlog_base(hoy).annotate(
+        antiguedad=ExpressionWrapper(Value(hoy, output_field=DateField()) - F('requerimiento__fecha_solicitud'), output_field=dias),
+        tramo=Case(
+            *[When(requerimiento__fecha_solicitud__gte=hoy - timedelta(days=limite), then=Value(etiqueta))
+              for limite, etiqueta in BACKLOG_TRAMOS],
+            default=Value(BACKLOG_TRAMO_FINAL),
+            output_field=CharField()
+        ),
+        atraso=Case(
+            When(requerimiento__fecha_necesaria__lt=hoy, then=ExpressionWrapper(
+                Value(hoy, output_field=DateField()) - F('requerimiento__fecha_necesaria'), output_field=dias
+            )),
+            default=None,
+            output_field=dias
+        ),
+        cubierto=Least(F('pendiente'), F('reserva') + Least(F('necesidad'), libre_restante)),
+    )
+
+def _orden_backlog(qs):
+    """Orden de atención (ORDEN_BACKLOG)."""
+    return qs.order_by(*[f"-{campo}" if descendente else campo for campo, descendente in ORDEN_BACKLOG])
+
 @login_required
+@condicional_por_version(alcance_proyectos)
 def reporte_backlog(request):
     """
-    Reporte 2: Backlog (Pendientes de Atención).
+    Reporte 2: Backlog (Pendientes de Atención) con antigüedad, atraso, prioridad y cobertura con stock.
     """
-    # Filtramos detalles de requerimientos pendientes o parciales
-    pendientes = DetalleRequerimiento.objects.filter(
-        requerimiento__estado__in=['PENDIENTE', 'PARCIAL']
-    ).annotate(
-        pendiente=F('cantidad_solicitada') - F('cantidad_atendida')
-    ).filter(pendiente__gt=0).select_related('requerimiento', 'material', 'requerimiento__proyecto').order_by('requerimiento__fecha_solicitud')
+    hoy = timezone.localdate()
+    proyecto_id = request.GET.get('proyecto')
+    prioridad = request.GET.get('prioridad')
+    tramo = request.GET.get('tramo')
+    solo_vencidos = request.GET.get('vencidos') == '1'
+
+    pendientes = _backlog(hoy)
+    if proyecto_id:
+        try:
+            pendientes = pendientes.filter(requerimiento__proyecto_id=uuid.UUID(proyecto_id))
+        except ValueError:
+            pass
+    if prioridad:
+        pendientes = pendientes.filter(requerimiento__prioridad=prioridad)
+    resumen_qs = pendientes  # La matriz de antigüedad ignora los filtros de tramo y vencidos
+    if tramo:
+        pendientes = pendientes.filter(tramo=tramo)
+    if solo_vencidos:
+        pendientes = pendientes.filter(vencido=True)
+    pendientes = _orden_backlog(pendientes)
+
+    # La antigüedad cambia cada día aunque los datos no cambien: la fecha entra en la clave
+    parametros = normalizar_parametros(request, ['proyecto', 'prioridad', 'tramo', 'vencidos'])
+    parametros['hoy'] = hoy.isoformat()
+    reporte = CacheReporte('backlog', parametros, alcance_proyectos(request))
+
+    if request.GET.get('export') in FORMATOS:
+        lineas = pendientes.values_list(
+            'requerimiento__codigo', 'requerimiento__proyecto__codigo', 'requerimiento__fecha_solicitud',
+            'requerimiento__fecha_necesaria', 'antiguedad', 'tramo', 'atraso', 'requerimiento__prioridad',
+            'requerimiento__solicitante', 'material__codigo', 'material__descripcion', 'material__unidad_medida',
+            'cantidad_solicitada', 'cantidad_atendida', 'pendiente', 'cubierto'
+        ).iterator(chunk_size=TAMANO_LOTE)
+
+        def generar():
+            for codigo, proyecto, fecha, necesaria, antiguedad, tramo_fila, atraso, *resto, pendiente, cubierto in lineas:
+                yield [
+                    codigo, proyecto, fecha.strftime("%d/%m/%Y"), necesaria.strftime("%d/%m/%Y") if necesaria else "-",
+                    antiguedad.days, tramo_fila, atraso.days if atraso else 0, *resto, pendiente, cubierto,
+                    round(cubierto * 100 / pendiente, 1) if pendiente else 0,
+                ]
+
+        return reporte.descarga(
+            request.GET['export'],
+            f"Backlog_Pendientes_{timezone.now().strftime('%Y%m%d')}",
+            "Backlog de Materiales",
+            ["Requerimiento", "Proyecto", "Fecha Sol.", "Fecha Necesaria", "Antigüedad (días)", "Tramo",
+             "Días de Atraso", "Prioridad", "Solicitante", "Código", "Material", "Unidad",
+             "Solicitado", "Atendido", "PENDIENTE", "Cubrible con Stock", "% Cobertura"],
+            generar(),
+            color=ROJO, anchos={'K': 40}, congelar='A2'
+        )
 
-    if request.GET.get('export') == 'excel':
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Backlog de Materiales"
-        ws.append(["Requerimiento", "Fecha Sol.", "Solicitante", "Código", "Material", "Unidad", "Solicitado", "Atendido", "PENDIENTE"])
-        
-        for p in pendientes:
-            ws.append([
-                p.requerimiento.codigo,
-                p.requerimiento.fecha_solicitud.strftime("%d/%m/%Y"),
-                p.requerimiento.solicitante,
-                p.material.codigo,
-                p.material.descripcion,
-                p.material.unidad_medida,
-                p.cantidad_solicitada,
-                p.cantidad_atendida,
-                p.pendiente
-            ])
-            
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="Backlog_Pendientes_{timezone.now().strftime("%Y%m%d")}.xlsx"'
-        wb.save(response)
-        return response
+    paginator = Paginator(
+        pendientes.select_related('requerimiento', 'material', 'requerimiento__proyecto'), BACKLOG_POR_PAGINA
+    )
+    pagina = paginator.get_page(request.GET.get('page'))
+
+    # Matriz antigüedad x prioridad (líneas, vencidas y cubiertas por completo) en un solo GROUP BY
+    celdas = reporte.resultado(lambda: list(resumen_qs.order_by().values('tramo', 'requerimiento__prioridad').annotate(
+        lineas=Count('id'),
+        vencidas=Count('id', filter=Q(vencido=True)),
+        cubiertas=Count('id', filter=Q(cubierto__gte=F('pendiente'))),
+    )))
+
+    prioridades = [clave for clave, _ in reversed(Requerimiento.PRIORIDADES)]
+    tramos = [etiqueta for _, etiqueta in BACKLOG_TRAMOS] + [BACKLOG_TRAMO_FINAL]
+    por_celda = {(c['tramo'], c['requerimiento__prioridad']): c for c in celdas}
+    matriz = [
+        {
+            'tramo': t,
+            'celdas': [por_celda.get((t, p), {'lineas': 0, 'vencidas': 0, 'cubiertas': 0}) for p in prioridades],
+            'total': sum(por_celda[(t, p)]['lineas'] for p in prioridades if (t, p) in por_celda),
+        }
+        for t in tramos
+    ]
 
-    context = {'pendientes': pendientes}
+    context = {
+        'pendientes': pagina,
+        'parametros': _querystring_sin(request, 'page'),
+        'matriz': matriz,
+        'prioridades': prioridades,
+        'tramos': tramos,
+        'filtros': {'proyecto': proyecto_id or '', 'prioridad': prioridad or '', 'tramo': tramo or '', 'vencidos': solo_vencidos},
+        'lista_prioridades': Requerimiento.PRIORIDADES,
+        'proyectos': Proyecto.objects.filter(activo=True).only('id', 'codigo', 'nombre'),
+    }
     return render(request, 'logistica/reporte_backlog.html', context)
 
+INVENTARIO_A_FECHA_POR_PAGINA = 100
+
 @login_required
+@condicional_por_version(alcance_proyectos)
+def reporte_inventario_a_fecha(request):
+    """
+    Reporte 4: Inventario valorizado a una fecha (cierres de mes, auditorías).
+    Stock por almacén y material y PMP del proyecto al final del día indicado, reconstruidos
+    desde el último CierreInventario anterior (InventarioHistoricoService).
+    """
+    fecha = parse_date(request.GET.get('fecha') or '') or timezone.localdate()
+    _, hasta = _rango_fechas(None, fecha.isoformat())
+
+    proyectos = Proyecto.objects.order_by('codigo')
+    proyecto_id = request.GET.get('proyecto')
+    almacen_id = None
+    try:
+        if proyecto_id:
+            proyectos = proyectos.filter(id=uuid.UUID(proyecto_id))
+        if request.GET.get('almacen'):
+            almacen_id = uuid.UUID(request.GET['almacen'])
+    except ValueError:
+        pass
+
+    parametros = normalizar_parametros(request, ['proyecto', 'almacen'])
+    parametros['fecha'] = fecha.isoformat()
+    reporte = CacheReporte('inventario_a_fecha', parametros, alcance_proyectos(request))
+
+    encabezados = ["Proyecto", "Almacén", "Código", "Material", "Unidad", "Cantidad", "PMP (S/.)", "Valor (S/.)"]
+    if request.GET.get('export') in FORMATOS:
+        return reporte.descarga(
+            request.GET['export'],
+            f"Inventario_al_{fecha.strftime('%Y%m%d')}",
+            f"Inventario al {fecha.strftime('%d-%m-%Y')}",
+            encabezados,
+            InventarioHistoricoService.filas(proyectos, hasta, almacen_id),
+            anchos={'B': 25, 'D': 45}, congelar='A2'
+        )
+
+    filas = reporte.resultado(lambda: list(InventarioHistoricoService.filas(proyectos, hasta, almacen_id)))
+
+    # Resumen por almacén (las filas ya vienen ordenadas por proyecto y almacén)
+    resumen = {}
+    for proyecto, almacen, *_, valor in filas:
+        item = resumen.setdefault((proyecto, almacen), {'proyecto': proyecto, 'almacen': almacen, 'lineas': 0, 'valor': Decimal(0)})
+        item['lineas'] += 1
+        item['valor'] += valor
+
+    context = {
+        'fecha': fecha,
+        'filas': Paginator(filas, INVENTARIO_A_FECHA_POR_PAGINA).get_page(request.GET.get('page')),
+        'parametros': _querystring_sin(request, 'page'),
+        'resumen': list(resumen.values()),
+        'total': sum((item['valor'] for item in resumen.values()), Decimal(0)),
+        'cierres': CierreInventario.objects.filter(proyecto__in=proyectos, fecha_corte__lte=hasta).values(
+            'proyecto__codigo'
+        ).annotate(ultimo=Max('fecha_corte')).order_by('proyecto__codigo'),
+        'proyectos': Proyecto.objects.order_by('codigo').only('id', 'codigo', 'nombre'),
+        'almacenes': Almacen.objects.filter(proyecto__in=proyectos).select_related('proyecto').order_by('proyecto__codigo', 'nombre'),
+        'filtros': {'proyecto': proyecto_id or '', 'almacen': request.GET.get('almacen', '')},
+    }
+    return render(request, 'logistica/reporte_inventario_a_fecha.html', context)
+
+@login_required
+@condicional_por_version(alcance_global)
 def reporte_epp_trabajador(request):
     """
     Reporte 3: Kardex de EPP por Trabajador.
@@ -1267,26 +2201,22 @@ def reporte_epp_trabajador(request):
         except:
             pass
 
-    if request.GET.get('export') == 'excel':
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Kardex EPP"
-        ws.append(["Fecha", "Trabajador", "DNI", "Material (EPP)", "Cantidad", "Vale Salida"])
-        
-        for e in epps:
-            ws.append([
-                e.movimiento.fecha.strftime("%d/%m/%Y"),
-                f"{e.movimiento.trabajador.nombres} {e.movimiento.trabajador.apellidos}",
-                e.movimiento.trabajador.dni,
-                e.material.descripcion,
-                e.cantidad,
-                e.movimiento.nota_ingreso
-            ])
-            
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="Kardex_EPP_{timezone.now().strftime("%Y%m%d")}.xlsx"'
-        wb.save(response)
-        return response
+    if request.GET.get('export') in FORMATOS:
+        lineas = epps.values_list(
+            'movimiento__fecha', 'movimiento__trabajador__nombres', 'movimiento__trabajador__apellidos',
+            'movimiento__trabajador__dni', 'material__descripcion', 'cantidad', 'movimiento__nota_ingreso'
+        ).iterator(chunk_size=TAMANO_LOTE)
+
+        return exportar(
+            request.GET['export'],
+            f"Kardex_EPP_{timezone.now().strftime('%Y%m%d')}",
+            "Kardex EPP",
+            ["Fecha", "Trabajador", "DNI", "Material (EPP)", "Cantidad", "Vale Salida"],
+            (
+                [timezone.localtime(fecha).strftime("%d/%m/%Y"), f"{nombres} {apellidos}", dni, material, cantidad, vale]
+                for fecha, nombres, apellidos, dni, material, cantidad, vale in lineas
+            )
+        )
 
     context = {
         'epps': epps,
@@ -1296,6 +2226,7 @@ def reporte_epp_trabajador(request):
     return render(request, 'logistica/reporte_epp_trabajador.html', context)
 
 @login_required
+@condicional_por_version(alcance_global)
 def reporte_reposicion(request):
     """
     Reporte 4: Alertas de Reposición (Stock <= Mínimo).
@@ -1309,30 +2240,21 @@ def reporte_reposicion(request):
     ).order_by('almacen', 'material__codigo')
 
     if request.GET.get('export') == 'excel':
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Reposición de Stock"
-        ws.append(["Almacén", "Código", "Material", "Categoría", "Stock Actual", "Stock Mínimo", "Déficit / A Reponer"])
-        
-        # Estilo Alerta
-        red_fill = PatternFill(start_color="E74C3C", end_color="E74C3C", fill_type="solid")
-        
-        for c in criticos:
-            deficit = c.cantidad_minima - c.cantidad
-            ws.append([
-                c.almacen.nombre,
-                c.material.codigo,
-                c.material.descripcion,
-                c.material.categoria.nombre if c.material.categoria else '-',
-                c.cantidad,
-                c.cantidad_minima,
-                deficit
-            ])
-            
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="Alerta_Reposicion_{timezone.now().strftime("%Y%m%d")}.xlsx"'
-        wb.save(response)
-        return response
+        lineas = criticos.values_list(
+            'almacen__nombre', 'material__codigo', 'material__descripcion', 'material__categoria__nombre',
+            'cantidad', 'cantidad_minima', 'deficit'
+        ).iterator(chunk_size=TAMANO_LOTE)
+
+        libro = LibroExcel()
+        libro.hoja(
+            "Reposición de Stock",
+            ["Almacén", "Código", "Material", "Categoría", "Stock Actual", "Stock Mínimo", "Déficit / A Reponer"],
+            (
+                [almacen, codigo, descripcion, categoria or '-', cantidad, minimo, deficit]
+                for almacen, codigo, descripcion, categoria, cantidad, minimo, deficit in lineas
+            )
+        )
+        return libro.respuesta(f"Alerta_Reposicion_{timezone.now().strftime('%Y%m%d')}.xlsx")
 
     context = {'criticos': criticos}
     return render(request, 'logistica/reporte_reposicion.html', context)
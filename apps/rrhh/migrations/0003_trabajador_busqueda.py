@@ -0,0 +1,60 @@
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalizar_texto(texto):
+    """Copia de apps.rrhh.models.normalizar_texto al crear la columna (la migración no depende del código vivo)."""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    sin_tildes = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    return ' '.join(sin_tildes.upper().split())
+
+
+def poblar_busqueda(apps, schema_editor):
+    Trabajador = apps.get_model('rrhh', 'Trabajador')
+    lote = []
+    for trabajador in Trabajador.objects.only('id', 'nombres', 'apellidos', 'dni').iterator(chunk_size=1000):
+        trabajador.busqueda = normalizar_texto(f"{trabajador.nombres} {trabajador.apellidos} {trabajador.dni}")
+        lote.append(trabajador)
+        if len(lote) >= 1000:
+            Trabajador.objects.bulk_update(lote, ['busqueda'])
+            lote = []
+    if lote:
+        Trabajador.objects.bulk_update(lote, ['busqueda'])
+
+
+def crear_indice(apps, schema_editor):
+    """
+    Índice trigram sobre la columna ya normalizada: sirve tanto para `contains`
+    (LIKE '%texto%') como para prefijos. Solo aplica en PostgreSQL.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS rrhh_trabajador_busqueda_trgm "
+        "ON rrhh_trabajador USING gin (busqueda gin_trgm_ops)"
+    )
+
+
+def eliminar_indice(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS rrhh_trabajador_busqueda_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rrhh', '0002_entregaepp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajador',
+            name='busqueda',
+            field=models.CharField(blank=True, default='', editable=False, max_length=220),
+        ),
+        migrations.RunPython(poblar_busqueda, migrations.RunPython.noop),
+        migrations.RunPython(crear_indice, eliminar_indice),
+    ]
@@ -1,6 +1,15 @@
 from django.db import models
+import unicodedata
 import uuid
 
+
+def normalizar_texto(texto):
+    """Mayúsculas sin tildes ni espacios repetidos: 'José  Núñez' -> 'JOSE NUNEZ'."""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    sin_tildes = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    return ' '.join(sin_tildes.upper().split())
+
+
 class Trabajador(models.Model):
     """
     Personal de obra al que se le asignan activos o EPPs.
@@ -17,9 +26,20 @@ class Trabajador(models.Model):
     
     activo = models.BooleanField(default=True, help_text="¿Sigue trabajando en la empresa?")
 
+    # Columna de búsqueda: "NOMBRES APELLIDOS DNI" normalizado (ver normalizar_texto).
+    # Se mantiene en save() y tiene índice trigram en PostgreSQL (migración 0003).
+    busqueda = models.CharField(max_length=220, blank=True, default='', editable=False)
+
     def __str__(self):
         return f"{self.nombres} {self.apellidos}"
 
+    def save(self, *args, **kwargs):
+        self.busqueda = normalizar_texto(f"{self.nombres} {self.apellidos} {self.dni}")
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'nombres', 'apellidos', 'dni'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'busqueda'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Trabajador"
         verbose_name_plural = "Trabajadores"
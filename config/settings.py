@@ -148,4 +148,20 @@ AUTH_USER_MODEL = 'core.User'
 # Redirecciones de Login
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'login'
-LOGIN_URL = 'login'
\ No newline at end of file
+LOGIN_URL = 'login'
+
+# Invalidación de cachés entre workers (PostgreSQL LISTEN/NOTIFY)
+# Activar en despliegues con varios workers/nodos de gunicorn.
+CACHE_INVALIDACION_LISTENER = env.bool('CACHE_INVALIDACION_LISTENER', default=False)
+CACHE_INVALIDACION_CANAL = env('CACHE_INVALIDACION_CANAL', default='almacen_cache')
+
+# Caché de fragmentos HTML (inventario, movimientos). La clave incluye la versión
+# de datos del almacén, así que un movimiento confirmado la renueva al instante.
+CACHE_FRAGMENTOS_SEGUNDOS = env.int('CACHE_FRAGMENTOS_SEGUNDOS', default=3600)
+
+
+# Caché de reportes gerenciales (consumo por torre, backlog, transacciones).
+# Resultados en la caché de Django y .xlsx en MEDIA_ROOT/reportes_cache/ (purga LRU).
+CACHE_REPORTES_MAX_EDAD = env.int('CACHE_REPORTES_MAX_EDAD', default=7 * 24 * 3600)
+CACHE_REPORTES_MAX_MB = env.int('CACHE_REPORTES_MAX_MB', default=500)
+CACHE_REPORTES_MAX_RESULTADO_KB = env.int('CACHE_REPORTES_MAX_RESULTADO_KB', default=2048)
\ No newline at end of file